@@ -24,18 +24,39 @@ const Endpoint = (props: Props) => {
   const [error, setError] = useState<ErrorDataItem | null>(null);
   const [isLoading, setIsLoading] = useState(false);
 
+  // Report endpoints answer with a job id right away; poll the job until the
+  // report is ready, backing off up to 10s between polls
+  const waitForReport = async (jobId: number) => {
+    let delay = 1000;
+    for (;;) {
+      await new Promise((resolve) => setTimeout(resolve, delay));
+      const response = await fetch(`/api/report_jobs/${jobId}`, { method: "GET" });
+      const data = await response.json();
+      if (data.status !== "pending") {
+        return data;
+      }
+      delay = Math.min(delay * 2, 10000);
+    }
+  };
+
   const getData = async () => {
     setIsLoading(true);
     const response = await fetch(`/api/${props.endpoint}`, { method: "GET" });
-    const data = await response.json();
+    let data = await response.json();
+    if (data.job_id != null && data.status === "pending") {
+      data = await waitForReport(data.job_id);
+    }
     if (data.error != null) {
       setError(data.error);
       setIsLoading(false);
       return;
     }
     setTransformedData(props.transformData(data)); // transform data into proper format for each individual product
-    if (data.pdf != null) {
-      setPdf(data.pdf);
+    // Backends either link a streamed download or embed the PDF as base64
+    if (data.pdf_url != null) {
+      setPdf(data.pdf_url);
+    } else if (data.pdf != null) {
+      setPdf(`data:application/pdf;base64,${data.pdf}`);
     }
     setShowTable(true);
     setIsLoading(false);
@@ -86,7 +107,7 @@ const Endpoint = (props: Props) => {
               centered
               wide
               className={styles.pdf}
-              href={`data:application/pdf;base64,${pdf}`}
+              href={pdf}
               componentProps={{ download: getPdfName()}}
             >
               Download PDF
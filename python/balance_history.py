@@ -0,0 +1,224 @@
+"""
+Change-only balance history with daily and weekly rollups.
+
+A raw snapshot is only added to account_balance_history when the current,
+available or limit balance differs from the account's latest snapshot.
+Every observation also maintains one row per account per day in
+account_balance_daily and per week in account_balance_weekly, holding the
+open/close/min/max current balance for that period. Balance charts read the
+rollups, so raw snapshots only need to be kept for
+BALANCE_HISTORY_RETENTION_DAYS (default 90) and are pruned by
+`etl.py balance_history_maintenance`.
+
+account_balance_history is partitioned by recorded_at (see partitions.py),
+with a BRIN index on recorded_at for time ranges and a B-tree on
+(account_id, recorded_at DESC) for per-account and latest-balance lookups.
+Partitions emptied by pruning are dropped.
+
+Usage:
+    balance_history.record_balance(cur, account_id, account['balances'])
+    conn.commit()
+
+    balance_history.get_rollups(conn, account_id, 'day', start_date, end_date)
+    balance_history.get_snapshots(conn, account_id, start_date, end_date)
+    balance_history.get_latest_balances(conn, item_id)
+"""
+
+import os
+from datetime import date, timedelta
+
+import partitions
+
+# Rollup granularity -> table
+ROLLUP_TABLES = {
+    'day': 'account_balance_daily',
+    'week': 'account_balance_weekly',
+}
+
+DEFAULT_RETENTION_DAYS = 90
+
+
+def record_balance(cur, account_id, balances):
+    """Record one balance observation; returns True if a raw snapshot was added.
+
+    The caller commits.
+    """
+    current = balances.get('current')
+    available = balances.get('available')
+    limit = balances.get('limit')
+    currency = balances.get('iso_currency_code')
+
+    cur.execute('''
+        INSERT INTO account_balance_history (
+            account_id, current_balance, available_balance, limit_amount, iso_currency_code
+        )
+        SELECT %(account_id)s, %(current)s, %(available)s, %(limit)s, %(currency)s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM (
+                SELECT current_balance, available_balance, limit_amount
+                FROM account_balance_history
+                WHERE account_id = %(account_id)s
+                ORDER BY recorded_at DESC
+                LIMIT 1
+            ) latest
+            WHERE latest.current_balance IS NOT DISTINCT FROM %(current)s::DECIMAL(15, 2)
+              AND latest.available_balance IS NOT DISTINCT FROM %(available)s::DECIMAL(15, 2)
+              AND latest.limit_amount IS NOT DISTINCT FROM %(limit)s::DECIMAL(15, 2)
+        )
+    ''', {
+        'account_id': account_id,
+        'current': current,
+        'available': available,
+        'limit': limit,
+        'currency': currency,
+    })
+    recorded = cur.rowcount == 1
+
+    for granularity, table in ROLLUP_TABLES.items():
+        # Only touches the rollup row when the period is new or the balance moved
+        cur.execute(f'''
+            INSERT INTO {table} AS rollup (
+                account_id, period_start, open_balance, close_balance,
+                min_balance, max_balance, available_balance, iso_currency_code
+            ) VALUES (
+                %(account_id)s, date_trunc(%(granularity)s, CURRENT_TIMESTAMP)::date,
+                %(current)s, %(current)s, %(current)s, %(current)s, %(available)s, %(currency)s
+            )
+            ON CONFLICT (account_id, period_start) DO UPDATE SET
+                close_balance = EXCLUDED.close_balance,
+                min_balance = LEAST(rollup.min_balance, EXCLUDED.min_balance),
+                max_balance = GREATEST(rollup.max_balance, EXCLUDED.max_balance),
+                available_balance = EXCLUDED.available_balance,
+                iso_currency_code = EXCLUDED.iso_currency_code,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE rollup.close_balance IS DISTINCT FROM EXCLUDED.close_balance
+               OR rollup.available_balance IS DISTINCT FROM EXCLUDED.available_balance
+        ''', {
+            'account_id': account_id,
+            'granularity': granularity,
+            'current': current,
+            'available': available,
+            'currency': currency,
+        })
+
+    return recorded
+
+
+def backfill_rollups(conn):
+    """Build rollup rows for periods only present in raw history, e.g. after upgrading.
+
+    Only snapshots of periods without a rollup row are aggregated; periods
+    record_balance already maintains are skipped rather than recomputed.
+    """
+    cur = conn.cursor()
+    inserted = 0
+    for granularity, table in ROLLUP_TABLES.items():
+        cur.execute(f'''
+            INSERT INTO {table} (
+                account_id, period_start, open_balance, close_balance,
+                min_balance, max_balance, available_balance, iso_currency_code
+            )
+            SELECT
+                account_id,
+                date_trunc(%(granularity)s, recorded_at)::date AS period_start,
+                (array_agg(current_balance ORDER BY recorded_at))[1],
+                (array_agg(current_balance ORDER BY recorded_at DESC))[1],
+                MIN(current_balance),
+                MAX(current_balance),
+                (array_agg(available_balance ORDER BY recorded_at DESC))[1],
+                (array_agg(iso_currency_code ORDER BY recorded_at DESC))[1]
+            FROM account_balance_history history
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {table} rollup
+                WHERE rollup.account_id = history.account_id
+                  AND rollup.period_start = date_trunc(%(granularity)s, history.recorded_at)::date
+            )
+            GROUP BY account_id, period_start
+            ON CONFLICT (account_id, period_start) DO NOTHING
+        ''', {'granularity': granularity})
+        inserted += cur.rowcount
+    conn.commit()
+    cur.close()
+    return inserted
+
+
+def prune_snapshots(conn, retention_days=None):
+    """Delete raw snapshots past retention, keeping each account's latest one.
+
+    The latest snapshot is the baseline for change detection, so it is never
+    pruned however old it is.
+    """
+    if retention_days is None:
+        retention_days = int(os.getenv('BALANCE_HISTORY_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+
+    cur = conn.cursor()
+    cur.execute('''
+        DELETE FROM account_balance_history history
+        WHERE history.recorded_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+          AND history.id <> (
+              SELECT latest.id FROM account_balance_history latest
+              WHERE latest.account_id = history.account_id
+              ORDER BY latest.recorded_at DESC
+              LIMIT 1
+          )
+    ''', (retention_days,))
+    deleted = cur.rowcount
+    conn.commit()
+    cur.close()
+
+    partitions.drop_empty_partitions(
+        conn, partitions.BALANCE_HISTORY, date.today() - timedelta(days=retention_days))
+    return deleted
+
+
+def get_rollups(conn, account_id, granularity, start_date, end_date):
+    """Rollup rows for one account between two dates, oldest first"""
+    table = ROLLUP_TABLES[granularity]
+    cur = conn.cursor()
+    cur.execute(f'''
+        SELECT period_start, open_balance, close_balance, min_balance, max_balance,
+               available_balance, iso_currency_code
+        FROM {table}
+        WHERE account_id = %s AND period_start BETWEEN %s AND %s
+        ORDER BY period_start
+    ''', (account_id, start_date, end_date))
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+def get_snapshots(conn, account_id, start_date, end_date, limit=None):
+    """Raw snapshots for one account between two dates (inclusive), oldest first"""
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT recorded_at, current_balance, available_balance, limit_amount, iso_currency_code
+        FROM account_balance_history
+        WHERE account_id = %s AND recorded_at >= %s AND recorded_at < %s
+        ORDER BY recorded_at
+        LIMIT %s
+    ''', (account_id, start_date, end_date + timedelta(days=1), limit))
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+def get_latest_balances(conn, item_id=None):
+    """The most recent snapshot of every account, optionally for one item"""
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT a.account_id, latest.recorded_at, latest.current_balance,
+               latest.available_balance, latest.limit_amount, latest.iso_currency_code
+        FROM financial_accounts a
+        CROSS JOIN LATERAL (
+            SELECT recorded_at, current_balance, available_balance, limit_amount, iso_currency_code
+            FROM account_balance_history h
+            WHERE h.account_id = a.account_id
+            ORDER BY h.recorded_at DESC
+            LIMIT 1
+        ) latest
+        WHERE %(item_id)s::VARCHAR IS NULL OR a.item_id = %(item_id)s
+        ORDER BY a.account_id
+    ''', {'item_id': item_id})
+    rows = cur.fetchall()
+    cur.close()
+    return rows
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for server.py.
+
+Imports the app in a fresh interpreter, once per run for each PLAID_PRODUCTS
+configuration, and reports the median import time, the resident memory of
+the process afterwards (what every gunicorn worker starts from) and how many
+routes and plaid.model modules were loaded. Importing the app does not
+connect to the database or to Plaid.
+
+Usage:
+    python bench_startup.py
+    python bench_startup.py --runs 10 --products transactions --products transactions,auth,identity
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_RUNS = 5
+
+DEFAULT_CONFIGS = [
+    'transactions',
+    'transactions,auth,identity,investments',
+    'auth,transactions,identity,assets,investments,transfer,statements,signal',
+    'cra_base_report,cra_income_insights,cra_partner_insights',
+    'payment_initiation',
+]
+
+
+def rss_kb():
+    """Current resident set size in kB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # No /proc (macOS): fall back to the peak, reported in bytes there
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def measure_import():
+    """Import the app in this process and return its startup figures"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    rss_before = rss_kb()
+    start = time.perf_counter()
+    import server
+    elapsed = time.perf_counter() - start
+    rss_after = rss_kb()
+    return {
+        'import_seconds': elapsed,
+        'rss_mb': rss_after / 1024,
+        'import_rss_mb': (rss_after - rss_before) / 1024,
+        'routes': len([rule for rule in server.app.url_map.iter_rules() if rule.endpoint != 'static']),
+        'blueprints': sorted(server.app.blueprints),
+        'plaid_models': len([name for name in sys.modules if name.startswith('plaid.model.')]),
+        'modules': len(sys.modules),
+    }
+
+
+def run_once(products):
+    env = dict(os.environ, PLAID_PRODUCTS=products)
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child'],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    # The app may print while importing; the figures are the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def benchmark(products, runs):
+    results = [run_once(products) for _ in range(runs)]
+    return {
+        'products': products,
+        'runs': runs,
+        'import_seconds': round(statistics.median(r['import_seconds'] for r in results), 3),
+        'rss_mb': round(statistics.median(r['rss_mb'] for r in results), 1),
+        'import_rss_mb': round(statistics.median(r['import_rss_mb'] for r in results), 1),
+        'routes': results[-1]['routes'],
+        'blueprints': results[-1]['blueprints'],
+        'plaid_models': results[-1]['plaid_models'],
+        'modules': results[-1]['modules'],
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Measure server.py import time and memory')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS)
+    parser.add_argument('--products', action='append',
+                        help='Comma separated PLAID_PRODUCTS to measure; repeatable')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    if args.child:
+        print(json.dumps(measure_import()))
+        return
+
+    print(f"{'PLAID_PRODUCTS':<45} {'import s':>9} {'RSS MB':>8} {'import MB':>10} {'routes':>7} {'models':>7}")
+    for products in args.products or DEFAULT_CONFIGS:
+        result = benchmark(products, max(1, args.runs))
+        print(f"{products[:45]:<45} {result['import_seconds']:>9} {result['rss_mb']:>8} "
+              f"{result['import_rss_mb']:>10} {result['routes']:>7} {result['plaid_models']:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""
+Shared PostgreSQL connection pool for the server and the ETL jobs.
+
+Connections are opened once and reused instead of paying a TLS and auth
+handshake for every request and every item. Configuration is read from the
+environment the first time the pool is used:
+
+    DB_POOL_MIN_SIZE        Connections opened up front (default 1)
+    DB_POOL_MAX_SIZE        Maximum open connections (default 10)
+    DB_POOL_TIMEOUT         Seconds to wait for a free connection (default 30)
+    DB_POOL_MAX_LIFETIME    Seconds before a connection is replaced (default 3600)
+    DB_POOL_HEALTH_CHECK    Run SELECT 1 on checkout, 'true' or 'false' (default true)
+
+Usage:
+    conn = db_pool.getconn()
+    try:
+        ...
+    finally:
+        db_pool.putconn(conn)
+
+    with db_pool.connection() as conn:
+        ...
+
+    db_pool.pool_stats()  # in use, idle, waiting, checkout latency, ...
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the checkout timeout"""
+
+
+class ConnectionPool:
+    """Thread-safe pool with checkout health checks and connection recycling"""
+
+    def __init__(self, min_size=1, max_size=10, timeout=30.0, max_lifetime=3600.0,
+                 health_check=True, **connect_kwargs):
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check = health_check
+        self.connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._created_at = {}
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._connections_created = 0
+        self._connections_closed = 0
+        self._health_check_failures = 0
+
+        for _ in range(self.min_size):
+            conn = self._connect()
+            with self._cond:
+                self._size += 1
+                self._idle.append(conn)
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+            self._connections_created += 1
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._created_at.pop(id(conn), None)
+            self._connections_closed += 1
+
+    def _discard(self, conn):
+        """Close a connection and give its slot back to the pool"""
+        self._close(conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _expired(self, conn):
+        created_at = self._created_at.get(id(conn))
+        return (
+            self.max_lifetime is not None
+            and created_at is not None
+            and time.monotonic() - created_at > self.max_lifetime
+        )
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if not self.health_check:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            with self._cond:
+                self._health_check_failures += 1
+            return False
+
+    def getconn(self):
+        """Check out a connection, waiting up to `timeout` seconds for one"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        # Reserve a slot and connect outside the lock
+                        self._size += 1
+                        conn = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"No database connection available after {self.timeout}s "
+                            f"(max_size={self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+        if conn is not None and (self._expired(conn) or not self._healthy(conn)):
+            # Keep the slot and replace the connection
+            self._close(conn)
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool, rolling back any open transaction"""
+        with self._cond:
+            self._in_use -= 1
+
+        if not close and not conn.closed:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+
+        if close or conn.closed or self._expired(conn):
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def ensure_max_size(self, max_size):
+        """Raise max_size so that at least `max_size` connections can be open"""
+        with self._cond:
+            if max_size > self.max_size:
+                self.max_size = max_size
+                self._cond.notify_all()
+
+    def closeall(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'checkout_latency_ms': {
+                    'avg': round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                    'max': round(self._wait_max * 1000, 3),
+                },
+                'connections_created': self._connections_created,
+                'connections_closed': self._connections_closed,
+                'health_check_failures': self._health_check_failures,
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use.
+
+    A pool inherited across fork() is abandoned rather than closed, since
+    closing it would also close the parent's server sessions.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(
+                min_size=int(os.getenv('DB_POOL_MIN_SIZE', '1')),
+                max_size=int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+                timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')),
+                max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', '3600')),
+                health_check=os.getenv('DB_POOL_HEALTH_CHECK', 'true').lower() == 'true',
+                host=os.getenv('POSTGRES_HOST'),
+                port=os.getenv('POSTGRES_PORT', '5432'),
+                database=os.getenv('POSTGRES_DB'),
+                user=os.getenv('POSTGRES_USER'),
+                password=os.getenv('POSTGRES_PASSWORD'),
+                cursor_factory=RealDictCursor
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def getconn():
+    return get_pool().getconn()
+
+
+def putconn(conn, close=False):
+    get_pool().putconn(conn, close=close)
+
+
+@contextmanager
+def connection():
+    conn = getconn()
+    try:
+        yield conn
+    finally:
+        putconn(conn)
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def close_pool():
+    """Close idle connections and drop the pool, e.g. before forking workers"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+        _pool_pid = None
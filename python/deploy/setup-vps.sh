@@ -26,17 +26,24 @@ source venv/bin/activate
 
 # Install Python dependencies
 pip install --upgrade pip
-pip install flask plaid-python python-dotenv psycopg2-binary
+pip install -r requirements.txt psycopg2-binary
 
 # Set permissions
 chmod +x /opt/plaid/*.py
 
-# Setup systemd service
+# Setup systemd service (gunicorn, see gunicorn.conf.py for SERVER_* settings)
 cp /opt/plaid/deploy/plaid-server.service /etc/systemd/system/
 systemctl daemon-reload
 systemctl enable plaid-server
 systemctl start plaid-server
 
+# Setup the ETL daemon (scheduled syncs and the webhook sync job queue, see etl.py);
+# started after the server, which creates the schema
+cp /opt/plaid/deploy/plaid-etl.service /etc/systemd/system/
+systemctl daemon-reload
+systemctl enable plaid-etl
+systemctl start plaid-etl
+
 # Setup nginx
 cp /opt/plaid/deploy/nginx-plaid.conf /etc/nginx/sites-available/plaid
 ln -sf /etc/nginx/sites-available/plaid /etc/nginx/sites-enabled/
@@ -56,7 +63,7 @@ echo ""
 echo "Plaid server running at: https://plaid.benrishty.com"
 echo "Webhook URL: https://plaid.benrishty.com/api/webhook"
 echo ""
-echo "Check status: systemctl status plaid-server"
-echo "View logs: journalctl -u plaid-server -f"
+echo "Check status: systemctl status plaid-server plaid-etl"
+echo "View logs: journalctl -u plaid-server -u plaid-etl -f"
 echo ""
 echo "Configure this webhook URL in your Plaid Dashboard!"
@@ -8,6 +8,18 @@ Usage:
     python etl.py sync_balances      # Sync balances only
     python etl.py sync_accounts      # Sync accounts only
     python etl.py fetch_historical   # Fetch ALL historical transactions (up to 5 years)
+    python etl.py balance_history_maintenance  # Backfill balance rollups and prune old snapshots
+    python etl.py maintain_partitions  # Create upcoming transaction and balance history partitions
+    python etl.py migrate_partitions   # Move unpartitioned transaction/balance history tables over online
+    python etl.py rebuild_spending_aggregates  # Recompute spending aggregates from all transactions
+    python etl.py refresh_institutions  # Refresh stored institution metadata past INSTITUTION_TTL_HOURS
+    python etl.py archive_statements   # Download statements of all items not archived yet
+    python etl.py daemon             # Stay resident and run the jobs on intervals
+    python etl.py queue_worker       # Drain the webhook sync job queue until stopped
+
+Options:
+    --concurrency N                  # Process up to N items in parallel (default: ETL_CONCURRENCY or 1)
+    --resume                         # fetch_historical: continue from the last checkpoints
 
 Schedule with cron:
     # Sync transactions every hour
@@ -15,15 +27,33 @@ Schedule with cron:
 
     # Sync balances daily at 6am
     0 6 * * * cd /path/to/quickstart/python && ./venv/bin/python etl.py sync_balances
+
+Daemon mode:
+    Instead of cron, `etl.py daemon` keeps the Plaid client and the database
+    pool warm and runs each job every ETL_DAEMON_<JOB>_INTERVAL seconds, e.g.
+    ETL_DAEMON_SYNC_TRANSACTIONS_INTERVAL=300. An interval of 0 disables a job.
+    SIGTERM/SIGINT stop it gracefully: items already in progress finish and
+    save their cursors, items not yet started are left for the next run.
+    The daemon also drains the sync job queue with ETL_DAEMON_QUEUE_WORKERS
+    worker threads (default 1, 0 to leave it to a separate queue_worker).
+
+Job queue:
+    Webhooks enqueue jobs in the sync_jobs table instead of syncing inline.
+    `etl.py queue_worker --concurrency N` drains it with N workers, retrying
+    failed jobs with backoff and dead-lettering them after
+    JOB_QUEUE_MAX_ATTEMPTS attempts (see job_queue.py). The workers also poll
+    the asset and Plaid Check reports started by the server (see report_jobs.py).
 """
 
 import os
 import sys
 import json
 import time
+import argparse
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 import plaid
 from plaid.api import plaid_api
@@ -36,6 +66,19 @@ from plaid.model.transactions_get_request import TransactionsGetRequest
 from plaid.model.item_get_request import ItemGetRequest
 from plaid.model.institutions_get_by_id_request import InstitutionsGetByIdRequest
 from datetime import date, timedelta
+from transaction_writer import TransactionBatchWriter, StagedTransactionSync
+import db_pool
+import rate_limiter
+from row_hash import content_hash
+import balance_history
+import partitions
+import job_queue
+import report_jobs
+import item_lock
+import spending_aggregates
+import institutions
+import historical_checkpoints
+import statement_archive
 
 # Load environment variables
 load_dotenv()
@@ -46,12 +89,6 @@ PLAID_SECRET = os.getenv('PLAID_SECRET')
 PLAID_ENV = os.getenv('PLAID_ENV', 'sandbox')
 PLAID_COUNTRY_CODES = os.getenv('PLAID_COUNTRY_CODES', 'US').split(',')
 
-POSTGRES_HOST = os.getenv('POSTGRES_HOST')
-POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
-POSTGRES_DB = os.getenv('POSTGRES_DB')
-POSTGRES_USER = os.getenv('POSTGRES_USER')
-POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
-
 # Email settings for notifications
 EMAIL_ENABLED = os.getenv('EMAIL_ENABLED', 'false').lower() == 'true'
 SMTP_HOST = os.getenv('SMTP_HOST')
@@ -61,6 +98,16 @@ SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
 FROM_EMAIL = os.getenv('FROM_EMAIL')
 TO_EMAILS = os.getenv('TO_EMAILS', '').split(',')
 
+# Number of items processed in parallel by each job
+ETL_CONCURRENCY = int(os.getenv('ETL_CONCURRENCY', '1'))
+
+# Historical fetches are split into date windows fetched in parallel
+HISTORICAL_WINDOW_MONTHS = int(os.getenv('HISTORICAL_WINDOW_MONTHS', '1'))
+HISTORICAL_WINDOW_CONCURRENCY = int(os.getenv('HISTORICAL_WINDOW_CONCURRENCY', '4'))
+
+# Set when the daemon is asked to stop; jobs stop picking up new items
+shutdown_event = threading.Event()
+
 # Initialize Plaid client
 host = plaid.Environment.Sandbox
 if PLAID_ENV == 'production':
@@ -75,7 +122,7 @@ configuration = plaid.Configuration(
     }
 )
 api_client = plaid.ApiClient(configuration)
-plaid_client = plaid_api.PlaidApi(api_client)
+plaid_client = rate_limiter.RateLimitedPlaidApi(plaid_api.PlaidApi(api_client))
 
 
 class ETLLogger:
@@ -84,12 +131,14 @@ class ETLLogger:
         self.job_name = job_name
         self.start_time = datetime.now()
         self.logs = []
+        self._lock = threading.RLock()
 
     def log(self, message, level='INFO'):
         timestamp = datetime.now().isoformat()
         log_entry = f"[{timestamp}] [{level}] [{self.job_name}] {message}"
-        self.logs.append(log_entry)
-        print(log_entry)
+        with self._lock:
+            self.logs.append(log_entry)
+            print(log_entry)
 
     def error(self, message):
         self.log(message, 'ERROR')
@@ -100,20 +149,20 @@ class ETLLogger:
             'job_name': self.job_name,
             'start_time': self.start_time.isoformat(),
             'duration_seconds': duration,
+            'db_pool': db_pool.pool_stats(),
+            'rate_limiter': rate_limiter.limiter_stats(),
             'logs': self.logs
         }
 
 
 def get_db_connection():
-    """Create a new database connection"""
-    return psycopg2.connect(
-        host=POSTGRES_HOST,
-        port=POSTGRES_PORT,
-        database=POSTGRES_DB,
-        user=POSTGRES_USER,
-        password=POSTGRES_PASSWORD,
-        cursor_factory=RealDictCursor
-    )
+    """Check out a connection from the shared pool"""
+    return db_pool.getconn()
+
+
+def release_db_connection(conn):
+    """Return a connection to the shared pool"""
+    db_pool.putconn(conn)
 
 
 def get_all_items():
@@ -123,7 +172,7 @@ def get_all_items():
     cur.execute('SELECT item_id, access_token FROM plaid_items')
     items = cur.fetchall()
     cur.close()
-    conn.close()
+    release_db_connection(conn)
     return items
 
 
@@ -136,22 +185,8 @@ def get_sync_cursor(conn, item_id):
     return result['cursor'] if result else ''
 
 
-def save_sync_cursor(conn, item_id, cursor):
-    """Save sync cursor for an item"""
-    cur = conn.cursor()
-    cur.execute('''
-        INSERT INTO sync_cursors (item_id, cursor, last_synced_at)
-        VALUES (%s, %s, CURRENT_TIMESTAMP)
-        ON CONFLICT (item_id) DO UPDATE SET
-            cursor = EXCLUDED.cursor,
-            last_synced_at = CURRENT_TIMESTAMP
-    ''', (item_id, cursor))
-    conn.commit()
-    cur.close()
-
-
 def save_account(conn, account_data, item_id):
-    """Save account data to database"""
+    """Save account data to database, returning False if it was unchanged"""
     cur = conn.cursor()
     balances = account_data.get('balances', {})
 
@@ -159,8 +194,9 @@ def save_account(conn, account_data, item_id):
         INSERT INTO financial_accounts (
             account_id, item_id, name, official_name, type, subtype, mask,
             current_balance, available_balance, limit_amount,
-            iso_currency_code, unofficial_currency_code, persistent_account_id, raw_data
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            iso_currency_code, unofficial_currency_code, persistent_account_id, raw_data,
+            content_hash
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         ON CONFLICT (account_id) DO UPDATE SET
             name = EXCLUDED.name,
             official_name = EXCLUDED.official_name,
@@ -174,7 +210,9 @@ def save_account(conn, account_data, item_id):
             unofficial_currency_code = EXCLUDED.unofficial_currency_code,
             persistent_account_id = EXCLUDED.persistent_account_id,
             raw_data = EXCLUDED.raw_data,
+            content_hash = EXCLUDED.content_hash,
             updated_at = CURRENT_TIMESTAMP
+        WHERE financial_accounts.content_hash IS DISTINCT FROM EXCLUDED.content_hash
     ''', (
         account_data.get('account_id'),
         item_id,
@@ -189,122 +227,22 @@ def save_account(conn, account_data, item_id):
         balances.get('iso_currency_code'),
         balances.get('unofficial_currency_code'),
         account_data.get('persistent_account_id'),
-        json.dumps(account_data, default=str)
+        json.dumps(account_data, default=str),
+        content_hash(account_data)
     ))
+    written = cur.rowcount == 1
     conn.commit()
     cur.close()
+    return written
 
 
 def save_balance_history(conn, account_id, balances):
-    """Save balance snapshot to history table"""
+    """Record a balance snapshot if the balance changed, and update the rollups"""
     cur = conn.cursor()
-    cur.execute('''
-        INSERT INTO account_balance_history (
-            account_id, current_balance, available_balance, limit_amount, iso_currency_code
-        ) VALUES (%s, %s, %s, %s, %s)
-    ''', (
-        account_id,
-        balances.get('current'),
-        balances.get('available'),
-        balances.get('limit'),
-        balances.get('iso_currency_code')
-    ))
-    conn.commit()
-    cur.close()
-
-
-def save_transaction(conn, txn_data):
-    """Save transaction data to database"""
-    cur = conn.cursor()
-
-    location = txn_data.get('location', {}) or {}
-    payment_meta = txn_data.get('payment_meta', {}) or {}
-    personal_finance_category = txn_data.get('personal_finance_category', {}) or {}
-
-    cur.execute('''
-        INSERT INTO financial_transactions (
-            transaction_id, account_id, amount, iso_currency_code, unofficial_currency_code,
-            date, datetime, authorized_date, authorized_datetime,
-            name, merchant_name, merchant_entity_id, logo_url, website,
-            payment_channel, pending, pending_transaction_id, account_owner,
-            transaction_code, transaction_type, category_id,
-            personal_finance_category_primary, personal_finance_category_detailed,
-            personal_finance_category_confidence, personal_finance_category_icon_url,
-            location_address, location_city, location_region, location_postal_code,
-            location_country, location_lat, location_lon, location_store_number,
-            payment_meta_reference_number, payment_meta_ppd_id, payment_meta_payee,
-            payment_meta_by_order_of, payment_meta_payer, payment_meta_payment_method,
-            payment_meta_payment_processor, payment_meta_reason,
-            counterparties, raw_data
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-            %s, %s, %s, %s, %s, %s, %s
-        )
-        ON CONFLICT (transaction_id) DO UPDATE SET
-            amount = EXCLUDED.amount,
-            name = EXCLUDED.name,
-            merchant_name = EXCLUDED.merchant_name,
-            pending = EXCLUDED.pending,
-            personal_finance_category_primary = EXCLUDED.personal_finance_category_primary,
-            personal_finance_category_detailed = EXCLUDED.personal_finance_category_detailed,
-            raw_data = EXCLUDED.raw_data,
-            updated_at = CURRENT_TIMESTAMP
-    ''', (
-        txn_data.get('transaction_id'),
-        txn_data.get('account_id'),
-        txn_data.get('amount'),
-        txn_data.get('iso_currency_code'),
-        txn_data.get('unofficial_currency_code'),
-        txn_data.get('date'),
-        txn_data.get('datetime'),
-        txn_data.get('authorized_date'),
-        txn_data.get('authorized_datetime'),
-        txn_data.get('name'),
-        txn_data.get('merchant_name'),
-        txn_data.get('merchant_entity_id'),
-        txn_data.get('logo_url'),
-        txn_data.get('website'),
-        txn_data.get('payment_channel'),
-        txn_data.get('pending'),
-        txn_data.get('pending_transaction_id'),
-        txn_data.get('account_owner'),
-        txn_data.get('transaction_code'),
-        txn_data.get('transaction_type'),
-        txn_data.get('category_id'),
-        personal_finance_category.get('primary'),
-        personal_finance_category.get('detailed'),
-        personal_finance_category.get('confidence_level'),
-        personal_finance_category.get('icon_url'),
-        location.get('address'),
-        location.get('city'),
-        location.get('region'),
-        location.get('postal_code'),
-        location.get('country'),
-        location.get('lat'),
-        location.get('lon'),
-        location.get('store_number'),
-        payment_meta.get('reference_number'),
-        payment_meta.get('ppd_id'),
-        payment_meta.get('payee'),
-        payment_meta.get('by_order_of'),
-        payment_meta.get('payer'),
-        payment_meta.get('payment_method'),
-        payment_meta.get('payment_processor'),
-        payment_meta.get('reason'),
-        json.dumps(txn_data.get('counterparties'), default=str) if txn_data.get('counterparties') else None,
-        json.dumps(txn_data, default=str)
-    ))
-    conn.commit()
-    cur.close()
-
-
-def delete_transaction(conn, transaction_id):
-    """Delete a transaction from the database"""
-    cur = conn.cursor()
-    cur.execute('DELETE FROM financial_transactions WHERE transaction_id = %s', (transaction_id,))
+    recorded = balance_history.record_balance(cur, account_id, balances)
     conn.commit()
     cur.close()
+    return recorded
 
 
 def send_notification(subject, body):
@@ -333,36 +271,53 @@ def send_notification(subject, body):
         print(f"Failed to send notification: {e}")
 
 
+_SKIPPED = object()
+
+
+def run_for_items(items, worker, concurrency=1):
+    """Run worker(item) for every item, at most `concurrency` at a time.
+
+    Results are returned in item order. Workers handle their own errors, so a
+    failing item never stops the others. Each worker opens its own database
+    connection; the Plaid client is safe to share between threads. Once a
+    shutdown is requested, items that have not started yet are skipped.
+    """
+    def run(item):
+        if shutdown_event.is_set():
+            return _SKIPPED
+        return worker(item)
+
+    if concurrency <= 1 or len(items) <= 1:
+        results = [run(item) for item in items]
+    else:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(items))) as executor:
+            results = list(executor.map(run, items))
+
+    return [result for result in results if result is not _SKIPPED]
+
+
 # ============================================
 # ETL Jobs
 # ============================================
 
-def sync_transactions():
-    """Sync transactions for all items"""
-    logger = ETLLogger('sync_transactions')
-    logger.log("Starting transaction sync")
-
-    items = get_all_items()
-    logger.log(f"Found {len(items)} items to sync")
-
-    total_added = 0
-    total_modified = 0
-    total_removed = 0
+def run_item_transaction_sync(item, logger):
+    """Sync transactions for a single item, raising on failure"""
+    item_id = item['item_id']
+    access_token = item['access_token']
+    logger.log(f"Syncing transactions for item: {item_id}")
 
-    for item in items:
-        item_id = item['item_id']
-        access_token = item['access_token']
-        logger.log(f"Syncing transactions for item: {item_id}")
+    conn = get_db_connection()
 
-        conn = get_db_connection()
-        cursor = get_sync_cursor(conn, item_id)
+    try:
+        # Held for the whole sync so the server and other jobs cannot race on the cursor
+        with item_lock.item_sync_lock(conn, item_id):
+            cursor = get_sync_cursor(conn, item_id)
 
-        added = []
-        modified = []
-        removed = []
-        has_more = True
+            # Each page is staged as it arrives and promoted with the cursor at the end
+            staged = StagedTransactionSync(conn, item_id)
+            has_more = True
 
-        try:
+            staged.reset()
             while has_more:
                 txn_request = TransactionsSyncRequest(
                     access_token=access_token,
@@ -375,37 +330,55 @@ def sync_transactions():
                     time.sleep(2)
                     continue
 
-                added.extend(response['added'])
-                modified.extend(response['modified'])
-                removed.extend(response['removed'])
+                staged.stage_page(response)
                 has_more = response['has_more']
 
-            # Save to database
-            for txn in added:
-                save_transaction(conn, txn)
-            for txn in modified:
-                save_transaction(conn, txn)
-            for txn in removed:
-                delete_transaction(conn, txn['transaction_id'])
+            # Apply staged pages and save cursor in one transaction
+            staged.promote(cursor)
 
-            # Save cursor
-            if cursor:
-                save_sync_cursor(conn, item_id, cursor)
+            logger.log(f"Item {item_id}: +{staged.added} added, ~{staged.modified} modified, -{staged.removed} removed ({staged.written} written, {staged.skipped} unchanged)")
+            return {
+                'added': staged.added,
+                'modified': staged.modified,
+                'removed': staged.removed,
+                'written': staged.written,
+                'skipped': staged.skipped
+            }
+    finally:
+        release_db_connection(conn)
 
-            total_added += len(added)
-            total_modified += len(modified)
-            total_removed += len(removed)
 
-            logger.log(f"Item {item_id}: +{len(added)} added, ~{len(modified)} modified, -{len(removed)} removed")
+def sync_item_transactions(item, logger):
+    """Sync transactions for a single item, logging failures"""
+    try:
+        return run_item_transaction_sync(item, logger)
+    except item_lock.ItemLockBusy:
+        logger.log(f"Item {item['item_id']}: sync already running elsewhere, skipping")
+    except plaid.ApiException as e:
+        logger.error(f"Plaid API error for item {item['item_id']}: {e}")
+    except Exception as e:
+        logger.error(f"Error syncing item {item['item_id']}: {e}")
 
-        except plaid.ApiException as e:
-            logger.error(f"Plaid API error for item {item_id}: {e}")
-        except Exception as e:
-            logger.error(f"Error syncing item {item_id}: {e}")
-        finally:
-            conn.close()
+    return {'added': 0, 'modified': 0, 'removed': 0, 'written': 0, 'skipped': 0}
 
-    logger.log(f"Transaction sync complete. Total: +{total_added} added, ~{total_modified} modified, -{total_removed} removed")
+
+def sync_transactions(concurrency=ETL_CONCURRENCY):
+    """Sync transactions for all items"""
+    logger = ETLLogger('sync_transactions')
+    logger.log("Starting transaction sync")
+
+    items = get_all_items()
+    logger.log(f"Found {len(items)} items to sync")
+
+    results = run_for_items(items, lambda item: sync_item_transactions(item, logger), concurrency)
+
+    total_added = sum(result['added'] for result in results)
+    total_modified = sum(result['modified'] for result in results)
+    total_removed = sum(result['removed'] for result in results)
+    total_written = sum(result['written'] for result in results)
+    total_skipped = sum(result['skipped'] for result in results)
+
+    logger.log(f"Transaction sync complete. Total: +{total_added} added, ~{total_modified} modified, -{total_removed} removed ({total_written} written, {total_skipped} unchanged)")
 
     # Send notification
     if total_added > 0 or total_modified > 0 or total_removed > 0:
@@ -417,7 +390,37 @@ def sync_transactions():
     return logger.get_summary()
 
 
-def sync_balances():
+def sync_item_balances(item, logger):
+    """Sync balances for a single item, returning (accounts updated, rows written)"""
+    item_id = item['item_id']
+    access_token = item['access_token']
+    logger.log(f"Syncing balances for item: {item_id}")
+
+    conn = get_db_connection()
+
+    try:
+        balance_request = AccountsBalanceGetRequest(access_token=access_token)
+        response = plaid_client.accounts_balance_get(balance_request).to_dict()
+
+        written = 0
+        for account in response['accounts']:
+            written += save_account(conn, account, item_id)
+            save_balance_history(conn, account['account_id'], account.get('balances', {}))
+
+        logger.log(f"Item {item_id}: Updated {len(response['accounts'])} accounts ({written} written, {len(response['accounts']) - written} unchanged)")
+        return len(response['accounts']), written
+
+    except plaid.ApiException as e:
+        logger.error(f"Plaid API error for item {item_id}: {e}")
+    except Exception as e:
+        logger.error(f"Error syncing item {item_id}: {e}")
+    finally:
+        release_db_connection(conn)
+
+    return 0, 0
+
+
+def sync_balances(concurrency=ETL_CONCURRENCY):
     """Sync account balances for all items"""
     logger = ETLLogger('sync_balances')
     logger.log("Starting balance sync")
@@ -425,39 +428,45 @@ def sync_balances():
     items = get_all_items()
     logger.log(f"Found {len(items)} items to sync")
 
-    total_accounts = 0
+    results = run_for_items(items, lambda item: sync_item_balances(item, logger), concurrency)
+    total_accounts = sum(accounts for accounts, _ in results)
+    total_written = sum(written for _, written in results)
 
-    for item in items:
-        item_id = item['item_id']
-        access_token = item['access_token']
-        logger.log(f"Syncing balances for item: {item_id}")
+    logger.log(f"Balance sync complete. Updated {total_accounts} accounts ({total_written} written, {total_accounts - total_written} unchanged)")
 
-        conn = get_db_connection()
+    return logger.get_summary()
 
-        try:
-            balance_request = AccountsBalanceGetRequest(access_token=access_token)
-            response = plaid_client.accounts_balance_get(balance_request).to_dict()
 
-            for account in response['accounts']:
-                save_account(conn, account, item_id)
-                save_balance_history(conn, account['account_id'], account.get('balances', {}))
-                total_accounts += 1
+def sync_item_accounts(item, logger):
+    """Sync accounts for a single item, returning (accounts synced, rows written)"""
+    item_id = item['item_id']
+    access_token = item['access_token']
+    logger.log(f"Syncing accounts for item: {item_id}")
 
-            logger.log(f"Item {item_id}: Updated {len(response['accounts'])} accounts")
+    conn = get_db_connection()
 
-        except plaid.ApiException as e:
-            logger.error(f"Plaid API error for item {item_id}: {e}")
-        except Exception as e:
-            logger.error(f"Error syncing item {item_id}: {e}")
-        finally:
-            conn.close()
+    try:
+        accounts_request = AccountsGetRequest(access_token=access_token)
+        response = plaid_client.accounts_get(accounts_request).to_dict()
 
-    logger.log(f"Balance sync complete. Updated {total_accounts} accounts")
+        written = 0
+        for account in response['accounts']:
+            written += save_account(conn, account, item_id)
 
-    return logger.get_summary()
+        logger.log(f"Item {item_id}: Synced {len(response['accounts'])} accounts ({written} written, {len(response['accounts']) - written} unchanged)")
+        return len(response['accounts']), written
+
+    except plaid.ApiException as e:
+        logger.error(f"Plaid API error for item {item_id}: {e}")
+    except Exception as e:
+        logger.error(f"Error syncing item {item_id}: {e}")
+    finally:
+        release_db_connection(conn)
 
+    return 0, 0
 
-def sync_accounts():
+
+def sync_accounts(concurrency=ETL_CONCURRENCY):
     """Sync account information for all items"""
     logger = ETLLogger('sync_accounts')
     logger.log("Starting account sync")
@@ -465,125 +474,319 @@ def sync_accounts():
     items = get_all_items()
     logger.log(f"Found {len(items)} items to sync")
 
-    total_accounts = 0
+    results = run_for_items(items, lambda item: sync_item_accounts(item, logger), concurrency)
+    total_accounts = sum(accounts for accounts, _ in results)
+    total_written = sum(written for _, written in results)
 
-    for item in items:
-        item_id = item['item_id']
-        access_token = item['access_token']
-        logger.log(f"Syncing accounts for item: {item_id}")
+    logger.log(f"Account sync complete. Synced {total_accounts} accounts ({total_written} written, {total_accounts - total_written} unchanged)")
 
-        conn = get_db_connection()
+    return logger.get_summary()
 
-        try:
-            accounts_request = AccountsGetRequest(access_token=access_token)
-            response = plaid_client.accounts_get(accounts_request).to_dict()
 
-            for account in response['accounts']:
-                save_account(conn, account, item_id)
-                total_accounts += 1
+def date_windows(start_date, end_date, months=1):
+    """Split [start_date, end_date] into consecutive windows aligned to calendar months"""
+    windows = []
+    window_start = start_date
+    while window_start <= end_date:
+        month_index = window_start.month - 1 + months
+        next_start = date(window_start.year + month_index // 12, month_index % 12 + 1, 1)
+        windows.append((window_start, min(next_start - timedelta(days=1), end_date)))
+        window_start = next_start
+    return windows
 
-            logger.log(f"Item {item_id}: Synced {len(response['accounts'])} accounts")
 
-        except plaid.ApiException as e:
-            logger.error(f"Plaid API error for item {item_id}: {e}")
-        except Exception as e:
-            logger.error(f"Error syncing item {item_id}: {e}")
-        finally:
-            conn.close()
+class WindowFetchError(Exception):
+    """A date window failed part way; the `fetched` rows before the failure were committed"""
 
-    logger.log(f"Account sync complete. Synced {total_accounts} accounts")
+    def __init__(self, start_date, end_date, fetched, error):
+        super().__init__(f"{start_date}..{end_date} failed after {fetched} transactions: {error}")
+        self.fetched = fetched
 
-    return logger.get_summary()
 
+def fetch_transactions_window(item_id, access_token, start_date, end_date, offset, logger):
+    """Fetch one date window with its own offset pagination, returning the number fetched.
 
-def fetch_historical_transactions(years_back=5):
+    Each page is committed together with the window's checkpoint. On failure
+    raises WindowFetchError with the number committed before it.
+    """
+    conn = get_db_connection()
+    writer = TransactionBatchWriter(conn)
+
+    try:
+        count = 500  # Max per request
+        window_total = 0
+
+        while True:
+            txn_request = TransactionsGetRequest(
+                access_token=access_token,
+                start_date=start_date,
+                end_date=end_date,
+                options={
+                    'count': count,
+                    'offset': offset
+                }
+            )
+            response = plaid_client.transactions_get(txn_request).to_dict()
+            transactions = response['transactions']
+            total_transactions = response['total_transactions']
+
+            # Save the whole page in one batch, with its checkpoint
+            writer.upsert_many(transactions)
+            writer.flush(commit=False)
+            offset += len(transactions)
+
+            # Check if we've fetched all available transactions
+            completed = not transactions or offset >= total_transactions
+            historical_checkpoints.save_checkpoint(
+                conn, item_id, start_date, end_date, offset, total_transactions, completed)
+            conn.commit()
+            window_total += len(transactions)
+
+            if transactions:
+                logger.log(f"Item {item_id} {start_date}..{end_date}: Fetched {len(transactions)} transactions (offset: {offset}, total available: {total_transactions})")
+
+            if completed:
+                break
+
+            if shutdown_event.is_set():
+                logger.log(f"Item {item_id} {start_date}..{end_date}: Stopping early for shutdown at offset {offset}")
+                break
+
+        if window_total:
+            logger.log(f"Item {item_id} {start_date}..{end_date}: {writer.written} written, {writer.skipped} unchanged")
+        return window_total
+
+    except Exception as e:
+        raise WindowFetchError(start_date, end_date, window_total, e) from e
+    finally:
+        release_db_connection(conn)
+
+
+def fetch_item_historical_transactions(item, logger, years_back=5, resume=False):
+    """Fetch historical transactions for a single item, returning the number fetched.
+
+    The date range is split into HISTORICAL_WINDOW_MONTHS windows which are
+    fetched concurrently, HISTORICAL_WINDOW_CONCURRENCY at a time. With
+    resume=True, completed windows are skipped and partial windows continue
+    from their checkpointed offset. A failed window is logged and left for a
+    --resume run; the others still finish and count. The item's sync lock is
+    held throughout, so the windows cannot race a webhook-triggered sync.
+    """
+    item_id = item['item_id']
+    access_token = item['access_token']
+    logger.log(f"Fetching historical transactions for item: {item_id}")
+
+    # Calculate date range - go back N years
+    end_date = date.today()
+    start_date = end_date - timedelta(days=365 * years_back)
+
+    item_total = 0
+    conn = get_db_connection()
+    try:
+        with item_lock.item_sync_lock(conn, item_id):
+            windows = historical_checkpoints.plan_windows(
+                conn, item_id, date_windows(start_date, end_date, HISTORICAL_WINDOW_MONTHS), resume)
+
+            if not windows:
+                logger.log(f"Item {item_id}: All windows already fetched")
+                return 0
+
+            failed = 0
+            with ThreadPoolExecutor(max_workers=HISTORICAL_WINDOW_CONCURRENCY) as executor:
+                futures = [
+                    executor.submit(fetch_transactions_window, item_id, access_token, window_start, window_end, offset, logger)
+                    for window_start, window_end, offset in windows
+                ]
+                for future in as_completed(futures):
+                    try:
+                        item_total += future.result()
+                    except WindowFetchError as e:
+                        item_total += e.fetched
+                        failed += 1
+                        logger.error(f"Item {item_id} {e}")
+
+            logger.log(f"Item {item_id}: Fetched {item_total} historical transactions across {len(windows)} windows"
+                       f"{f', {failed} failed (rerun with --resume)' if failed else ''}")
+
+    except item_lock.ItemLockBusy:
+        logger.log(f"Item {item_id}: sync already running elsewhere, skipping")
+    except plaid.ApiException as e:
+        logger.error(f"Plaid API error for item {item_id}: {e}")
+    except Exception as e:
+        logger.error(f"Error fetching item {item_id}: {e}")
+    finally:
+        release_db_connection(conn)
+
+    return item_total
+
+
+def fetch_historical_transactions(years_back=5, concurrency=ETL_CONCURRENCY, resume=False):
     """Fetch all historical transactions going back N years using TransactionsGet API"""
     logger = ETLLogger('fetch_historical_transactions')
-    logger.log(f"Starting historical transaction fetch (going back {years_back} years)")
+    logger.log(f"Starting historical transaction fetch (going back {years_back} years{', resuming' if resume else ''})")
 
     items = get_all_items()
     logger.log(f"Found {len(items)} items to fetch")
 
-    total_fetched = 0
+    total_fetched = sum(run_for_items(
+        items,
+        lambda item: fetch_item_historical_transactions(item, logger, years_back, resume),
+        concurrency
+    ))
 
-    for item in items:
-        item_id = item['item_id']
-        access_token = item['access_token']
-        logger.log(f"Fetching historical transactions for item: {item_id}")
+    logger.log(f"Historical fetch complete. Total: {total_fetched} transactions")
 
-        conn = get_db_connection()
+    send_notification(
+        "Plaid Historical Transaction Fetch Complete",
+        f"Fetched {total_fetched} historical transactions going back {years_back} years."
+    )
 
-        try:
-            # Calculate date range - go back N years
-            end_date = date.today()
-            start_date = end_date - timedelta(days=365 * years_back)
+    return logger.get_summary()
 
-            offset = 0
-            count = 500  # Max per request
-            item_total = 0
 
-            while True:
-                txn_request = TransactionsGetRequest(
-                    access_token=access_token,
-                    start_date=start_date,
-                    end_date=end_date,
-                    options={
-                        'count': count,
-                        'offset': offset
-                    }
-                )
-                response = plaid_client.transactions_get(txn_request).to_dict()
-                transactions = response['transactions']
-                total_transactions = response['total_transactions']
+def balance_history_maintenance(concurrency=ETL_CONCURRENCY):
+    """Backfill missing balance rollups, then prune raw snapshots past retention"""
+    logger = ETLLogger('balance_history_maintenance')
+    conn = get_db_connection()
 
-                if not transactions:
-                    break
+    try:
+        # Rollups are filled first so pruning never drops the only copy of a period
+        backfilled = balance_history.backfill_rollups(conn)
+        logger.log(f"Backfilled {backfilled} rollup rows")
 
-                # Save each transaction
-                for txn in transactions:
-                    save_transaction(conn, txn)
-                    item_total += 1
+        pruned = balance_history.prune_snapshots(conn)
+        logger.log(f"Pruned {pruned} raw balance snapshots")
+    except Exception as e:
+        logger.error(f"Balance history maintenance failed: {e}")
+    finally:
+        release_db_connection(conn)
 
-                logger.log(f"Fetched {len(transactions)} transactions (offset: {offset}, total available: {total_transactions})")
+    return logger.get_summary()
+
+
+def maintain_partitions(concurrency=ETL_CONCURRENCY):
+    """Create upcoming transaction and balance history partitions ahead of time"""
+    logger = ETLLogger('maintain_partitions')
+    conn = get_db_connection()
+
+    try:
+        for table in partitions.TABLES:
+            created = partitions.maintain_partitions(conn, table)
+            logger.log(f"{table}: created {len(created)} partitions{': ' + ', '.join(created) if created else ''}")
+    except Exception as e:
+        logger.error(f"Partition maintenance failed: {e}")
+    finally:
+        release_db_connection(conn)
 
-                offset += len(transactions)
+    return logger.get_summary()
 
-                # Check if we've fetched all available transactions
-                if offset >= total_transactions:
-                    break
 
-                # Small delay to avoid rate limiting
-                time.sleep(0.5)
+def migrate_partitions(concurrency=ETL_CONCURRENCY):
+    """Move unpartitioned transaction and balance history tables onto partitions online"""
+    logger = ETLLogger('migrate_partitions')
+    conn = get_db_connection()
 
-            total_fetched += item_total
-            logger.log(f"Item {item_id}: Fetched {item_total} historical transactions")
+    try:
+        for table in partitions.TABLES:
+            partitions.migrate_table(conn, table, log=logger.log)
+    except Exception as e:
+        logger.error(f"Partition migration failed: {e}")
+    finally:
+        release_db_connection(conn)
 
-        except plaid.ApiException as e:
+    return logger.get_summary()
+
+
+def rebuild_spending_aggregates(concurrency=ETL_CONCURRENCY):
+    """Recompute the spending aggregates from scratch; syncs keep them current after that"""
+    logger = ETLLogger('rebuild_spending_aggregates')
+    conn = get_db_connection()
+
+    try:
+        buckets = spending_aggregates.rebuild(conn)
+        logger.log(f"Rebuilt spending aggregates: {buckets} buckets")
+    except Exception as e:
+        logger.error(f"Spending aggregate rebuild failed: {e}")
+    finally:
+        release_db_connection(conn)
+
+    return logger.get_summary()
+
+
+def refresh_institutions(concurrency=ETL_CONCURRENCY):
+    """Refresh the stored metadata of linked institutions that are missing or stale"""
+    logger = ETLLogger('refresh_institutions')
+    conn = get_db_connection()
+
+    try:
+        refreshed, failed = institutions.refresh_stale(conn, plaid_client, PLAID_COUNTRY_CODES, log=logger.error)
+        logger.log(f"Refreshed {refreshed} institutions, {failed} failed")
+    except Exception as e:
+        logger.error(f"Institution refresh failed: {e}")
+    finally:
+        release_db_connection(conn)
+
+    return logger.get_summary()
+
+
+# Plaid error codes of items that don't have statements, which archiving skips
+NO_STATEMENTS_ERRORS = {'PRODUCTS_NOT_SUPPORTED', 'ADDITIONAL_CONSENT_REQUIRED', 'INVALID_PRODUCT'}
+
+
+def archive_item_statements(item, logger):
+    """Archive the new statements of a single item, returning (archived, failed)"""
+    item_id = item['item_id']
+    conn = get_db_connection()
+
+    try:
+        archived, failed = statement_archive.archive_item(conn, plaid_client, item, log=logger.error)
+        if archived or failed:
+            logger.log(f"Item {item_id}: Archived {archived} statements, {failed} failed")
+        return archived, failed
+
+    except plaid.ApiException as e:
+        try:
+            error_code = json.loads(e.body).get('error_code')
+        except (TypeError, ValueError, AttributeError):
+            error_code = None
+        if error_code in NO_STATEMENTS_ERRORS:
+            logger.log(f"Item {item_id}: No statements available ({error_code}), skipping")
+        else:
             logger.error(f"Plaid API error for item {item_id}: {e}")
-        except Exception as e:
-            logger.error(f"Error fetching item {item_id}: {e}")
-        finally:
-            conn.close()
+    except Exception as e:
+        logger.error(f"Error archiving statements of item {item_id}: {e}")
+    finally:
+        release_db_connection(conn)
 
-    logger.log(f"Historical fetch complete. Total: {total_fetched} transactions")
+    return 0, 0
 
-    send_notification(
-        "Plaid Historical Transaction Fetch Complete",
-        f"Fetched {total_fetched} historical transactions going back {years_back} years."
-    )
+
+def archive_statements(concurrency=ETL_CONCURRENCY):
+    """Download every statement of every item that isn't in the statement archive yet"""
+    logger = ETLLogger('archive_statements')
+    logger.log("Starting statement archive")
+
+    items = get_all_items()
+    logger.log(f"Found {len(items)} items to archive")
+
+    results = run_for_items(items, lambda item: archive_item_statements(item, logger), concurrency)
+    total_archived = sum(archived for archived, _ in results)
+    total_failed = sum(failed for _, failed in results)
+
+    logger.log(f"Statement archive complete. Archived {total_archived} new statements, {total_failed} failed")
 
     return logger.get_summary()
 
 
-def sync_all():
+def sync_all(concurrency=ETL_CONCURRENCY):
     """Run all sync jobs"""
     logger = ETLLogger('sync_all')
     logger.log("Starting full sync")
 
     results = {
-        'accounts': sync_accounts(),
-        'balances': sync_balances(),
-        'transactions': sync_transactions()
+        'accounts': sync_accounts(concurrency),
+        'balances': sync_balances(concurrency),
+        'transactions': sync_transactions(concurrency)
     }
 
     logger.log("Full sync complete")
@@ -598,32 +801,177 @@ def sync_all():
     return results
 
 
+def handle_sync_transactions_job(job, logger):
+    """Queue handler: sync one item's transactions, raising so failures are retried"""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT item_id, access_token FROM plaid_items WHERE item_id = %s', (job['item_id'],))
+        item = cur.fetchone()
+        cur.close()
+    finally:
+        release_db_connection(conn)
+
+    if item is None:
+        logger.log(f"Job {job['id']}: item {job['item_id']} no longer exists, skipping")
+        return
+
+    try:
+        run_item_transaction_sync(item, logger)
+    except item_lock.ItemLockBusy as e:
+        # Run again once the other sync is done; it may have read the cursor
+        # before the update that triggered this job
+        raise job_queue.RetryLater(str(e))
+
+
+def queue_handlers(logger):
+    return {
+        'sync_transactions': lambda job: handle_sync_transactions_job(job, logger),
+        report_jobs.JOB_TYPE: lambda job: report_jobs.handle_poll_job(job, plaid_client, logger.log),
+    }
+
+
+JOBS = {
+    'sync_all': sync_all,
+    'sync_transactions': sync_transactions,
+    'sync_balances': sync_balances,
+    'sync_accounts': sync_accounts,
+    'fetch_historical': fetch_historical_transactions,
+    'balance_history_maintenance': balance_history_maintenance,
+    'maintain_partitions': maintain_partitions,
+    'migrate_partitions': migrate_partitions,
+    'rebuild_spending_aggregates': rebuild_spending_aggregates,
+    'refresh_institutions': refresh_institutions,
+    'archive_statements': archive_statements,
+}
+
+# Default daemon intervals in seconds; override with ETL_DAEMON_<JOB>_INTERVAL
+DAEMON_INTERVALS = {
+    'sync_transactions': 3600,
+    'sync_balances': 86400,
+    'sync_accounts': 86400,
+    'fetch_historical': 0,
+    'balance_history_maintenance': 86400,
+    'maintain_partitions': 86400,
+    'refresh_institutions': 86400,
+    'archive_statements': 86400,
+}
+
+
+def install_shutdown_handlers(logger):
+    """Set shutdown_event on SIGTERM/SIGINT so in-flight work can finish"""
+    def request_shutdown(signum, frame):
+        logger.log(f"Received signal {signum}, finishing in-flight items")
+        shutdown_event.set()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+
+def queue_worker(concurrency=ETL_CONCURRENCY):
+    """Drain the sync job queue with `concurrency` workers until SIGTERM/SIGINT"""
+    logger = ETLLogger('queue_worker')
+    install_shutdown_handlers(logger)
+
+    logger.log(f"Queue worker started with {concurrency} workers")
+    job_queue.run_workers(queue_handlers(logger), concurrency, shutdown_event, log=logger.log)
+    logger.log("Queue worker stopped")
+
+    summary = logger.get_summary()
+    db_pool.close_pool()
+    return summary
+
+
+def run_daemon(concurrency=ETL_CONCURRENCY):
+    """Stay resident and run the ETL jobs on their configured intervals"""
+    logger = ETLLogger('daemon')
+
+    intervals = {
+        name: int(os.getenv(f'ETL_DAEMON_{name.upper()}_INTERVAL', default))
+        for name, default in DAEMON_INTERVALS.items()
+    }
+    queue_workers = int(os.getenv('ETL_DAEMON_QUEUE_WORKERS', '1'))
+    # Every enabled job runs once at startup, then on its interval
+    next_run = {name: time.monotonic() for name, interval in intervals.items() if interval > 0}
+    if not next_run and queue_workers <= 0:
+        logger.error("No jobs enabled, set ETL_DAEMON_<JOB>_INTERVAL or ETL_DAEMON_QUEUE_WORKERS")
+        return logger.get_summary()
+
+    install_shutdown_handlers(logger)
+
+    queue_thread = None
+    if queue_workers > 0:
+        db_pool.get_pool().ensure_max_size(concurrency * (HISTORICAL_WINDOW_CONCURRENCY + 1) + queue_workers + 1)
+        queue_thread = threading.Thread(
+            target=job_queue.run_workers,
+            args=(queue_handlers(logger), queue_workers, shutdown_event),
+            kwargs={'log': logger.log},
+            name='queue-workers',
+        )
+        queue_thread.start()
+
+    logger.log(f"Daemon started: {', '.join(f'{name} every {intervals[name]}s' for name in next_run) or 'no scheduled jobs'}, {queue_workers} queue workers")
+
+    while not shutdown_event.is_set():
+        for name in sorted(next_run, key=next_run.get):
+            if shutdown_event.is_set() or next_run[name] > time.monotonic():
+                break
+            try:
+                JOBS[name](concurrency=concurrency)
+            except Exception as e:
+                logger.error(f"Job {name} failed: {e}")
+                send_notification(f"Plaid ETL Error: {name}", str(e))
+            next_run[name] = time.monotonic() + intervals[name]
+
+        # Sleep until the next job is due, waking immediately on shutdown
+        shutdown_event.wait(max(0, min(next_run.values()) - time.monotonic()) if next_run else None)
+
+    if queue_thread is not None:
+        queue_thread.join()
+    logger.log("Daemon stopped")
+    summary = logger.get_summary()
+    db_pool.close_pool()
+    return summary
+
+
 # ============================================
 # CLI Entry Point
 # ============================================
 
+def parse_args(argv):
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('command', nargs='?')
+    parser.add_argument('--concurrency', type=int, default=ETL_CONCURRENCY)
+    parser.add_argument('--resume', action='store_true')
+    return parser.parse_args(argv)
+
+
 def main():
-    if len(sys.argv) < 2:
+    args = parse_args(sys.argv[1:])
+    if args.command is None:
         print(__doc__)
         sys.exit(1)
 
-    command = sys.argv[1]
+    command = args.command
 
-    commands = {
-        'sync_all': sync_all,
-        'sync_transactions': sync_transactions,
-        'sync_balances': sync_balances,
-        'sync_accounts': sync_accounts,
-        'fetch_historical': fetch_historical_transactions,
-    }
+    commands = dict(JOBS, daemon=run_daemon, queue_worker=queue_worker)
 
     if command not in commands:
         print(f"Unknown command: {command}")
         print(f"Available commands: {', '.join(commands.keys())}")
         sys.exit(1)
 
+    concurrency = max(1, args.concurrency)
     try:
-        result = commands[command]()
+        # Every worker holds one pooled connection while it processes an item
+        # (or one per date window plus the item lock's for the historical
+        # fetch, or one per statement download)
+        db_pool.get_pool().ensure_max_size(
+            concurrency * max(HISTORICAL_WINDOW_CONCURRENCY + 1, statement_archive.download_concurrency()) + 1)
+        if command == 'fetch_historical':
+            result = commands[command](concurrency=concurrency, resume=args.resume)
+        else:
+            result = commands[command](concurrency=concurrency)
         print(json.dumps(result, indent=2, default=str))
     except Exception as e:
         print(f"Error running {command}: {e}")
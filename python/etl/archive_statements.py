@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Archive the statements of every linked item: list each item's statements,
+skip the statement_ids already in statement_archive and download the new ones
+STATEMENT_ARCHIVE_CONCURRENCY (default 4) at a time into STATEMENT_ARCHIVE_DIR.
+Runs are incremental, so scheduling it often only costs one list call per item.
+
+Usage:
+    python etl/archive_statements.py
+"""
+
+import os
+import sys
+import json
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+import plaid
+from plaid.api import plaid_api
+import db_pool
+import rate_limiter
+import statement_archive
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+PLAID_CLIENT_ID = os.getenv('PLAID_CLIENT_ID')
+PLAID_SECRET = os.getenv('PLAID_SECRET')
+PLAID_ENV = os.getenv('PLAID_ENV', 'sandbox')
+
+host = plaid.Environment.Sandbox
+if PLAID_ENV == 'production':
+    host = plaid.Environment.Production
+
+configuration = plaid.Configuration(
+    host=host,
+    api_key={
+        'clientId': PLAID_CLIENT_ID,
+        'secret': PLAID_SECRET,
+        'plaidVersion': '2020-09-14'
+    }
+)
+api_client = plaid.ApiClient(configuration)
+plaid_client = rate_limiter.RateLimitedPlaidApi(plaid_api.PlaidApi(api_client))
+
+
+def log(message):
+    print(f"[{datetime.now().isoformat()}] {message}")
+
+
+def get_all_items():
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT item_id, access_token FROM plaid_items')
+        items = cur.fetchall()
+        cur.close()
+    return items
+
+
+def archive_statements():
+    log("Starting statement archive")
+
+    total_archived = 0
+    total_failed = 0
+    for item in get_all_items():
+        conn = db_pool.getconn()
+        try:
+            archived, failed = statement_archive.archive_item(conn, plaid_client, item, log=log)
+            total_archived += archived
+            total_failed += failed
+            log(f"Item {item['item_id']}: Archived {archived} statements, {failed} failed")
+        except plaid.ApiException as e:
+            log(f"Plaid API error for item {item['item_id']}: {e}")
+        finally:
+            db_pool.putconn(conn)
+
+    log(f"Statement archive complete. Archived {total_archived} new statements, {total_failed} failed")
+    return {'statements_archived': total_archived, 'statements_failed': total_failed}
+
+
+if __name__ == '__main__':
+    result = archive_statements()
+    print(json.dumps(result, indent=2))
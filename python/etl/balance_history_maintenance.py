@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Maintain balance history: backfill the daily/weekly rollups from raw
+snapshots, then delete raw snapshots older than BALANCE_HISTORY_RETENTION_DAYS
+(default 90). Each account's latest snapshot is always kept.
+
+Usage:
+    python etl/balance_history_maintenance.py
+"""
+
+import os
+import sys
+import json
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+import db_pool
+import balance_history
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+
+def balance_history_maintenance():
+    print(f"[{datetime.now().isoformat()}] Starting balance history maintenance")
+
+    conn = db_pool.getconn()
+    try:
+        backfilled = balance_history.backfill_rollups(conn)
+        print(f"[{datetime.now().isoformat()}] Backfilled {backfilled} rollup rows")
+
+        pruned = balance_history.prune_snapshots(conn)
+        print(f"[{datetime.now().isoformat()}] Pruned {pruned} raw balance snapshots")
+    finally:
+        db_pool.putconn(conn)
+
+    return {'rollups_backfilled': backfilled, 'snapshots_pruned': pruned}
+
+
+if __name__ == '__main__':
+    result = balance_history_maintenance()
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Refresh stored institution metadata for every linked item whose institution
+is missing from the institutions table or older than INSTITUTION_TTL_HOURS
+(default 168), so /api/item and item linking read it without calling Plaid.
+
+Usage:
+    python etl/refresh_institutions.py
+"""
+
+import os
+import sys
+import json
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+import plaid
+from plaid.api import plaid_api
+import db_pool
+import rate_limiter
+import institutions
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+PLAID_CLIENT_ID = os.getenv('PLAID_CLIENT_ID')
+PLAID_SECRET = os.getenv('PLAID_SECRET')
+PLAID_ENV = os.getenv('PLAID_ENV', 'sandbox')
+PLAID_COUNTRY_CODES = os.getenv('PLAID_COUNTRY_CODES', 'US').split(',')
+
+host = plaid.Environment.Sandbox
+if PLAID_ENV == 'production':
+    host = plaid.Environment.Production
+
+configuration = plaid.Configuration(
+    host=host,
+    api_key={
+        'clientId': PLAID_CLIENT_ID,
+        'secret': PLAID_SECRET,
+        'plaidVersion': '2020-09-14'
+    }
+)
+api_client = plaid.ApiClient(configuration)
+plaid_client = rate_limiter.RateLimitedPlaidApi(plaid_api.PlaidApi(api_client))
+
+
+def log(message):
+    print(f"[{datetime.now().isoformat()}] {message}")
+
+
+def refresh_institutions():
+    log("Starting institution refresh")
+
+    conn = db_pool.getconn()
+    try:
+        refreshed, failed = institutions.refresh_stale(conn, plaid_client, PLAID_COUNTRY_CODES, log=log)
+        log(f"Refreshed {refreshed} institutions, {failed} failed")
+    finally:
+        db_pool.putconn(conn)
+
+    return {'institutions_refreshed': refreshed, 'institutions_failed': failed}
+
+
+if __name__ == '__main__':
+    result = refresh_institutions()
+    print(json.dumps(result, indent=2))
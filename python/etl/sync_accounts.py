@@ -13,12 +13,13 @@ from datetime import datetime
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 import plaid
 from plaid.api import plaid_api
 from plaid.model.accounts_get_request import AccountsGetRequest
+import db_pool
+import rate_limiter
+from row_hash import content_hash
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
@@ -26,12 +27,6 @@ PLAID_CLIENT_ID = os.getenv('PLAID_CLIENT_ID')
 PLAID_SECRET = os.getenv('PLAID_SECRET')
 PLAID_ENV = os.getenv('PLAID_ENV', 'sandbox')
 
-POSTGRES_HOST = os.getenv('POSTGRES_HOST')
-POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
-POSTGRES_DB = os.getenv('POSTGRES_DB')
-POSTGRES_USER = os.getenv('POSTGRES_USER')
-POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
-
 host = plaid.Environment.Sandbox
 if PLAID_ENV == 'production':
     host = plaid.Environment.Production
@@ -45,18 +40,17 @@ configuration = plaid.Configuration(
     }
 )
 api_client = plaid.ApiClient(configuration)
-plaid_client = plaid_api.PlaidApi(api_client)
+plaid_client = rate_limiter.RateLimitedPlaidApi(plaid_api.PlaidApi(api_client))
 
 
 def get_db_connection():
-    return psycopg2.connect(
-        host=POSTGRES_HOST,
-        port=POSTGRES_PORT,
-        database=POSTGRES_DB,
-        user=POSTGRES_USER,
-        password=POSTGRES_PASSWORD,
-        cursor_factory=RealDictCursor
-    )
+    """Check out a connection from the shared pool"""
+    return db_pool.getconn()
+
+
+def release_db_connection(conn):
+    """Return a connection to the shared pool"""
+    db_pool.putconn(conn)
 
 
 def get_all_items():
@@ -65,7 +59,7 @@ def get_all_items():
     cur.execute('SELECT item_id, access_token FROM plaid_items')
     items = cur.fetchall()
     cur.close()
-    conn.close()
+    release_db_connection(conn)
     return items
 
 
@@ -77,8 +71,9 @@ def save_account(conn, account_data, item_id):
         INSERT INTO financial_accounts (
             account_id, item_id, name, official_name, type, subtype, mask,
             current_balance, available_balance, limit_amount,
-            iso_currency_code, unofficial_currency_code, persistent_account_id, raw_data
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            iso_currency_code, unofficial_currency_code, persistent_account_id, raw_data,
+            content_hash
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         ON CONFLICT (account_id) DO UPDATE SET
             name = EXCLUDED.name,
             official_name = EXCLUDED.official_name,
@@ -92,7 +87,9 @@ def save_account(conn, account_data, item_id):
             unofficial_currency_code = EXCLUDED.unofficial_currency_code,
             persistent_account_id = EXCLUDED.persistent_account_id,
             raw_data = EXCLUDED.raw_data,
+            content_hash = EXCLUDED.content_hash,
             updated_at = CURRENT_TIMESTAMP
+        WHERE financial_accounts.content_hash IS DISTINCT FROM EXCLUDED.content_hash
     ''', (
         account_data.get('account_id'),
         item_id,
@@ -107,10 +104,13 @@ def save_account(conn, account_data, item_id):
         balances.get('iso_currency_code'),
         balances.get('unofficial_currency_code'),
         account_data.get('persistent_account_id'),
-        json.dumps(account_data, default=str)
+        json.dumps(account_data, default=str),
+        content_hash(account_data)
     ))
+    written = cur.rowcount == 1
     conn.commit()
     cur.close()
+    return written
 
 
 def sync_accounts():
@@ -120,6 +120,7 @@ def sync_accounts():
     print(f"[{datetime.now().isoformat()}] Found {len(items)} items to sync")
 
     total_accounts = 0
+    total_written = 0
 
     for item in items:
         item_id = item['item_id']
@@ -132,22 +133,28 @@ def sync_accounts():
             accounts_request = AccountsGetRequest(access_token=access_token)
             response = plaid_client.accounts_get(accounts_request).to_dict()
 
+            written = 0
             for account in response['accounts']:
-                save_account(conn, account, item_id)
+                written += save_account(conn, account, item_id)
                 total_accounts += 1
+            total_written += written
 
-            print(f"[{datetime.now().isoformat()}] Item {item_id}: Synced {len(response['accounts'])} accounts")
+            print(f"[{datetime.now().isoformat()}] Item {item_id}: Synced {len(response['accounts'])} accounts ({written} written, {len(response['accounts']) - written} unchanged)")
 
         except plaid.ApiException as e:
             print(f"[{datetime.now().isoformat()}] ERROR: Plaid API error for item {item_id}: {e}")
         except Exception as e:
             print(f"[{datetime.now().isoformat()}] ERROR: {e}")
         finally:
-            conn.close()
+            release_db_connection(conn)
 
-    print(f"[{datetime.now().isoformat()}] Account sync complete. Synced {total_accounts} accounts")
+    print(f"[{datetime.now().isoformat()}] Account sync complete. Synced {total_accounts} accounts ({total_written} written, {total_accounts - total_written} unchanged)")
 
-    return {'accounts_synced': total_accounts}
+    return {
+        'accounts_synced': total_accounts,
+        'rows_written': total_written,
+        'rows_skipped': total_accounts - total_written
+    }
 
 
 if __name__ == '__main__':
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 Sync account balances from Plaid to PostgreSQL database.
-Also records balance history for tracking over time.
+Also records balance history for tracking over time; a snapshot is only
+stored when the balance changed, and the daily/weekly rollups are updated.
 
 Usage:
     python etl/sync_balances.py
@@ -14,12 +15,14 @@ from datetime import datetime
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 import plaid
 from plaid.api import plaid_api
 from plaid.model.accounts_balance_get_request import AccountsBalanceGetRequest
+import db_pool
+import rate_limiter
+from row_hash import content_hash
+import balance_history
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
@@ -27,12 +30,6 @@ PLAID_CLIENT_ID = os.getenv('PLAID_CLIENT_ID')
 PLAID_SECRET = os.getenv('PLAID_SECRET')
 PLAID_ENV = os.getenv('PLAID_ENV', 'sandbox')
 
-POSTGRES_HOST = os.getenv('POSTGRES_HOST')
-POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
-POSTGRES_DB = os.getenv('POSTGRES_DB')
-POSTGRES_USER = os.getenv('POSTGRES_USER')
-POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
-
 host = plaid.Environment.Sandbox
 if PLAID_ENV == 'production':
     host = plaid.Environment.Production
@@ -46,18 +43,17 @@ configuration = plaid.Configuration(
     }
 )
 api_client = plaid.ApiClient(configuration)
-plaid_client = plaid_api.PlaidApi(api_client)
+plaid_client = rate_limiter.RateLimitedPlaidApi(plaid_api.PlaidApi(api_client))
 
 
 def get_db_connection():
-    return psycopg2.connect(
-        host=POSTGRES_HOST,
-        port=POSTGRES_PORT,
-        database=POSTGRES_DB,
-        user=POSTGRES_USER,
-        password=POSTGRES_PASSWORD,
-        cursor_factory=RealDictCursor
-    )
+    """Check out a connection from the shared pool"""
+    return db_pool.getconn()
+
+
+def release_db_connection(conn):
+    """Return a connection to the shared pool"""
+    db_pool.putconn(conn)
 
 
 def get_all_items():
@@ -66,7 +62,7 @@ def get_all_items():
     cur.execute('SELECT item_id, access_token FROM plaid_items')
     items = cur.fetchall()
     cur.close()
-    conn.close()
+    release_db_connection(conn)
     return items
 
 
@@ -78,8 +74,9 @@ def save_account(conn, account_data, item_id):
         INSERT INTO financial_accounts (
             account_id, item_id, name, official_name, type, subtype, mask,
             current_balance, available_balance, limit_amount,
-            iso_currency_code, unofficial_currency_code, persistent_account_id, raw_data
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            iso_currency_code, unofficial_currency_code, persistent_account_id, raw_data,
+            content_hash
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         ON CONFLICT (account_id) DO UPDATE SET
             name = EXCLUDED.name,
             official_name = EXCLUDED.official_name,
@@ -93,7 +90,9 @@ def save_account(conn, account_data, item_id):
             unofficial_currency_code = EXCLUDED.unofficial_currency_code,
             persistent_account_id = EXCLUDED.persistent_account_id,
             raw_data = EXCLUDED.raw_data,
+            content_hash = EXCLUDED.content_hash,
             updated_at = CURRENT_TIMESTAMP
+        WHERE financial_accounts.content_hash IS DISTINCT FROM EXCLUDED.content_hash
     ''', (
         account_data.get('account_id'),
         item_id,
@@ -108,27 +107,21 @@ def save_account(conn, account_data, item_id):
         balances.get('iso_currency_code'),
         balances.get('unofficial_currency_code'),
         account_data.get('persistent_account_id'),
-        json.dumps(account_data, default=str)
+        json.dumps(account_data, default=str),
+        content_hash(account_data)
     ))
+    written = cur.rowcount == 1
     conn.commit()
     cur.close()
+    return written
 
 
 def save_balance_history(conn, account_id, balances):
     cur = conn.cursor()
-    cur.execute('''
-        INSERT INTO account_balance_history (
-            account_id, current_balance, available_balance, limit_amount, iso_currency_code
-        ) VALUES (%s, %s, %s, %s, %s)
-    ''', (
-        account_id,
-        balances.get('current'),
-        balances.get('available'),
-        balances.get('limit'),
-        balances.get('iso_currency_code')
-    ))
+    recorded = balance_history.record_balance(cur, account_id, balances)
     conn.commit()
     cur.close()
+    return recorded
 
 
 def sync_balances():
@@ -138,6 +131,7 @@ def sync_balances():
     print(f"[{datetime.now().isoformat()}] Found {len(items)} items to sync")
 
     total_accounts = 0
+    total_written = 0
 
     for item in items:
         item_id = item['item_id']
@@ -150,23 +144,29 @@ def sync_balances():
             balance_request = AccountsBalanceGetRequest(access_token=access_token)
             response = plaid_client.accounts_balance_get(balance_request).to_dict()
 
+            written = 0
             for account in response['accounts']:
-                save_account(conn, account, item_id)
+                written += save_account(conn, account, item_id)
                 save_balance_history(conn, account['account_id'], account.get('balances', {}))
                 total_accounts += 1
+            total_written += written
 
-            print(f"[{datetime.now().isoformat()}] Item {item_id}: Updated {len(response['accounts'])} accounts")
+            print(f"[{datetime.now().isoformat()}] Item {item_id}: Updated {len(response['accounts'])} accounts ({written} written, {len(response['accounts']) - written} unchanged)")
 
         except plaid.ApiException as e:
             print(f"[{datetime.now().isoformat()}] ERROR: Plaid API error for item {item_id}: {e}")
         except Exception as e:
             print(f"[{datetime.now().isoformat()}] ERROR: {e}")
         finally:
-            conn.close()
+            release_db_connection(conn)
 
-    print(f"[{datetime.now().isoformat()}] Balance sync complete. Updated {total_accounts} accounts")
+    print(f"[{datetime.now().isoformat()}] Balance sync complete. Updated {total_accounts} accounts ({total_written} written, {total_accounts - total_written} unchanged)")
 
-    return {'accounts_updated': total_accounts}
+    return {
+        'accounts_updated': total_accounts,
+        'rows_written': total_written,
+        'rows_skipped': total_accounts - total_written
+    }
 
 
 if __name__ == '__main__':
@@ -16,12 +16,14 @@ from datetime import datetime
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 import plaid
 from plaid.api import plaid_api
 from plaid.model.transactions_sync_request import TransactionsSyncRequest
+from transaction_writer import StagedTransactionSync
+import db_pool
+import rate_limiter
+import item_lock
 
 # Load environment variables
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
@@ -31,12 +33,6 @@ PLAID_CLIENT_ID = os.getenv('PLAID_CLIENT_ID')
 PLAID_SECRET = os.getenv('PLAID_SECRET')
 PLAID_ENV = os.getenv('PLAID_ENV', 'sandbox')
 
-POSTGRES_HOST = os.getenv('POSTGRES_HOST')
-POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
-POSTGRES_DB = os.getenv('POSTGRES_DB')
-POSTGRES_USER = os.getenv('POSTGRES_USER')
-POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
-
 # Initialize Plaid client
 host = plaid.Environment.Sandbox
 if PLAID_ENV == 'production':
@@ -51,18 +47,17 @@ configuration = plaid.Configuration(
     }
 )
 api_client = plaid.ApiClient(configuration)
-plaid_client = plaid_api.PlaidApi(api_client)
+plaid_client = rate_limiter.RateLimitedPlaidApi(plaid_api.PlaidApi(api_client))
 
 
 def get_db_connection():
-    return psycopg2.connect(
-        host=POSTGRES_HOST,
-        port=POSTGRES_PORT,
-        database=POSTGRES_DB,
-        user=POSTGRES_USER,
-        password=POSTGRES_PASSWORD,
-        cursor_factory=RealDictCursor
-    )
+    """Check out a connection from the shared pool"""
+    return db_pool.getconn()
+
+
+def release_db_connection(conn):
+    """Return a connection to the shared pool"""
+    db_pool.putconn(conn)
 
 
 def get_all_items():
@@ -77,7 +72,7 @@ def get_all_items():
     ''')
     items = cur.fetchall()
     cur.close()
-    conn.close()
+    release_db_connection(conn)
     return items
 
 
@@ -94,7 +89,7 @@ def get_items_needing_reauth():
     ''')
     items = cur.fetchall()
     cur.close()
-    conn.close()
+    release_db_connection(conn)
     return items
 
 
@@ -109,7 +104,7 @@ def update_item_error(item_id, error_data):
     ''', (json.dumps(error_data, default=str), item_id))
     conn.commit()
     cur.close()
-    conn.close()
+    release_db_connection(conn)
 
 
 def get_sync_cursor(conn, item_id):
@@ -120,111 +115,6 @@ def get_sync_cursor(conn, item_id):
     return result['cursor'] if result else ''
 
 
-def save_sync_cursor(conn, item_id, cursor):
-    cur = conn.cursor()
-    cur.execute('''
-        INSERT INTO sync_cursors (item_id, cursor, last_synced_at)
-        VALUES (%s, %s, CURRENT_TIMESTAMP)
-        ON CONFLICT (item_id) DO UPDATE SET
-            cursor = EXCLUDED.cursor,
-            last_synced_at = CURRENT_TIMESTAMP
-    ''', (item_id, cursor))
-    conn.commit()
-    cur.close()
-
-
-def save_transaction(conn, txn_data):
-    cur = conn.cursor()
-
-    location = txn_data.get('location', {}) or {}
-    payment_meta = txn_data.get('payment_meta', {}) or {}
-    personal_finance_category = txn_data.get('personal_finance_category', {}) or {}
-
-    cur.execute('''
-        INSERT INTO financial_transactions (
-            transaction_id, account_id, amount, iso_currency_code, unofficial_currency_code,
-            date, datetime, authorized_date, authorized_datetime,
-            name, merchant_name, merchant_entity_id, logo_url, website,
-            payment_channel, pending, pending_transaction_id, account_owner,
-            transaction_code, transaction_type, category_id,
-            personal_finance_category_primary, personal_finance_category_detailed,
-            personal_finance_category_confidence, personal_finance_category_icon_url,
-            location_address, location_city, location_region, location_postal_code,
-            location_country, location_lat, location_lon, location_store_number,
-            payment_meta_reference_number, payment_meta_ppd_id, payment_meta_payee,
-            payment_meta_by_order_of, payment_meta_payer, payment_meta_payment_method,
-            payment_meta_payment_processor, payment_meta_reason,
-            counterparties, raw_data
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-            %s, %s, %s, %s, %s, %s, %s
-        )
-        ON CONFLICT (transaction_id) DO UPDATE SET
-            amount = EXCLUDED.amount,
-            name = EXCLUDED.name,
-            merchant_name = EXCLUDED.merchant_name,
-            pending = EXCLUDED.pending,
-            personal_finance_category_primary = EXCLUDED.personal_finance_category_primary,
-            personal_finance_category_detailed = EXCLUDED.personal_finance_category_detailed,
-            raw_data = EXCLUDED.raw_data,
-            updated_at = CURRENT_TIMESTAMP
-    ''', (
-        txn_data.get('transaction_id'),
-        txn_data.get('account_id'),
-        txn_data.get('amount'),
-        txn_data.get('iso_currency_code'),
-        txn_data.get('unofficial_currency_code'),
-        txn_data.get('date'),
-        txn_data.get('datetime'),
-        txn_data.get('authorized_date'),
-        txn_data.get('authorized_datetime'),
-        txn_data.get('name'),
-        txn_data.get('merchant_name'),
-        txn_data.get('merchant_entity_id'),
-        txn_data.get('logo_url'),
-        txn_data.get('website'),
-        txn_data.get('payment_channel'),
-        txn_data.get('pending'),
-        txn_data.get('pending_transaction_id'),
-        txn_data.get('account_owner'),
-        txn_data.get('transaction_code'),
-        txn_data.get('transaction_type'),
-        txn_data.get('category_id'),
-        personal_finance_category.get('primary'),
-        personal_finance_category.get('detailed'),
-        personal_finance_category.get('confidence_level'),
-        personal_finance_category.get('icon_url'),
-        location.get('address'),
-        location.get('city'),
-        location.get('region'),
-        location.get('postal_code'),
-        location.get('country'),
-        location.get('lat'),
-        location.get('lon'),
-        location.get('store_number'),
-        payment_meta.get('reference_number'),
-        payment_meta.get('ppd_id'),
-        payment_meta.get('payee'),
-        payment_meta.get('by_order_of'),
-        payment_meta.get('payer'),
-        payment_meta.get('payment_method'),
-        payment_meta.get('payment_processor'),
-        payment_meta.get('reason'),
-        json.dumps(txn_data.get('counterparties'), default=str) if txn_data.get('counterparties') else None,
-        json.dumps(txn_data, default=str)
-    ))
-    conn.commit()
-    cur.close()
-
-
-def delete_transaction(conn, transaction_id):
-    cur = conn.cursor()
-    cur.execute('DELETE FROM financial_transactions WHERE transaction_id = %s', (transaction_id,))
-    conn.commit()
-    cur.close()
-
-
 def sync_transactions():
     print(f"[{datetime.now().isoformat()}] Starting transaction sync")
 
@@ -242,7 +132,10 @@ def sync_transactions():
     total_added = 0
     total_modified = 0
     total_removed = 0
+    total_written = 0
+    total_skipped = 0
     items_failed = []
+    items_busy = []
 
     for item in items:
         item_id = item['item_id']
@@ -250,46 +143,44 @@ def sync_transactions():
         print(f"[{datetime.now().isoformat()}] Syncing item: {item_id}")
 
         conn = get_db_connection()
-        cursor = get_sync_cursor(conn, item_id)
-
-        added = []
-        modified = []
-        removed = []
-        has_more = True
 
         try:
-            while has_more:
-                txn_request = TransactionsSyncRequest(
-                    access_token=access_token,
-                    cursor=cursor,
-                )
-                response = plaid_client.transactions_sync(txn_request).to_dict()
-                cursor = response['next_cursor']
-
-                if cursor == '':
-                    time.sleep(2)
-                    continue
-
-                added.extend(response['added'])
-                modified.extend(response['modified'])
-                removed.extend(response['removed'])
-                has_more = response['has_more']
-
-            for txn in added:
-                save_transaction(conn, txn)
-            for txn in modified:
-                save_transaction(conn, txn)
-            for txn in removed:
-                delete_transaction(conn, txn['transaction_id'])
-
-            if cursor:
-                save_sync_cursor(conn, item_id, cursor)
-
-            total_added += len(added)
-            total_modified += len(modified)
-            total_removed += len(removed)
-
-            print(f"[{datetime.now().isoformat()}] Item {item_id}: +{len(added)} added, ~{len(modified)} modified, -{len(removed)} removed")
+            # Held for the whole sync so webhook jobs and the server cannot race on the cursor
+            with item_lock.item_sync_lock(conn, item_id):
+                cursor = get_sync_cursor(conn, item_id)
+
+                staged = StagedTransactionSync(conn, item_id)
+                has_more = True
+
+                staged.reset()
+                while has_more:
+                    txn_request = TransactionsSyncRequest(
+                        access_token=access_token,
+                        cursor=cursor,
+                    )
+                    response = plaid_client.transactions_sync(txn_request).to_dict()
+                    cursor = response['next_cursor']
+
+                    if cursor == '':
+                        time.sleep(2)
+                        continue
+
+                    staged.stage_page(response)
+                    has_more = response['has_more']
+
+                staged.promote(cursor)
+
+            total_added += staged.added
+            total_modified += staged.modified
+            total_removed += staged.removed
+            total_written += staged.written
+            total_skipped += staged.skipped
+
+            print(f"[{datetime.now().isoformat()}] Item {item_id}: +{staged.added} added, ~{staged.modified} modified, -{staged.removed} removed ({staged.written} written, {staged.skipped} unchanged)")
+
+        except item_lock.ItemLockBusy:
+            print(f"[{datetime.now().isoformat()}] Item {item_id}: sync already running elsewhere, skipping")
+            items_busy.append(item_id)
 
         except plaid.ApiException as e:
             error_body = json.loads(e.body)
@@ -304,9 +195,9 @@ def sync_transactions():
             print(f"[{datetime.now().isoformat()}] ERROR: {e}")
             items_failed.append({'item_id': item_id, 'error': str(e)})
         finally:
-            conn.close()
+            release_db_connection(conn)
 
-    print(f"[{datetime.now().isoformat()}] Transaction sync complete. Total: +{total_added} added, ~{total_modified} modified, -{total_removed} removed")
+    print(f"[{datetime.now().isoformat()}] Transaction sync complete. Total: +{total_added} added, ~{total_modified} modified, -{total_removed} removed ({total_written} written, {total_skipped} unchanged)")
 
     if items_failed:
         print(f"[{datetime.now().isoformat()}] WARNING: {len(items_failed)} items failed during sync")
@@ -315,8 +206,11 @@ def sync_transactions():
         'added': total_added,
         'modified': total_modified,
         'removed': total_removed,
-        'items_synced': len(items) - len(items_failed),
+        'rows_written': total_written,
+        'rows_skipped': total_skipped,
+        'items_synced': len(items) - len(items_failed) - len(items_busy),
         'items_failed': len(items_failed),
+        'items_busy': len(items_busy),
         'items_needing_reauth': len(items_needing_reauth)
     }
 
@@ -0,0 +1,84 @@
+"""
+Gunicorn configuration for serving server.py in production.
+
+    gunicorn -c gunicorn.conf.py server:app
+
+The app is imported once in the master and forked into SERVER_WORKERS
+processes, each running SERVER_THREADS request threads. The master needs
+the app anyway to initialize the database schema before any worker starts,
+instead of every worker doing it on import, so it is always preloaded.
+Configuration is read from the environment:
+
+    SERVER_BIND             Address to listen on (default 127.0.0.1:$PORT, PORT default 8000)
+    SERVER_WORKERS          Worker processes (default 1; see below before raising it)
+    SERVER_THREADS          Threads per worker (default 4); 1 uses plain sync workers
+    SERVER_WORKER_CLASS     Override the worker class, e.g. gevent
+    SERVER_TIMEOUT          Seconds before a silent worker is restarted (default 300)
+    SERVER_MAX_REQUESTS     Recycle a worker after this many requests (default 0, never)
+
+A single worker scaled with SERVER_THREADS is the default because the
+payment initiation, transfer and CRA demo endpoints keep their ids in
+process memory, which other workers don't see. Use several workers, e.g.
+2 x cores + 1, only without those flows and with the postgres response
+cache, which then becomes the default backend, so webhook invalidations
+reach every worker's cache; the master warns at startup otherwise. Each
+worker has its own connection pool, so the database must allow
+SERVER_WORKERS x DB_POOL_MAX_SIZE connections.
+"""
+
+import os
+
+bind = os.getenv('SERVER_BIND', f"127.0.0.1:{os.getenv('PORT', '8000')}")
+
+workers = int(os.getenv('SERVER_WORKERS', '1'))
+threads = int(os.getenv('SERVER_THREADS', '4'))
+worker_class = os.getenv('SERVER_WORKER_CLASS', 'gthread' if threads > 1 else 'sync')
+
+# on_starting imports the app in the master, so workers reuse it
+preload_app = True
+
+# /api/transactions can wait on an item's sync lock and Plaid pagination,
+# so allow as long as nginx's proxy_read_timeout
+timeout = int(os.getenv('SERVER_TIMEOUT', '300'))
+graceful_timeout = 30
+keepalive = 5
+
+max_requests = int(os.getenv('SERVER_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+# nginx on the same host terminates TLS and sets X-Forwarded-*
+forwarded_allow_ips = '127.0.0.1'
+
+accesslog = '-'
+errorlog = '-'
+
+
+# Products whose demo flows keep ids in one worker's memory (server_common.demo_state)
+PER_PROCESS_PRODUCTS = ('payment_initiation', 'transfer', 'cra_base_report', 'cra_income_insights',
+                        'cra_partner_insights')
+
+
+def on_starting(server):
+    """Create and migrate the schema once, in the master"""
+    import db_pool
+    import response_cache
+    import server as plaid_server
+
+    # Workers may also come from -w/WEB_CONCURRENCY; the response cache picks
+    # its default backend from this
+    os.environ['SERVER_WORKERS'] = str(server.cfg.workers)
+
+    if server.cfg.workers > 1:
+        products = [product for product in plaid_server.PLAID_PRODUCTS if product in PER_PROCESS_PRODUCTS]
+        if products:
+            server.log.warning(
+                f"{server.cfg.workers} workers: the {', '.join(products)} demo flows keep their ids in "
+                f"one worker's memory and break across workers; use SERVER_WORKERS=1 and SERVER_THREADS")
+        if response_cache.backend_name() == 'memory':
+            server.log.warning(
+                f"{server.cfg.workers} workers with the memory response cache: webhook invalidations "
+                f"only reach the worker that received them; set RESPONSE_CACHE_BACKEND=postgres")
+
+    plaid_server.setup_database()
+    # Workers open their own connections; don't fork the master's
+    db_pool.close_pool()
@@ -0,0 +1,59 @@
+"""
+Persistent checkpoints for the historical transaction fetch.
+
+Every item's date windows are recorded in historical_fetch_checkpoints with
+the next offset to fetch and a completed flag. Each page of transactions is
+written in the same transaction as its checkpoint update, so after a crash,
+timeout or deploy a `--resume` run continues from exactly where the previous
+run stopped instead of starting every item over from offset 0.
+"""
+
+from psycopg2.extras import execute_values
+
+
+def plan_windows(conn, item_id, windows, resume=False):
+    """Return the (window_start, window_end, offset) tuples left to fetch for an item.
+
+    With resume=True the windows recorded by the previous run are reused, so
+    resuming on a later day does not shift the window bounds. Otherwise, or
+    when nothing was recorded, the item's checkpoints are reset to `windows`.
+    """
+    cur = conn.cursor()
+
+    if resume:
+        cur.execute('''
+            SELECT window_start, window_end, next_offset, completed
+            FROM historical_fetch_checkpoints
+            WHERE item_id = %s
+            ORDER BY window_start
+        ''', (item_id,))
+        rows = cur.fetchall()
+        if rows:
+            cur.close()
+            return [
+                (row['window_start'], row['window_end'], row['next_offset'])
+                for row in rows if not row['completed']
+            ]
+
+    cur.execute('DELETE FROM historical_fetch_checkpoints WHERE item_id = %s', (item_id,))
+    execute_values(cur, '''
+        INSERT INTO historical_fetch_checkpoints (item_id, window_start, window_end)
+        VALUES %s
+    ''', [(item_id, window_start, window_end) for window_start, window_end in windows])
+    conn.commit()
+    cur.close()
+    return [(window_start, window_end, 0) for window_start, window_end in windows]
+
+
+def save_checkpoint(conn, item_id, window_start, window_end, next_offset, total_transactions, completed):
+    """Record window progress; callers commit it together with the page it covers"""
+    cur = conn.cursor()
+    cur.execute('''
+        UPDATE historical_fetch_checkpoints
+        SET next_offset = %s,
+            total_transactions = %s,
+            completed = %s,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE item_id = %s AND window_start = %s AND window_end = %s
+    ''', (next_offset, total_transactions, completed, item_id, window_start, window_end))
+    cur.close()
@@ -0,0 +1,128 @@
+"""
+Institution metadata served from the institutions table.
+
+Institution details rarely change, so lookups read the stored row first and
+only call /institutions/get_by_id when it is missing or older than
+INSTITUTION_TTL_HOURS (default 168, one week). If Plaid cannot be reached
+the stale row is served rather than failing the request. `etl.py
+refresh_institutions` refreshes the stale institutions of every item in the
+background, so interactive lookups normally never wait on Plaid.
+
+Usage:
+    institution = institutions.get_institution(conn, client, institution_id, country_codes)
+
+    institutions.refresh_stale(conn, client, country_codes)
+"""
+
+import json
+import os
+
+import plaid
+from plaid.model.country_code import CountryCode
+from plaid.model.institutions_get_by_id_request import InstitutionsGetByIdRequest
+
+DEFAULT_TTL_HOURS = 168
+
+
+def ttl_hours():
+    return float(os.getenv('INSTITUTION_TTL_HOURS', DEFAULT_TTL_HOURS))
+
+
+def save_institution(cur, institution_data):
+    """Upsert an institution from a Plaid payload; the caller commits"""
+    cur.execute('''
+        INSERT INTO institutions (
+            institution_id, name, url, logo, primary_color,
+            country_codes, products, routing_numbers, raw_data
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (institution_id) DO UPDATE SET
+            name = EXCLUDED.name,
+            url = EXCLUDED.url,
+            logo = EXCLUDED.logo,
+            primary_color = EXCLUDED.primary_color,
+            country_codes = EXCLUDED.country_codes,
+            products = EXCLUDED.products,
+            routing_numbers = EXCLUDED.routing_numbers,
+            raw_data = EXCLUDED.raw_data,
+            updated_at = CURRENT_TIMESTAMP
+    ''', (
+        institution_data.get('institution_id'),
+        institution_data.get('name'),
+        institution_data.get('url'),
+        institution_data.get('logo'),
+        institution_data.get('primary_color'),
+        institution_data.get('country_codes'),
+        institution_data.get('products'),
+        institution_data.get('routing_numbers'),
+        json.dumps(institution_data, default=str)
+    ))
+
+
+def fetch_institution(conn, client, institution_id, country_codes):
+    """Fetch an institution from Plaid, store it and commit; returns the Plaid payload"""
+    inst_request = InstitutionsGetByIdRequest(
+        institution_id=institution_id,
+        country_codes=[CountryCode(code) for code in country_codes]
+    )
+    institution = client.institutions_get_by_id(inst_request).to_dict()['institution']
+    cur = conn.cursor()
+    save_institution(cur, institution)
+    conn.commit()
+    cur.close()
+    return institution
+
+
+def get_institution(conn, client, institution_id, country_codes, ttl=None):
+    """An institution from the table, refreshed from Plaid once older than the TTL (hours)"""
+    if ttl is None:
+        ttl = ttl_hours()
+
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT raw_data, updated_at > CURRENT_TIMESTAMP - make_interval(secs => %s) AS fresh
+        FROM institutions
+        WHERE institution_id = %s
+    ''', (ttl * 3600, institution_id))
+    row = cur.fetchone()
+    cur.close()
+
+    if row and row['fresh'] and row['raw_data']:
+        return row['raw_data']
+
+    try:
+        return fetch_institution(conn, client, institution_id, country_codes)
+    except plaid.ApiException:
+        if row and row['raw_data']:
+            return row['raw_data']
+        raise
+
+
+def refresh_stale(conn, client, country_codes, ttl=None, log=print):
+    """Refresh every linked institution that is missing or past the TTL; returns (refreshed, failed)"""
+    if ttl is None:
+        ttl = ttl_hours()
+
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT DISTINCT pi.institution_id
+        FROM plaid_items pi
+        LEFT JOIN institutions i ON i.institution_id = pi.institution_id
+        WHERE pi.institution_id IS NOT NULL
+          AND (i.institution_id IS NULL
+               OR i.updated_at <= CURRENT_TIMESTAMP - make_interval(secs => %s))
+        ORDER BY pi.institution_id
+    ''', (ttl * 3600,))
+    stale = [row['institution_id'] for row in cur.fetchall()]
+    cur.close()
+
+    refreshed = 0
+    failed = 0
+    for institution_id in stale:
+        try:
+            fetch_institution(conn, client, institution_id, country_codes)
+            refreshed += 1
+        except Exception as e:
+            conn.rollback()
+            failed += 1
+            log(f"Could not refresh institution {institution_id}: {e}")
+    return refreshed, failed
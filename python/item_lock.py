@@ -0,0 +1,68 @@
+"""
+Per-item sync locks shared by the server and the ETL jobs.
+
+A transaction sync reads an item's cursor, pages through /transactions/sync
+and saves the new cursor. Two syncs of the same item at once waste Plaid
+calls and race on the sync_cursors row, so every sync holds a session-level
+PostgreSQL advisory lock keyed by the item for its whole duration. Advisory
+locks live in the database, so they work across server workers, the ETL
+daemon, queue workers and cron runs alike.
+
+Usage:
+    with item_lock.item_sync_lock(conn, item_id):
+        ...  # ItemLockBusy if another sync of the item is running
+
+    with item_lock.item_sync_lock(conn, item_id, timeout=30):
+        ...  # wait up to 30s for the running sync to finish
+"""
+
+import time
+from contextlib import contextmanager
+
+# First key of the two-key advisory lock form, so item locks cannot collide
+# with other advisory locks in the database
+LOCK_NAMESPACE = 7301
+
+POLL_INTERVAL = 0.5
+
+
+class ItemLockBusy(Exception):
+    """Raised when another sync of the item holds its lock"""
+
+    def __init__(self, item_id):
+        super().__init__(f"A sync of item {item_id} is already running")
+        self.item_id = item_id
+
+
+def try_acquire(conn, item_id):
+    cur = conn.cursor()
+    cur.execute('SELECT pg_try_advisory_lock(%s, hashtext(%s)) AS acquired', (LOCK_NAMESPACE, item_id))
+    acquired = cur.fetchone()['acquired']
+    cur.close()
+    # Session-level locks outlive the transaction, so don't leave it open
+    conn.commit()
+    return acquired
+
+
+def release(conn, item_id):
+    cur = conn.cursor()
+    cur.execute('SELECT pg_advisory_unlock(%s, hashtext(%s))', (LOCK_NAMESPACE, item_id))
+    cur.close()
+    conn.commit()
+
+
+@contextmanager
+def item_sync_lock(conn, item_id, timeout=0):
+    """Hold the item's sync lock on `conn`, waiting up to `timeout` seconds for it"""
+    deadline = time.monotonic() + timeout
+    while not try_acquire(conn, item_id):
+        if time.monotonic() >= deadline:
+            raise ItemLockBusy(item_id)
+        time.sleep(POLL_INTERVAL)
+
+    try:
+        yield
+    finally:
+        # Roll back first: an aborted transaction would make the unlock fail
+        conn.rollback()
+        release(conn, item_id)
@@ -0,0 +1,435 @@
+"""
+Durable PostgreSQL-backed job queue.
+
+Webhooks enqueue a row in sync_jobs and return immediately; workers started
+by `etl.py queue_worker` (or by the ETL daemon) claim jobs with
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers can drain the
+queue without handing the same job out twice.
+
+A failed job is retried with exponential backoff until it has been attempted
+max_attempts times (JOB_QUEUE_MAX_ATTEMPTS, default 5), after which it is
+dead-lettered with status 'dead' and its last error kept for inspection.
+A job whose worker died is handed out again once it has been running longer
+than JOB_QUEUE_VISIBILITY_TIMEOUT seconds (default 900).
+
+Jobs for an item coalesce: while a job is queued, enqueueing another of the
+same type for the same item only bumps the queued job's `coalesced` count
+(a partial unique index allows one queued job per type and item), so a burst
+of webhooks costs a single sync. A job already running does not absorb new
+triggers, since it may have read its cursor before the new data arrived;
+the next one queues behind it. A job that would go back on the queue while
+another is already queued for its item is marked 'superseded' instead.
+
+A handler raises RetryLater to put its job back without using an attempt,
+e.g. when another sync of the item holds the item's lock.
+
+A worker only finishes, fails or defers a job it still holds: if the job
+was handed out again while it ran past the visibility timeout, its result
+is discarded (JobLost) rather than overwriting the newer run.
+
+Usage:
+    job_queue.enqueue(conn, 'sync_transactions', item_id, {'webhook_code': code})
+
+    job_queue.run_workers({'sync_transactions': handle_sync}, concurrency, stop_event)
+
+    job_queue.queue_stats(conn)   # depth per status and job type, oldest job age, coalesced triggers
+"""
+
+import json
+import os
+import socket
+import threading
+import traceback
+
+import psycopg2
+
+import db_pool
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_VISIBILITY_TIMEOUT = 900
+DEFAULT_RETENTION_DAYS = 7
+
+# Seconds before the first retry; doubles with every attempt up to RETRY_MAX_DELAY
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 3600
+
+# Seconds a job waits when its handler raises RetryLater without a delay
+DEFER_DELAY = 15
+
+# Status for a job going back on the queue: 'superseded' when another job of the
+# same type is already queued for the item, as that one will do the same work
+REQUEUE_STATUS = '''
+    CASE WHEN EXISTS (
+        SELECT 1 FROM sync_jobs sibling
+        WHERE sibling.job_type = sync_jobs.job_type
+          AND sibling.item_id = sync_jobs.item_id
+          AND sibling.status = 'queued'
+          AND sibling.id <> sync_jobs.id
+    ) THEN 'superseded' ELSE 'queued' END
+'''
+
+
+class JobLost(Exception):
+    """The job was handed to another worker while this one ran it; its outcome was not recorded"""
+
+    def __init__(self, job_id, worker_id):
+        super().__init__(f"Job {job_id} is no longer held by {worker_id}")
+        self.job_id = job_id
+        self.worker_id = worker_id
+
+
+class RetryLater(Exception):
+    """Raised by a handler to requeue its job after `delay` seconds without using an attempt"""
+
+    def __init__(self, message, delay=None):
+        super().__init__(message)
+        self.delay = DEFER_DELAY if delay is None else delay
+
+
+def create_tables(cur):
+    """Create the queue table; called from init_db"""
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS sync_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            job_type VARCHAR(50) NOT NULL,
+            item_id VARCHAR(255) REFERENCES plaid_items(item_id),
+            payload JSONB,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            locked_by VARCHAR(255),
+            locked_at TIMESTAMP,
+            last_error TEXT,
+            coalesced INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sync_jobs_ready
+        ON sync_jobs (run_after, id) WHERE status = 'queued'
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sync_jobs_running
+        ON sync_jobs (locked_at) WHERE status = 'running'
+    ''')
+    cur.execute('ALTER TABLE sync_jobs ADD COLUMN IF NOT EXISTS coalesced INTEGER NOT NULL DEFAULT 0')
+
+    # Collapse duplicates queued before coalescing existed, keeping the oldest
+    cur.execute('''
+        UPDATE sync_jobs
+        SET status = 'superseded', finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE status = 'queued' AND item_id IS NOT NULL AND EXISTS (
+            SELECT 1 FROM sync_jobs older
+            WHERE older.job_type = sync_jobs.job_type
+              AND older.item_id = sync_jobs.item_id
+              AND older.status = 'queued'
+              AND older.id < sync_jobs.id
+        )
+    ''')
+    cur.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_sync_jobs_pending
+        ON sync_jobs (job_type, item_id) WHERE status = 'queued'
+    ''')
+
+
+def enqueue(conn, job_type, item_id=None, payload=None, max_attempts=None):
+    """Add a job and commit; returns its id.
+
+    If a job of this type is already queued for the item, that job takes the
+    new payload, becomes runnable now and its id is returned instead.
+    """
+    if max_attempts is None:
+        max_attempts = int(os.getenv('JOB_QUEUE_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS))
+    cur = conn.cursor()
+    cur.execute('''
+        INSERT INTO sync_jobs (job_type, item_id, payload, max_attempts)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (job_type, item_id) WHERE status = 'queued' DO UPDATE SET
+            payload = EXCLUDED.payload,
+            coalesced = sync_jobs.coalesced + 1,
+            run_after = LEAST(sync_jobs.run_after, EXCLUDED.run_after),
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING id
+    ''', (job_type, item_id, json.dumps(payload or {}, default=str), max_attempts))
+    job_id = cur.fetchone()['id']
+    conn.commit()
+    cur.close()
+    return job_id
+
+
+def claim(conn, worker_id, job_types):
+    """Lock the next runnable job for this worker, or return None"""
+    cur = conn.cursor()
+    cur.execute('''
+        UPDATE sync_jobs
+        SET status = 'running',
+            attempts = attempts + 1,
+            locked_by = %s,
+            locked_at = CURRENT_TIMESTAMP,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = (
+            SELECT id FROM sync_jobs
+            WHERE status = 'queued'
+              AND run_after <= CURRENT_TIMESTAMP
+              AND job_type = ANY(%s)
+            ORDER BY run_after, id
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING *
+    ''', (worker_id, list(job_types)))
+    job = cur.fetchone()
+    conn.commit()
+    cur.close()
+    return job
+
+
+def complete(conn, job_id, worker_id):
+    """Mark a job done; raises JobLost if `worker_id` no longer holds it"""
+    cur = conn.cursor()
+    cur.execute('''
+        UPDATE sync_jobs
+        SET status = 'done', last_error = NULL, locked_by = NULL,
+            finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND status = 'running' AND locked_by = %s
+    ''', (job_id, worker_id))
+    updated = cur.rowcount
+    conn.commit()
+    cur.close()
+    if not updated:
+        raise JobLost(job_id, worker_id)
+
+
+def fail(conn, job, error, worker_id):
+    """Schedule a retry with backoff, or dead-letter the job once out of attempts.
+
+    Returns True if the job was dead-lettered; raises JobLost if `worker_id`
+    no longer holds it.
+    """
+    dead = job['attempts'] >= job['max_attempts']
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (job['attempts'] - 1))
+    _release(conn, job['id'], worker_id, "'dead'" if dead else REQUEUE_STATUS, delay, error, 0)
+    return dead
+
+
+def defer(conn, job, delay, reason, worker_id):
+    """Put a job back on the queue after `delay` seconds without counting the attempt"""
+    _release(conn, job['id'], worker_id, REQUEUE_STATUS, delay, reason, 1)
+
+
+def _release(conn, job_id, worker_id, status_sql, delay, error, refund_attempts):
+    """Move a job `worker_id` holds to the status the SQL expression `status_sql` gives and commit"""
+    query = '''
+        UPDATE sync_jobs
+        SET status = {status},
+            attempts = attempts - %(refund)s,
+            run_after = CURRENT_TIMESTAMP + make_interval(secs => %(delay)s),
+            last_error = %(error)s,
+            locked_by = NULL,
+            finished_at = CASE WHEN {status} = 'queued' THEN NULL ELSE CURRENT_TIMESTAMP END,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = %(job_id)s AND status = 'running' AND locked_by = %(worker_id)s
+    '''
+    params = {'refund': refund_attempts, 'delay': delay, 'error': error, 'job_id': job_id, 'worker_id': worker_id}
+    cur = conn.cursor()
+    try:
+        cur.execute(query.format(status=status_sql), params)
+    except psycopg2.IntegrityError:
+        # A job for the item was queued between the check and the update
+        conn.rollback()
+        cur.execute(query.format(status="'superseded'"), params)
+    updated = cur.rowcount
+    conn.commit()
+    cur.close()
+    if not updated:
+        raise JobLost(job_id, worker_id)
+
+
+def requeue_stale(conn, visibility_timeout=None):
+    """Hand out jobs again whose worker stopped without finishing them"""
+    if visibility_timeout is None:
+        visibility_timeout = int(os.getenv('JOB_QUEUE_VISIBILITY_TIMEOUT', DEFAULT_VISIBILITY_TIMEOUT))
+    # Only one job per item may go back on the queue
+    superseded = '''
+        EXISTS (
+            SELECT 1 FROM sync_jobs sibling
+            WHERE sibling.job_type = sync_jobs.job_type
+              AND sibling.item_id = sync_jobs.item_id
+              AND sibling.id <> sync_jobs.id
+              AND (sibling.status = 'queued' OR (
+                  sibling.status = 'running'
+                  AND sibling.locked_at < CURRENT_TIMESTAMP - make_interval(secs => %(timeout)s)
+                  AND sibling.id > sync_jobs.id
+              ))
+        )
+    '''
+    cur = conn.cursor()
+    cur.execute('''
+        UPDATE sync_jobs
+        SET status = CASE
+                WHEN attempts >= max_attempts THEN 'dead'
+                WHEN {superseded} THEN 'superseded'
+                ELSE 'queued'
+            END,
+            -- Dead and superseded jobs are finished, as in _release
+            finished_at = CASE
+                WHEN attempts >= max_attempts OR {superseded} THEN CURRENT_TIMESTAMP
+                ELSE NULL
+            END,
+            last_error = 'Worker stopped responding',
+            locked_by = NULL,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE status = 'running'
+          AND locked_at < CURRENT_TIMESTAMP - make_interval(secs => %(timeout)s)
+    '''.format(superseded=superseded), {'timeout': visibility_timeout})
+    requeued = cur.rowcount
+    conn.commit()
+    cur.close()
+    return requeued
+
+
+def purge_finished(conn, retention_days=None):
+    """Delete completed and superseded jobs past retention; dead jobs are kept until handled"""
+    if retention_days is None:
+        retention_days = int(os.getenv('JOB_QUEUE_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+    cur = conn.cursor()
+    cur.execute('''
+        DELETE FROM sync_jobs
+        WHERE status IN ('done', 'superseded') AND finished_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+    ''', (retention_days,))
+    purged = cur.rowcount
+    conn.commit()
+    cur.close()
+    return purged
+
+
+def retry_dead(conn, job_id=None):
+    """Move dead-lettered jobs (or one of them) back onto the queue"""
+    cur = conn.cursor()
+    cur.execute('''
+        UPDATE sync_jobs
+        SET status = 'queued', attempts = 0, run_after = CURRENT_TIMESTAMP,
+            finished_at = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE status = 'dead' AND (%(job_id)s::BIGINT IS NULL OR id = %(job_id)s)
+    ''', {'job_id': job_id})
+    retried = cur.rowcount
+    conn.commit()
+    cur.close()
+    return retried
+
+
+def queue_stats(conn):
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT job_type, status, COUNT(*) AS jobs, SUM(coalesced) AS coalesced,
+               EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - MIN(created_at)) AS oldest_seconds
+        FROM sync_jobs
+        GROUP BY job_type, status
+        ORDER BY job_type, status
+    ''')
+    rows = cur.fetchall()
+    cur.close()
+
+    by_status = {}
+    for row in rows:
+        by_status[row['status']] = by_status.get(row['status'], 0) + row['jobs']
+    queued_ages = [row['oldest_seconds'] for row in rows if row['status'] == 'queued']
+    return {
+        'depth': by_status.get('queued', 0),
+        'running': by_status.get('running', 0),
+        'dead': by_status.get('dead', 0),
+        'superseded': by_status.get('superseded', 0),
+        # Triggers absorbed by an already-queued job instead of queueing their own
+        'coalesced': sum(int(row['coalesced']) for row in rows),
+        'oldest_queued_seconds': round(float(max(queued_ages)), 1) if queued_ages else None,
+        'by_type': [
+            {
+                'job_type': row['job_type'],
+                'status': row['status'],
+                'jobs': row['jobs'],
+                'coalesced': int(row['coalesced']),
+                'oldest_seconds': round(float(row['oldest_seconds']), 1),
+            }
+            for row in rows
+        ],
+    }
+
+
+def _worker_loop(handlers, stop_event, poll_interval, log):
+    worker_id = f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+    while not stop_event.is_set():
+        conn = db_pool.getconn()
+        try:
+            job = claim(conn, worker_id, handlers.keys())
+            if job is None:
+                db_pool.putconn(conn)
+                conn = None
+                stop_event.wait(poll_interval)
+                continue
+
+            log(f"Job {job['id']} ({job['job_type']}, item {job['item_id']}) started, attempt {job['attempts']}/{job['max_attempts']}")
+            try:
+                try:
+                    handlers[job['job_type']](job)
+                except RetryLater as e:
+                    conn.rollback()
+                    defer(conn, job, e.delay, str(e), worker_id)
+                    log(f"Job {job['id']} deferred {e.delay}s: {e}")
+                except Exception as e:
+                    conn.rollback()
+                    if fail(conn, job, f'{e}\n{traceback.format_exc()}', worker_id):
+                        log(f"Job {job['id']} dead-lettered after {job['attempts']} attempts: {e}")
+                    else:
+                        log(f"Job {job['id']} failed, will retry: {e}")
+                else:
+                    complete(conn, job['id'], worker_id)
+                    log(f"Job {job['id']} done")
+            except JobLost as e:
+                # It ran past JOB_QUEUE_VISIBILITY_TIMEOUT and was requeued;
+                # the newer claim owns the outcome
+                log(f"{e}: it was requeued after JOB_QUEUE_VISIBILITY_TIMEOUT, discarding this run's outcome")
+        except Exception as e:
+            # Lost the database; back off instead of spinning
+            log(f"Queue worker error: {e}")
+            stop_event.wait(poll_interval)
+        finally:
+            if conn is not None:
+                db_pool.putconn(conn)
+
+
+def run_workers(handlers, concurrency, stop_event, poll_interval=None, log=print):
+    """Drain the queue with `concurrency` worker threads until stop_event is set.
+
+    Jobs already started finish before this returns.
+    """
+    if poll_interval is None:
+        poll_interval = float(os.getenv('JOB_QUEUE_POLL_INTERVAL', '2'))
+
+    threads = [
+        threading.Thread(
+            target=_worker_loop,
+            args=(handlers, stop_event, poll_interval, log),
+            name=f'queue-worker-{n}',
+            daemon=True,
+        )
+        for n in range(max(1, concurrency))
+    ]
+    for thread in threads:
+        thread.start()
+
+    # Housekeeping runs alongside the workers
+    while not stop_event.wait(60):
+        try:
+            with db_pool.connection() as conn:
+                requeued = requeue_stale(conn)
+                purged = purge_finished(conn)
+            if requeued or purged:
+                log(f"Requeued {requeued} stale jobs, purged {purged} finished jobs")
+        except Exception as e:
+            log(f"Queue housekeeping error: {e}")
+
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,409 @@
+"""
+Declarative range partitioning for the large time-ordered tables.
+
+financial_transactions is range partitioned by `date` and
+account_balance_history by `recorded_at`, into monthly or yearly partitions
+(TRANSACTION_PARTITION_INTERVAL / BALANCE_HISTORY_PARTITION_INTERVAL, 'month'
+or 'year', default 'month'). The interval is fixed when a table is created
+and recorded in its comment. A DEFAULT partition catches rows outside every
+range.
+
+Partitions are created on demand: init_db and the daily maintain_partitions
+job create *_PARTITIONS_AHEAD (default 3) future partitions, and
+merge_staged_transactions creates any partition a batch needs before writing
+it. New partitions are built standalone and attached, which only takes a
+SHARE UPDATE EXCLUSIVE lock on the parent, so reads and writes continue.
+
+Databases created before partitioning keep their plain tables until
+`etl.py migrate_partitions` moves them over online (see migrate_table).
+"""
+
+import os
+from datetime import date, datetime
+
+TRANSACTIONS = 'financial_transactions'
+BALANCE_HISTORY = 'account_balance_history'
+
+# Partitioned tables: partition column, primary key (must include the
+# partition column), whether writers upsert on that key, and the indexes and
+# foreign keys a migrated table needs
+TABLES = {
+    TRANSACTIONS: {
+        'column': 'date',
+        'key': ('transaction_id', 'date'),
+        'upsert': True,
+        'interval_env': 'TRANSACTION_PARTITION_INTERVAL',
+        'ahead_env': 'TRANSACTION_PARTITIONS_AHEAD',
+        'default_interval': 'month',
+        'indexes': {
+            # Keyset pagination order, alone and after each filter column
+            # (see transaction_queries.py)
+            'idx_transactions_date_id': '(date DESC, transaction_id DESC)',
+            'idx_transactions_account_date': '(account_id, date DESC, transaction_id DESC)',
+            'idx_transactions_merchant_date': '(merchant_name, date DESC, transaction_id DESC)',
+            'idx_transactions_category_date': '(personal_finance_category_primary, date DESC, transaction_id DESC)',
+        },
+        'foreign_keys': ['(account_id) REFERENCES financial_accounts(account_id)'],
+    },
+    BALANCE_HISTORY: {
+        'column': 'recorded_at',
+        'key': ('id', 'recorded_at'),
+        'upsert': False,
+        'interval_env': 'BALANCE_HISTORY_PARTITION_INTERVAL',
+        'ahead_env': 'BALANCE_HISTORY_PARTITIONS_AHEAD',
+        'default_interval': 'month',
+        'indexes': {
+            'idx_balance_history_account_latest': '(account_id, recorded_at DESC)',
+            'idx_balance_history_recorded_brin': 'USING BRIN (recorded_at)',
+        },
+        'foreign_keys': ['(account_id) REFERENCES financial_accounts(account_id)'],
+    },
+}
+
+INTERVALS = ('month', 'year')
+
+
+def configured_interval(table):
+    spec = TABLES[table]
+    interval = os.getenv(spec['interval_env'], spec['default_interval']).lower()
+    if interval not in INTERVALS:
+        raise ValueError(f"{spec['interval_env']} must be one of {', '.join(INTERVALS)}, got {interval!r}")
+    return interval
+
+
+def period_start(day, interval):
+    return date(day.year, day.month, 1) if interval == 'month' else date(day.year, 1, 1)
+
+
+def next_period(start, interval):
+    if interval == 'year':
+        return date(start.year + 1, 1, 1)
+    if start.month == 12:
+        return date(start.year + 1, 1, 1)
+    return date(start.year, start.month + 1, 1)
+
+
+def partition_name(table, start, interval):
+    if interval == 'year':
+        return f'{table}_p{start.year}'
+    return f'{table}_p{start.year}_{start.month:02d}'
+
+
+def _partition_start(table, name):
+    """Inverse of partition_name; None for the DEFAULT or foreign partitions"""
+    prefix = f'{table}_p'
+    if not name.startswith(prefix):
+        return None
+    parts = name[len(prefix):].split('_')
+    try:
+        return date(int(parts[0]), int(parts[1]) if len(parts) > 1 else 1, 1)
+    except (ValueError, IndexError):
+        return None
+
+
+def is_partitioned(cur, table):
+    cur.execute('''
+        SELECT c.relkind = 'p' AS partitioned
+        FROM pg_class c
+        WHERE c.oid = to_regclass(%s)
+    ''', (table,))
+    row = cur.fetchone()
+    return bool(row and row['partitioned'])
+
+
+def table_interval(cur, table):
+    """The interval recorded on a partitioned table, or the configured one"""
+    cur.execute("SELECT obj_description(to_regclass(%s), 'pg_class') AS comment", (table,))
+    row = cur.fetchone()
+    comment = (row and row['comment']) or ''
+    if 'interval=' in comment:
+        return comment.split('interval=')[-1].strip()
+    return configured_interval(table)
+
+
+def _record_interval(cur, table, column, interval):
+    cur.execute(f"COMMENT ON TABLE {table} IS 'range partitioned by {column}, interval={interval}'")
+
+
+def _as_date(value):
+    """The date of a partition column value; account_balance_history's is a TIMESTAMP"""
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _periods(start_date, end_date, interval):
+    """(start, end) bounds of every period overlapping start_date..end_date"""
+    start = period_start(_as_date(start_date), interval)
+    end_date = _as_date(end_date)
+    while start <= end_date:
+        end = next_period(start, interval)
+        yield start, end
+        start = end
+
+
+def _create_partition(cur, parent, column, name, start, end):
+    """Build a partition standalone and attach it, moving matching rows out of DEFAULT"""
+    default = f'{parent}_default'
+
+    cur.execute(f'CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    if _relation_exists(cur, default):
+        cur.execute(f'''
+            WITH moved AS (
+                DELETE FROM {default}
+                WHERE {column} >= %s AND {column} < %s
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        ''', (start, end))
+    cur.execute(f'ALTER TABLE {parent} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', (start, end))
+
+
+def _relation_exists(cur, name):
+    cur.execute('SELECT to_regclass(%s) IS NOT NULL AS present', (name,))
+    return cur.fetchone()['present']
+
+
+def ensure_partitions(cur, table, start_date, end_date):
+    """Create any missing partitions covering start_date..end_date; the caller commits.
+
+    Returns the names of the partitions created. A no-op for a table that is
+    not partitioned.
+    """
+    if start_date is None or end_date is None or not is_partitioned(cur, table):
+        return []
+
+    interval = table_interval(cur, table)
+    wanted = [
+        (partition_name(table, start, interval), start, end)
+        for start, end in _periods(start_date, end_date, interval)
+    ]
+
+    missing = [partition for partition in wanted if not _relation_exists(cur, partition[0])]
+    if not missing:
+        return []
+
+    # Serialize partition creation across the server and ETL workers
+    cur.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', (f'partitions:{table}',))
+    created = []
+    for name, start, end in missing:
+        if not _relation_exists(cur, name):
+            _create_partition(cur, table, TABLES[table]['column'], name, start, end)
+            created.append(name)
+    return created
+
+
+def ensure_partitions_for(cur, table, source, params=None):
+    """Create the partitions needed for every row of `source` before it is written"""
+    column = TABLES[table]['column']
+    cur.execute(f'SELECT MIN({column}) AS first, MAX({column}) AS last FROM {source}', params)
+    row = cur.fetchone()
+    return ensure_partitions(cur, table, row['first'], row['last'])
+
+
+def _future_end(table, interval, today):
+    """Start of the last period that should already exist"""
+    end = period_start(today, interval)
+    for _ in range(int(os.getenv(TABLES[table]['ahead_env'], '3'))):
+        end = next_period(end, interval)
+    return end
+
+
+def ensure_future_partitions(cur, table, today=None):
+    today = today or date.today()
+    return ensure_partitions(cur, table, today, _future_end(table, table_interval(cur, table), today))
+
+
+def init_partitions(cur, table):
+    """Called from init_db after the table is created; the caller commits.
+
+    A partitioned table gets its interval recorded, a DEFAULT partition and
+    its future partitions. A plain table that is upserted into gets a unique
+    index on the key, so the same ON CONFLICT target works before and after
+    migration.
+    """
+    spec = TABLES[table]
+    if is_partitioned(cur, table):
+        cur.execute("SELECT obj_description(to_regclass(%s), 'pg_class') AS comment", (table,))
+        if not cur.fetchone()['comment']:
+            _record_interval(cur, table, spec['column'], configured_interval(table))
+        cur.execute(f'CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT')
+        ensure_future_partitions(cur, table)
+    elif spec['upsert']:
+        key = ', '.join(spec['key'])
+        cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_upsert_key ON {table} ({key})")
+
+
+def maintain_partitions(conn, table):
+    """Create upcoming partitions ahead of time; returns the names created"""
+    cur = conn.cursor()
+    created = ensure_future_partitions(cur, table)
+    conn.commit()
+    cur.close()
+    return created
+
+
+def drop_empty_partitions(conn, table, before):
+    """Detach and drop partitions that end on or before `before` and hold no rows.
+
+    Used after pruning, so retention does not leave empty partitions behind.
+    Returns the names dropped.
+    """
+    cur = conn.cursor()
+    if not is_partitioned(cur, table):
+        cur.close()
+        return []
+
+    interval = table_interval(cur, table)
+    cur.execute('''
+        SELECT child.relname AS name
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(%s)
+        ORDER BY child.relname
+    ''', (table,))
+    names = [row['name'] for row in cur.fetchall()]
+
+    dropped = []
+    for name in names:
+        start = _partition_start(table, name)
+        if start is None or next_period(start, interval) > before:
+            continue
+        cur.execute(f'SELECT NOT EXISTS (SELECT 1 FROM {name}) AS empty')
+        if cur.fetchone()['empty']:
+            cur.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+            cur.execute(f'DROP TABLE {name}')
+            dropped.append(name)
+    conn.commit()
+    cur.close()
+    return dropped
+
+
+def _columns(cur, table):
+    cur.execute('''
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        ORDER BY ordinal_position
+    ''', (table,))
+    return [row['column_name'] for row in cur.fetchall()]
+
+
+def migrate_table(conn, table, log=print):
+    """Move a plain table onto a partitioned copy of itself without blocking writes.
+
+    1. Create `<table>_partitioned` with the same columns, partitioned by the
+       configured interval, with its key, foreign keys, indexes and partitions.
+    2. Install a trigger that mirrors every insert, update and delete on the
+       old table into the new one.
+    3. Copy the existing rows one partition range at a time, committing after
+       each. Source rows are read FOR SHARE, so a concurrent update or delete
+       waits for the batch holding its row and is then mirrored on top of it.
+    4. In one short transaction, drop the trigger and swap the table names.
+
+    The old table is kept as `<table>_unpartitioned` until it is dropped by
+    hand. Re-running after an interruption resumes the copy.
+    """
+    spec = TABLES[table]
+    column = spec['column']
+    key = ', '.join(spec['key'])
+    new = f'{table}_partitioned'
+    old = f'{table}_unpartitioned'
+    cur = conn.cursor()
+
+    if is_partitioned(cur, table):
+        log(f"{table} is already partitioned")
+        cur.close()
+        return False
+
+    cur.execute(f'SELECT COUNT(*) AS missing FROM {table} WHERE {column} IS NULL')
+    if cur.fetchone()['missing']:
+        cur.close()
+        raise ValueError(f"{table} has rows without a {column}; fix them before partitioning")
+
+    interval = configured_interval(table)
+    columns = _columns(cur, table)
+
+    if not _relation_exists(cur, new):
+        log(f"Creating {new} ({interval}ly partitions)")
+        cur.execute(f'CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS) PARTITION BY RANGE ({column})')
+        cur.execute(f'ALTER TABLE {new} ALTER COLUMN {column} SET NOT NULL')
+        cur.execute(f'ALTER TABLE {new} ADD PRIMARY KEY ({key})')
+        for foreign_key in spec['foreign_keys']:
+            cur.execute(f'ALTER TABLE {new} ADD FOREIGN KEY {foreign_key}')
+        for index, definition in spec['indexes'].items():
+            cur.execute(f'CREATE INDEX IF NOT EXISTS {index}_partitioned ON {new} {definition}')
+        _record_interval(cur, new, column, interval)
+        cur.execute(f'CREATE TABLE {new}_default PARTITION OF {new} DEFAULT')
+        conn.commit()
+
+    # Partitions already carry the names the final table will use
+    cur.execute(f'SELECT MIN({column}) AS first, MAX({column}) AS last FROM {table}')
+    bounds = cur.fetchone()
+    today = date.today()
+    first = min(_as_date(bounds['first']) or today, today)
+    for start, end in _periods(first, _future_end(table, interval, today), interval):
+        name = partition_name(table, start, interval)
+        if not _relation_exists(cur, name):
+            _create_partition(cur, new, column, name, start, end)
+    conn.commit()
+
+    key_match = ' AND '.join(f'{name} = OLD.{name}' for name in spec['key'])
+    updates = ', '.join(f'{name} = EXCLUDED.{name}' for name in columns if name not in spec['key'])
+    cur.execute(f'''
+        CREATE OR REPLACE FUNCTION {table}_partition_mirror() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM {new} WHERE {key_match};
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO {new} SELECT (NEW).*
+                ON CONFLICT ({key}) DO UPDATE SET {updates};
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    ''')
+    cur.execute(f'DROP TRIGGER IF EXISTS {table}_partition_mirror ON {table}')
+    cur.execute(f'''
+        CREATE TRIGGER {table}_partition_mirror
+        AFTER INSERT OR UPDATE OR DELETE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION {table}_partition_mirror()
+    ''')
+    conn.commit()
+    log(f"Mirroring writes on {table} into {new}")
+
+    if bounds['first'] is not None:
+        for start, end in _periods(bounds['first'], bounds['last'], interval):
+            cur.execute(f'''
+                INSERT INTO {new}
+                SELECT * FROM {table}
+                WHERE {column} >= %s AND {column} < %s
+                FOR SHARE
+                ON CONFLICT ({key}) DO NOTHING
+            ''', (start, end))
+            copied = cur.rowcount
+            conn.commit()
+            log(f"Copied {copied} rows for {start}..{end}")
+
+    sequence_cur = conn.cursor()
+    sequence_cur.execute("SELECT pg_get_serial_sequence(%s, 'id') AS sequence", (table,))
+    sequence = sequence_cur.fetchone()['sequence']
+    sequence_cur.close()
+
+    cur.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+    cur.execute(f'DROP TRIGGER {table}_partition_mirror ON {table}')
+    cur.execute(f'DROP FUNCTION {table}_partition_mirror()')
+    cur.execute(f'ALTER TABLE {table} RENAME TO {old}')
+    for index in spec['indexes']:
+        cur.execute(f'ALTER INDEX IF EXISTS {index} RENAME TO {index}_unpartitioned')
+        cur.execute(f'ALTER INDEX {index}_partitioned RENAME TO {index}')
+    cur.execute(f'ALTER INDEX IF EXISTS idx_{table}_upsert_key RENAME TO idx_{old}_upsert_key')
+    cur.execute(f'ALTER TABLE {new} RENAME TO {table}')
+    cur.execute(f'ALTER TABLE {new}_default RENAME TO {table}_default')
+    if sequence:
+        # Keep the id sequence alive when the old table is dropped
+        cur.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+    conn.commit()
+    cur.close()
+
+    log(f"{table} is now partitioned; the old table was kept as {old}")
+    return True
+
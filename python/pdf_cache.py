@@ -0,0 +1,266 @@
+"""
+Content-addressed on-disk cache of statement and report PDFs.
+
+PDFs are streamed from Plaid to the client and, as they pass through, into
+PDF_CACHE_DIR under the SHA-256 of their bytes, so a PDF is never held in
+memory whole and identical PDFs are stored once. The pdf_artifacts table maps
+what a PDF is of (a source key such as 'statement:<statement_id>') to its
+digest, so a repeat download is served from disk without calling Plaid, by
+whichever worker gets it. The table also records each PDF's size and when
+it was last downloaded, so the cache size is summed there rather than by
+walking the directory: once it grows past PDF_CACHE_MAX_BYTES the least
+recently downloaded files are evicted, and a key whose file was evicted is
+fetched from Plaid again. reconcile(), run at startup, is the only walk of
+the directory; it removes files the table doesn't know of, rows whose file
+is gone and stale partial downloads. Configuration is read from the
+environment:
+
+    PDF_CACHE_DIR          Cache directory (default pdf_cache next to this file)
+    PDF_CACHE_MAX_BYTES    Size the cache is trimmed to (default 1 GiB)
+
+Usage:
+    cached = pdf_cache.lookup(conn, 'statement:' + statement_id)
+    if cached is None:
+        upstream = client.statements_download(request, _preload_content=False)
+        chunks = pdf_cache.stream_into_cache('statement:' + statement_id, upstream)
+
+    pdf_cache.reconcile(conn)
+    pdf_cache.cache_stats()
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import db_pool
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+CHUNK_SIZE = 64 * 1024
+
+# Partial downloads left behind by a crashed worker are removed after this long
+STALE_PART_SECONDS = 3600
+
+_stats = {'hits': 0, 'misses': 0, 'stored': 0, 'evictions': 0}
+_stats_lock = threading.Lock()
+
+
+def cache_dir():
+    return os.getenv('PDF_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pdf_cache'))
+
+
+def max_bytes():
+    return int(os.getenv('PDF_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+
+
+def _count(stat, n=1):
+    with _stats_lock:
+        _stats[stat] += n
+
+
+def _path(digest):
+    return os.path.join(cache_dir(), digest[:2], f'{digest}.pdf')
+
+
+def create_tables(cur):
+    """Create the source key -> digest table; called from init_db"""
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS pdf_artifacts (
+            source_key VARCHAR(255) PRIMARY KEY,
+            digest CHAR(64) NOT NULL,
+            size BIGINT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cur.execute('''
+        ALTER TABLE pdf_artifacts ADD COLUMN IF NOT EXISTS last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ''')
+
+
+def lookup(conn, source_key):
+    """{'path', 'digest', 'size'} of a cached PDF, or None if it was never stored or was evicted"""
+    cur = conn.cursor()
+    # last_used_at orders eviction, so a download marks the PDF recently used
+    cur.execute('''
+        UPDATE pdf_artifacts SET last_used_at = CURRENT_TIMESTAMP
+        WHERE source_key = %s
+        RETURNING digest, size
+    ''', (source_key,))
+    row = cur.fetchone()
+    if row is not None and not os.path.exists(_path(row['digest'])):
+        # Evicted by another worker, or removed by hand; forget it so the
+        # recorded size stays that of the files on disk
+        cur.execute('DELETE FROM pdf_artifacts WHERE source_key = %s', (source_key,))
+        row = None
+    conn.commit()
+    cur.close()
+
+    if row is None:
+        _count('misses')
+        return None
+    _count('hits')
+    return {'path': _path(row['digest']), 'digest': row['digest'], 'size': row['size']}
+
+
+def _record(source_key, digest, size):
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            INSERT INTO pdf_artifacts (source_key, digest, size)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (source_key) DO UPDATE SET
+                digest = EXCLUDED.digest,
+                size = EXCLUDED.size,
+                created_at = CURRENT_TIMESTAMP,
+                last_used_at = CURRENT_TIMESTAMP
+        ''', (source_key, digest, size))
+        conn.commit()
+        cur.close()
+
+
+def stream_into_cache(source_key, upstream, chunk_size=CHUNK_SIZE):
+    """Yield the body of a urllib3 response (a Plaid call made with
+    _preload_content=False) chunk by chunk while writing it to the cache.
+
+    The file is only added, and `source_key` pointed at it, once the whole
+    body was read; a download that fails or is abandoned leaves nothing behind.
+    """
+    os.makedirs(cache_dir(), exist_ok=True)
+    part = tempfile.NamedTemporaryFile(dir=cache_dir(), suffix='.part', delete=False)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        for chunk in upstream.stream(chunk_size):
+            part.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+            yield chunk
+        part.close()
+    except BaseException:
+        # Plaid failed mid-body or the client went away: drop the partial
+        # file, and the upstream connection since its body wasn't read out
+        part.close()
+        os.unlink(part.name)
+        upstream.close()
+        raise
+    upstream.release_conn()
+
+    # The client already has every byte, so failing to cache only costs a
+    # Plaid call next time
+    try:
+        path = _path(digest.hexdigest())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            # Same bytes already cached under another key
+            os.unlink(part.name)
+        else:
+            os.replace(part.name, path)
+        _record(source_key, digest.hexdigest(), size)
+        _count('stored')
+        evict()
+    except Exception as e:
+        print(f"Warning: Could not cache PDF {source_key}: {e}")
+
+
+def evict(limit=None):
+    """Remove the least recently used PDFs until the cache fits in `limit` bytes; returns how many.
+
+    Sizes come from pdf_artifacts, where a PDF stored under several keys is
+    counted once and used as recently as its most recent key.
+    """
+    if limit is None:
+        limit = max_bytes()
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            WITH files AS (
+                SELECT digest, MAX(size) AS size, MAX(last_used_at) AS last_used_at
+                FROM pdf_artifacts
+                GROUP BY digest
+            ), ranked AS (
+                SELECT digest, SUM(size) OVER (ORDER BY last_used_at DESC, digest) AS kept
+                FROM files
+            )
+            DELETE FROM pdf_artifacts artifact
+            USING ranked
+            WHERE artifact.digest = ranked.digest AND ranked.kept > %s
+            RETURNING artifact.digest
+        ''', (limit,))
+        digests = {row['digest'] for row in cur.fetchall()}
+        conn.commit()
+        cur.close()
+
+    evicted = 0
+    for digest in digests:
+        try:
+            # Workers already sending the file keep their open handle
+            os.unlink(_path(digest))
+        except OSError:
+            continue
+        evicted += 1
+    if evicted:
+        _count('evictions', evicted)
+    return evicted
+
+
+def reconcile(conn):
+    """Bring the table and the cache directory back in line after a crash or a manual cleanup.
+
+    Removes files no row points at and stale partial downloads, and deletes
+    rows whose file is gone. Returns (files removed, rows deleted).
+    """
+    cur = conn.cursor()
+    cur.execute('SELECT DISTINCT digest FROM pdf_artifacts')
+    known = {row['digest'] for row in cur.fetchall()}
+    conn.commit()
+
+    removed = 0
+    present = set()
+    now = time.time()
+    for root, _, files in os.walk(cache_dir()):
+        for name in files:
+            path = os.path.join(root, name)
+            digest = name[:-len('.pdf')] if name.endswith('.pdf') else None
+            if digest in known:
+                present.add(digest)
+                continue
+            try:
+                if name.endswith('.part') and now - os.stat(path).st_mtime <= STALE_PART_SECONDS:
+                    # Possibly still being written by a running download
+                    continue
+                os.unlink(path)
+                removed += 1
+            except OSError:
+                pass
+
+    missing = list(known - present)
+    deleted = 0
+    if missing:
+        cur.execute('DELETE FROM pdf_artifacts WHERE digest = ANY(%s)', (missing,))
+        deleted = cur.rowcount
+    conn.commit()
+    cur.close()
+    return removed, deleted
+
+
+def cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT COUNT(*) AS files, COALESCE(SUM(size), 0) AS bytes
+            FROM (SELECT digest, MAX(size) AS size FROM pdf_artifacts GROUP BY digest) cached
+        ''')
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
+    lookups = stats['hits'] + stats['misses']
+    return dict(
+        stats,
+        hit_rate=round(stats['hits'] / lookups, 3) if lookups else None,
+        files=row['files'],
+        bytes=int(row['bytes']),
+        max_bytes=max_bytes(),
+    )
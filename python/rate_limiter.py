@@ -0,0 +1,259 @@
+"""
+Adaptive rate limiting for Plaid API calls.
+
+Every call made through RateLimitedPlaidApi takes a token from a bucket for
+its endpoint and a bucket for its (endpoint, item) pair before it is sent.
+When Plaid answers with RATE_LIMIT_EXCEEDED the call is retried with
+exponential backoff and jitter, and both buckets slow down. Successful calls
+speed them back up towards the configured ceiling, so throughput settles at
+whatever Plaid allows. Items are identified by a hash of their access token,
+and only the MAX_ITEM_BUCKETS most recently used item buckets are kept.
+Configuration is read from the environment; rates must be greater than 0:
+
+    PLAID_RATE_LIMIT                Requests/second per endpoint (default 25)
+    PLAID_ITEM_RATE_LIMIT           Requests/second per endpoint per item (default 5)
+    PLAID_RATE_LIMIT_<ENDPOINT>     Per-endpoint override, e.g. PLAID_RATE_LIMIT_TRANSACTIONS_SYNC
+    PLAID_RATE_LIMIT_MAX_RETRIES    Retries after RATE_LIMIT_EXCEEDED (default 5)
+    PLAID_RATE_LIMIT_BACKOFF        Base backoff in seconds (default 1)
+    PLAID_RATE_LIMIT_MAX_BACKOFF    Backoff ceiling in seconds (default 30)
+
+Usage:
+    client = RateLimitedPlaidApi(plaid_api.PlaidApi(api_client))
+    client.transactions_sync(request)   # throttled and retried
+
+    rate_limiter.limiter_stats()        # time spent throttled, per endpoint
+"""
+
+import functools
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import plaid
+
+# Per-item buckets kept; the least recently used are dropped past this and
+# start full again if their item calls again
+MAX_ITEM_BUCKETS = 10000
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """Exponential backoff with full jitter for the given retry attempt (0-based)"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def is_rate_limit_error(e):
+    if not isinstance(e, plaid.ApiException):
+        return False
+    if e.status == 429:
+        return True
+    try:
+        body = json.loads(e.body)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(body, dict) and body.get('error_type') == 'RATE_LIMIT_EXCEEDED'
+
+
+class TokenBucket:
+    """Token bucket whose refill rate adapts to rate-limit feedback"""
+
+    def __init__(self, rate, min_rate=None):
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate) if min_rate else self.max_rate / 20
+        self.rate = self.max_rate
+        self.capacity = max(self.max_rate, 1.0)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return how long the caller must wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def slow_down(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+
+    def speed_up(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RateLimiter:
+    """Per-endpoint and per-item token buckets with backoff on RATE_LIMIT_EXCEEDED"""
+
+    def __init__(self, rate=25.0, item_rate=5.0, max_retries=5, backoff=1.0, max_backoff=30.0,
+                 endpoint_rates=None):
+        self.rate = rate
+        self.item_rate = item_rate
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.endpoint_rates = endpoint_rates or {}
+
+        self._lock = threading.Lock()
+        self._endpoint_buckets = {}
+        self._item_buckets = OrderedDict()
+        self._stats = {}
+
+    def _buckets(self, endpoint, item_key):
+        with self._lock:
+            bucket = self._endpoint_buckets.get(endpoint)
+            if bucket is None:
+                bucket = TokenBucket(self.endpoint_rates.get(endpoint, self.rate))
+                self._endpoint_buckets[endpoint] = bucket
+                self._stats[endpoint] = {
+                    'calls': 0,
+                    'throttled_seconds': 0.0,
+                    'rate_limit_errors': 0,
+                    'retries': 0,
+                    'backoff_seconds': 0.0,
+                }
+            buckets = [bucket]
+            if item_key is not None:
+                item_bucket = self._item_buckets.get((endpoint, item_key))
+                if item_bucket is None:
+                    item_bucket = TokenBucket(min(self.item_rate, bucket.max_rate))
+                    self._item_buckets[(endpoint, item_key)] = item_bucket
+                    if len(self._item_buckets) > MAX_ITEM_BUCKETS:
+                        self._item_buckets.popitem(last=False)
+                else:
+                    self._item_buckets.move_to_end((endpoint, item_key))
+                buckets.append(item_bucket)
+            return buckets
+
+    def _record(self, endpoint, **deltas):
+        with self._lock:
+            stats = self._stats[endpoint]
+            for key, value in deltas.items():
+                stats[key] += value
+
+    def call(self, endpoint, item_key, func, *args, **kwargs):
+        """Call func once tokens are available, retrying on rate-limit errors"""
+        buckets = self._buckets(endpoint, item_key)
+        attempt = 0
+        while True:
+            wait = max(bucket.reserve() for bucket in buckets)
+            if wait > 0:
+                time.sleep(wait)
+            self._record(endpoint, calls=1, throttled_seconds=wait)
+
+            try:
+                result = func(*args, **kwargs)
+            except plaid.ApiException as e:
+                if not is_rate_limit_error(e):
+                    raise
+                for bucket in buckets:
+                    bucket.slow_down()
+                self._record(endpoint, rate_limit_errors=1)
+                if attempt >= self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, self.backoff, self.max_backoff)
+                self._record(endpoint, retries=1, backoff_seconds=delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            for bucket in buckets:
+                bucket.speed_up()
+            return result
+
+    def stats(self):
+        with self._lock:
+            endpoints = {
+                endpoint: dict(
+                    stats,
+                    throttled_seconds=round(stats['throttled_seconds'], 3),
+                    backoff_seconds=round(stats['backoff_seconds'], 3),
+                    current_rate=round(self._endpoint_buckets[endpoint].rate, 3),
+                )
+                for endpoint, stats in self._stats.items()
+            }
+        return {
+            'throttled_seconds': round(sum(s['throttled_seconds'] + s['backoff_seconds'] for s in endpoints.values()), 3),
+            'rate_limit_errors': sum(s['rate_limit_errors'] for s in endpoints.values()),
+            'endpoints': endpoints,
+        }
+
+
+def _request_item_key(args, kwargs):
+    """The per-item key of a Plaid request: a hash of its access_token, so tokens aren't kept in memory"""
+    for request in list(args) + list(kwargs.values()):
+        try:
+            access_token = request.get('access_token')
+        except Exception:
+            continue
+        if access_token:
+            return hashlib.sha256(access_token.encode()).hexdigest()
+    return None
+
+
+class RateLimitedPlaidApi:
+    """Wraps a PlaidApi client so every API method goes through the rate limiter"""
+
+    def __init__(self, client, limiter=None):
+        self._client = client
+        self._limiter = limiter or get_limiter()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            return self._limiter.call(name, _request_item_key(args, kwargs), attr, *args, **kwargs)
+        return call
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def _rate(name, value):
+    """A requests/second setting, which must be positive"""
+    rate = float(value)
+    if rate <= 0:
+        raise ValueError(f"{name} must be greater than 0, got {value!r}")
+    return rate
+
+
+def _endpoint_rates():
+    prefix = 'PLAID_RATE_LIMIT_'
+    reserved = {'MAX_RETRIES', 'BACKOFF', 'MAX_BACKOFF'}
+    return {
+        key[len(prefix):].lower(): _rate(key, value)
+        for key, value in os.environ.items()
+        if key.startswith(prefix) and key[len(prefix):] not in reserved
+    }
+
+
+def get_limiter():
+    """Return the process-wide limiter, creating it on first use"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(
+                rate=_rate('PLAID_RATE_LIMIT', os.getenv('PLAID_RATE_LIMIT', '25')),
+                item_rate=_rate('PLAID_ITEM_RATE_LIMIT', os.getenv('PLAID_ITEM_RATE_LIMIT', '5')),
+                max_retries=int(os.getenv('PLAID_RATE_LIMIT_MAX_RETRIES', '5')),
+                backoff=float(os.getenv('PLAID_RATE_LIMIT_BACKOFF', '1')),
+                max_backoff=float(os.getenv('PLAID_RATE_LIMIT_MAX_BACKOFF', '30')),
+                endpoint_rates=_endpoint_rates(),
+            )
+        return _limiter
+
+
+def limiter_stats():
+    return get_limiter().stats()
@@ -0,0 +1,309 @@
+"""
+Asynchronous Plaid report jobs.
+
+Asset Reports and Plaid Check (CRA) reports take seconds to minutes to
+generate. Rather than polling Plaid from the request thread, an endpoint
+starts the report, records it in report_jobs, queues a `poll_report` job on
+the job queue and returns the report's id right away. The poll_report
+handler asks Plaid once per run: while the report is not ready
+(PRODUCT_NOT_READY) it puts its job back on the queue with exponential
+backoff (job_queue.RetryLater), and once it is ready it stores the response
+on the report_jobs row. Clients poll GET /api/report_jobs/<id>, which only
+reads that row. Report PDFs are not part of the result; they are streamed
+on request through the PDF cache (see pdf_cache.py and PDF_DOWNLOADS).
+Configuration is read from the environment:
+
+    REPORT_POLL_BASE_DELAY    Seconds before the first poll; doubles with every poll (default 2)
+    REPORT_POLL_MAX_DELAY     Ceiling of the delay between polls (default 60)
+    REPORT_POLL_TIMEOUT       Seconds after which a report that is still not ready fails (default 1800)
+    REPORT_POLLER_THREADS     poll_report workers a server process starts on its first report
+                              (default 1; 0 leaves them to `etl.py queue_worker` or the ETL daemon)
+
+Usage:
+    report_id = report_jobs.start(conn, 'asset_report', item_id, {'asset_report_token': token})
+    report = report_jobs.get_report(conn, report_id)
+
+    job_queue.run_workers({'poll_report': lambda job: report_jobs.handle_poll_job(job, client)}, ...)
+"""
+
+import json
+import os
+import random
+import threading
+
+import plaid
+
+import db_pool
+import job_queue
+
+JOB_TYPE = 'poll_report'
+
+DEFAULT_BASE_DELAY = 2
+DEFAULT_MAX_DELAY = 60
+DEFAULT_TIMEOUT = 1800
+
+
+def _fetch_asset_report(client, params):
+    from plaid.model.asset_report_get_request import AssetReportGetRequest
+
+    response = client.asset_report_get(AssetReportGetRequest(asset_report_token=params['asset_report_token']))
+    return {'error': None, 'json': response['report'].to_dict()}
+
+
+def _fetch_cra_base_report(client, params):
+    from plaid.model.cra_check_report_base_report_get_request import CraCheckReportBaseReportGetRequest
+
+    response = client.cra_check_report_base_report_get(
+        CraCheckReportBaseReportGetRequest(user_token=params['user_token'], item_ids=[]))
+    return {'report': response.to_dict()['report']}
+
+
+def _fetch_cra_income_insights(client, params):
+    from plaid.model.cra_check_report_income_insights_get_request import CraCheckReportIncomeInsightsGetRequest
+
+    response = client.cra_check_report_income_insights_get(
+        CraCheckReportIncomeInsightsGetRequest(user_token=params['user_token']))
+    return {'report': response.to_dict()['report']}
+
+
+def _fetch_cra_partner_insights(client, params):
+    from plaid.model.cra_check_report_partner_insights_get_request import CraCheckReportPartnerInsightsGetRequest
+
+    response = client.cra_check_report_partner_insights_get(
+        CraCheckReportPartnerInsightsGetRequest(user_token=params['user_token']))
+    return response.to_dict()
+
+
+# Report type -> function fetching the finished report as the endpoint's response body.
+# Model imports are deferred so a deployment only loads the ones it uses
+FETCHERS = {
+    'asset_report': _fetch_asset_report,
+    'cra_base_report': _fetch_cra_base_report,
+    'cra_income_insights': _fetch_cra_income_insights,
+    'cra_partner_insights': _fetch_cra_partner_insights,
+}
+
+
+def _download_asset_report_pdf(client, params, **kwargs):
+    from plaid.model.asset_report_pdf_get_request import AssetReportPDFGetRequest
+
+    return client.asset_report_pdf_get(
+        AssetReportPDFGetRequest(asset_report_token=params['asset_report_token']), **kwargs)
+
+
+def _download_cra_base_report_pdf(client, params, **kwargs):
+    from plaid.model.cra_check_report_pdf_get_request import CraCheckReportPDFGetRequest
+
+    return client.cra_check_report_pdf_get(CraCheckReportPDFGetRequest(user_token=params['user_token']), **kwargs)
+
+
+def _download_cra_income_insights_pdf(client, params, **kwargs):
+    from plaid.model.cra_check_report_pdf_get_request import CraCheckReportPDFGetRequest
+    from plaid.model.cra_pdf_add_ons import CraPDFAddOns
+
+    return client.cra_check_report_pdf_get(
+        CraCheckReportPDFGetRequest(user_token=params['user_token'], add_ons=[CraPDFAddOns('cra_income_insights')]),
+        **kwargs)
+
+
+# Report type -> function making the Plaid call for the report's PDF, passing
+# kwargs such as _preload_content=False through; partner insights have none
+PDF_DOWNLOADS = {
+    'asset_report': _download_asset_report_pdf,
+    'cra_base_report': _download_cra_base_report_pdf,
+    'cra_income_insights': _download_cra_income_insights_pdf,
+}
+
+
+def create_tables(cur):
+    """Create the report_jobs table; called from init_db after sync_jobs"""
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS report_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            report_type VARCHAR(50) NOT NULL,
+            item_id VARCHAR(255) REFERENCES plaid_items(item_id),
+            params JSONB NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            polls INTEGER NOT NULL DEFAULT 0,
+            result JSONB,
+            error JSONB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP
+        )
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_report_jobs_pending
+        ON report_jobs (created_at) WHERE status = 'pending'
+    ''')
+
+
+def start(conn, report_type, item_id, params):
+    """Record a report and queue its first poll; commits and returns the report id"""
+    if report_type not in FETCHERS:
+        raise ValueError(f'Unknown report type: {report_type}')
+    cur = conn.cursor()
+    cur.execute('''
+        INSERT INTO report_jobs (report_type, item_id, params)
+        VALUES (%s, %s, %s)
+        RETURNING id
+    ''', (report_type, item_id, json.dumps(params, default=str)))
+    report_id = cur.fetchone()['id']
+    cur.close()
+    # Queued without an item so polls of several reports of one item don't coalesce
+    job_queue.enqueue(conn, JOB_TYPE, None, {'report_id': report_id})
+    return report_id
+
+
+def get_report(conn, report_id):
+    """A report's status, and its result or error once finished; None if it doesn't exist"""
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT id, report_type, item_id, params, status, polls, result, error,
+               created_at, updated_at, completed_at
+        FROM report_jobs
+        WHERE id = %s
+    ''', (report_id,))
+    report = cur.fetchone()
+    cur.close()
+    return report
+
+
+def _finish(conn, report_id, status, result=None, error=None):
+    cur = conn.cursor()
+    cur.execute('''
+        UPDATE report_jobs
+        SET status = %s, result = %s, error = %s,
+            completed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+    ''', (status, json.dumps(result, default=str) if result is not None else None,
+          json.dumps(error, default=str) if error is not None else None, report_id))
+    conn.commit()
+    cur.close()
+
+
+def _count_poll(conn, report_id):
+    """Record a poll that found the report not ready; returns (polls, seconds since start)"""
+    cur = conn.cursor()
+    cur.execute('''
+        UPDATE report_jobs
+        SET polls = polls + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+        RETURNING polls, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - created_at) AS age
+    ''', (report_id,))
+    row = cur.fetchone()
+    conn.commit()
+    cur.close()
+    return row['polls'], float(row['age'])
+
+
+def _plaid_error(e):
+    """A Plaid error in the {'status_code', 'display_message', ...} shape endpoints return"""
+    try:
+        body = json.loads(e.body)
+    except (TypeError, ValueError):
+        body = {}
+    return {
+        'status_code': e.status,
+        'display_message': body.get('error_message', str(e)),
+        'error_code': body.get('error_code'),
+        'error_type': body.get('error_type'),
+    }
+
+
+def _is_not_ready(e):
+    try:
+        return json.loads(e.body).get('error_code') == 'PRODUCT_NOT_READY'
+    except (TypeError, ValueError, AttributeError):
+        return False
+
+
+def poll_delay(polls):
+    """Seconds before the next poll after `polls` unsuccessful ones, with jitter"""
+    base = float(os.getenv('REPORT_POLL_BASE_DELAY', DEFAULT_BASE_DELAY))
+    cap = float(os.getenv('REPORT_POLL_MAX_DELAY', DEFAULT_MAX_DELAY))
+    return min(cap, base * 2 ** max(0, polls - 1)) + random.uniform(0, base)
+
+
+def poll(conn, client, report_id):
+    """Ask Plaid for a pending report once and store it if it is ready.
+
+    Returns the report's status afterwards; raises job_queue.RetryLater with
+    the backoff delay while it is not ready.
+    """
+    cur = conn.cursor()
+    cur.execute('SELECT id, report_type, params, status FROM report_jobs WHERE id = %s', (report_id,))
+    report = cur.fetchone()
+    cur.close()
+    conn.commit()
+    if report is None or report['status'] != 'pending':
+        return report['status'] if report else None
+
+    try:
+        result = FETCHERS[report['report_type']](client, report['params'])
+    except plaid.ApiException as e:
+        if not _is_not_ready(e):
+            _finish(conn, report_id, 'failed', error=_plaid_error(e))
+            return 'failed'
+        polls, age = _count_poll(conn, report_id)
+        timeout = float(os.getenv('REPORT_POLL_TIMEOUT', DEFAULT_TIMEOUT))
+        if age >= timeout:
+            _finish(conn, report_id, 'failed', error={
+                'status_code': 504,
+                'display_message': f'The report was not ready after {int(timeout)}s',
+                'error_code': 'PRODUCT_NOT_READY',
+                'error_type': 'API_ERROR',
+            })
+            return 'failed'
+        raise job_queue.RetryLater(f'Report {report_id} not ready after {polls} polls', delay=poll_delay(polls))
+
+    _finish(conn, report_id, 'ready', result=result)
+    return 'ready'
+
+
+def handle_poll_job(job, client, log=print):
+    """Queue handler for poll_report jobs"""
+    report_id = job['payload']['report_id']
+    with db_pool.connection() as conn:
+        try:
+            status = poll(conn, client, report_id)
+        except job_queue.RetryLater:
+            raise
+        except Exception as e:
+            # Out of attempts: fail the report rather than leave clients polling forever
+            if job['attempts'] >= job['max_attempts']:
+                conn.rollback()
+                _finish(conn, report_id, 'failed', error={
+                    'status_code': 500,
+                    'display_message': f'Could not fetch the report: {e}',
+                    'error_code': 'INTERNAL_SERVER_ERROR',
+                    'error_type': 'API_ERROR',
+                })
+            raise
+    if status is not None:
+        log(f"Report {report_id} {status}")
+
+
+_poller_stop = threading.Event()
+_poller_pid = None
+_poller_lock = threading.Lock()
+
+
+def ensure_poller(client, log=print):
+    """Start this process's poll_report workers (REPORT_POLLER_THREADS) if not running yet"""
+    global _poller_pid
+    threads = int(os.getenv('REPORT_POLLER_THREADS', '1'))
+    if threads <= 0:
+        return
+    with _poller_lock:
+        # Threads don't survive fork(), so each worker process starts its own
+        if _poller_pid == os.getpid():
+            return
+        _poller_pid = os.getpid()
+        threading.Thread(
+            target=job_queue.run_workers,
+            args=({JOB_TYPE: lambda job: handle_poll_job(job, client, log)}, threads, _poller_stop),
+            kwargs={'log': log},
+            name='report-poller',
+            daemon=True,
+        ).start()
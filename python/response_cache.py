@@ -0,0 +1,291 @@
+"""
+TTL response cache for the Plaid passthrough endpoints.
+
+Responses of /api/accounts, /api/item, /api/auth, /api/identity,
+/api/holdings and /api/statements are cached per (item, endpoint), so
+repeated page loads are served without a Plaid round trip. Entries expire
+after a per-endpoint TTL and are dropped early when a webhook reports that
+the item's data changed (see invalidate_for_webhook). Configuration is read
+from the environment:
+
+    RESPONSE_CACHE_BACKEND          'memory', 'postgres' or 'none' (default memory, or postgres
+                                    when SERVER_WORKERS/WEB_CONCURRENCY configures several workers)
+    RESPONSE_CACHE_MAX_ENTRIES      Entries kept before least recently used ones are evicted (default 256)
+    RESPONSE_CACHE_TTL_<ENDPOINT>   Per-endpoint TTL in seconds, e.g. RESPONSE_CACHE_TTL_ACCOUNTS; 0 disables
+
+The memory backend is per process. With several server workers the
+postgres backend is used unless another one is set: it keeps entries in the
+response_cache table, so every worker shares them and a webhook received by
+one worker invalidates them for all.
+
+Usage:
+    body = response_cache.get(item_id, 'accounts')
+    if body is None:
+        body = ...
+        response_cache.put(item_id, 'accounts', body)
+
+    response_cache.invalidate_for_webhook(item_id, webhook_type)
+    response_cache.cache_stats()
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import db_pool
+
+DEFAULT_MAX_ENTRIES = 256
+
+# Default TTL in seconds per cached endpoint
+DEFAULT_TTLS = {
+    'accounts': 900,
+    'item': 3600,
+    'auth': 86400,
+    'identity': 86400,
+    'holdings': 3600,
+    'statements': 86400,
+}
+
+# Webhook type -> cached endpoints it makes stale; None means all of them
+WEBHOOK_INVALIDATIONS = {
+    'TRANSACTIONS': ('accounts',),
+    'ITEM': None,
+    'AUTH': ('auth',),
+    'IDENTITY': ('identity',),
+    'HOLDINGS': ('holdings', 'accounts'),
+    'INVESTMENTS_TRANSACTIONS': ('holdings',),
+    'STATEMENTS': ('statements',),
+}
+
+
+class MemoryBackend:
+    """Size-bounded LRU of (expires_at, value) in this process"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, item_id, endpoints):
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == item_id and key[1] in endpoints]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class PostgresBackend:
+    """Entries in the response_cache table, shared by every process"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.evictions = 0
+
+    def get(self, key):
+        with db_pool.connection() as conn:
+            cur = conn.cursor()
+            # Reading an entry marks it recently used
+            cur.execute('''
+                UPDATE response_cache
+                SET accessed_at = CURRENT_TIMESTAMP
+                WHERE item_id = %s AND endpoint = %s AND expires_at > CURRENT_TIMESTAMP
+                RETURNING body
+            ''', key)
+            row = cur.fetchone()
+            conn.commit()
+            cur.close()
+        return row['body'] if row else None
+
+    def set(self, key, value, ttl):
+        with db_pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                INSERT INTO response_cache (item_id, endpoint, body, expires_at)
+                VALUES (%s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+                ON CONFLICT (item_id, endpoint) DO UPDATE SET
+                    body = EXCLUDED.body,
+                    expires_at = EXCLUDED.expires_at,
+                    accessed_at = CURRENT_TIMESTAMP
+            ''', key + (value, ttl))
+            cur.execute('''
+                DELETE FROM response_cache
+                WHERE expires_at <= CURRENT_TIMESTAMP
+                   OR (item_id, endpoint) IN (
+                       SELECT item_id, endpoint FROM response_cache
+                       ORDER BY accessed_at DESC
+                       OFFSET %s
+                   )
+            ''', (self.max_entries,))
+            self.evictions += cur.rowcount
+            conn.commit()
+            cur.close()
+
+    def delete(self, item_id, endpoints):
+        with db_pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                'DELETE FROM response_cache WHERE item_id = %s AND endpoint = ANY(%s)',
+                (item_id, list(endpoints))
+            )
+            deleted = cur.rowcount
+            conn.commit()
+            cur.close()
+        return deleted
+
+    def size(self):
+        with db_pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT COUNT(*) AS entries FROM response_cache WHERE expires_at > CURRENT_TIMESTAMP')
+            entries = cur.fetchone()['entries']
+            cur.close()
+        return entries
+
+
+def create_tables(cur):
+    """Create the table behind the postgres backend; called from init_db"""
+    cur.execute('''
+        CREATE UNLOGGED TABLE IF NOT EXISTS response_cache (
+            item_id VARCHAR(255) NOT NULL,
+            endpoint VARCHAR(50) NOT NULL,
+            body TEXT NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            accessed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (item_id, endpoint)
+        )
+    ''')
+
+
+class ResponseCache:
+    """Per-item, per-endpoint TTL cache in front of a backend"""
+
+    def __init__(self, backend, ttls):
+        self.backend = backend
+        self.ttls = ttls
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def _count(self, stat, n=1):
+        with self._lock:
+            self._stats[stat] += n
+
+    def enabled(self, item_id, endpoint):
+        return self.backend is not None and item_id is not None and self.ttls.get(endpoint, 0) > 0
+
+    def get(self, item_id, endpoint):
+        if not self.enabled(item_id, endpoint):
+            return None
+        value = self.backend.get((item_id, endpoint))
+        self._count('hits' if value is not None else 'misses')
+        return value
+
+    def set(self, item_id, endpoint, value):
+        if self.enabled(item_id, endpoint):
+            self.backend.set((item_id, endpoint), value, self.ttls[endpoint])
+
+    def invalidate(self, item_id, endpoints=None):
+        """Drop an item's cached responses, or only those of some endpoints"""
+        if self.backend is None or item_id is None:
+            return 0
+        deleted = self.backend.delete(item_id, tuple(endpoints or self.ttls))
+        self._count('invalidations', deleted)
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        return dict(
+            stats,
+            backend=type(self.backend).__name__ if self.backend else None,
+            hit_rate=round(stats['hits'] / lookups, 3) if lookups else None,
+            evictions=self.backend.evictions if self.backend else 0,
+            entries=self.backend.size() if self.backend else 0,
+            ttls=self.ttls,
+        )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _ttls():
+    return {
+        endpoint: int(os.getenv(f'RESPONSE_CACHE_TTL_{endpoint.upper()}', default))
+        for endpoint, default in DEFAULT_TTLS.items()
+    }
+
+
+def configured_workers():
+    """Server worker processes configured for this deployment (see gunicorn.conf.py)"""
+    return int(os.getenv('SERVER_WORKERS') or os.getenv('WEB_CONCURRENCY') or 1)
+
+
+def backend_name():
+    """The configured backend, defaulting to postgres when workers can't share a memory cache"""
+    default = 'postgres' if configured_workers() > 1 else 'memory'
+    return (os.getenv('RESPONSE_CACHE_BACKEND') or default).lower()
+
+
+def get_cache():
+    """Return the process-wide cache, creating it on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            name = backend_name()
+            max_entries = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+            if name == 'postgres':
+                backend = PostgresBackend(max_entries)
+            elif name == 'none':
+                backend = None
+            else:
+                backend = MemoryBackend(max_entries)
+            _cache = ResponseCache(backend, _ttls())
+        return _cache
+
+
+def get(item_id, endpoint):
+    return get_cache().get(item_id, endpoint)
+
+
+def put(item_id, endpoint, value):
+    get_cache().set(item_id, endpoint, value)
+
+
+def invalidate(item_id, endpoints=None):
+    return get_cache().invalidate(item_id, endpoints)
+
+
+def invalidate_for_webhook(item_id, webhook_type):
+    """Drop the cached responses a webhook makes stale; returns how many were dropped"""
+    if webhook_type not in WEBHOOK_INVALIDATIONS:
+        return 0
+    return invalidate(item_id, WEBHOOK_INVALIDATIONS[webhook_type])
+
+
+def cache_stats():
+    return get_cache().stats()
@@ -0,0 +1,45 @@
+"""
+Per-product API routes.
+
+Each module defines a Flask blueprint `bp` with the endpoints of one Plaid
+product, and imports the plaid.model request classes only that product uses.
+register_blueprints() imports and registers just the modules whose products
+are in PLAID_PRODUCTS, so a transactions-only deployment never loads the
+payment initiation, transfer, CRA, ... models. The endpoints every product
+uses (link tokens, accounts, balance, item, webhooks) stay in server.py.
+
+Usage:
+    routes.register_blueprints(app, PLAID_PRODUCTS)
+"""
+
+import importlib
+
+# Blueprint module -> products that enable it
+BLUEPRINTS = {
+    'transactions': ('transactions',),
+    'auth': ('auth',),
+    'identity': ('identity',),
+    'assets': ('assets',),
+    'investments': ('investments',),
+    'transfer': ('transfer',),
+    'statements': ('statements',),
+    'signal': ('signal',),
+    'payment_initiation': ('payment_initiation',),
+    'cra': ('cra_base_report', 'cra_income_insights', 'cra_partner_insights'),
+    'report_jobs': ('assets', 'cra_base_report', 'cra_income_insights', 'cra_partner_insights'),
+}
+
+
+def enabled_blueprints(products):
+    """Names of the blueprint modules enabled by any of `products`"""
+    return [name for name, enabling in BLUEPRINTS.items()
+            if any(product in enabling for product in products)]
+
+
+def register_blueprints(app, products):
+    """Import and register the blueprints of `products`; returns their names"""
+    names = enabled_blueprints(products)
+    for name in names:
+        module = importlib.import_module(f'{__name__}.{name}')
+        app.register_blueprint(module.bp)
+    return names
@@ -0,0 +1,55 @@
+"""Assets: Asset Report JSON and PDF"""
+
+from flask import Blueprint, jsonify
+import plaid
+from plaid.model.asset_report_create_request import AssetReportCreateRequest
+from plaid.model.asset_report_create_request_options import AssetReportCreateRequestOptions
+from plaid.model.asset_report_user import AssetReportUser
+from server_common import (
+    client, get_current_item, start_report_job,
+    format_error,
+)
+from structured_log import log_response
+
+bp = Blueprint('assets', __name__)
+
+
+# Create an Asset Report for one or more Items and return a report job to
+# poll at /api/report_jobs/<job_id>. Note that an Asset Report can contain up
+# to 100 items, but for simplicity we're only including one Item here.
+# https://plaid.com/docs/#assets
+
+
+@bp.route('/api/assets', methods=['GET'])
+def get_assets():
+    try:
+        item = get_current_item()
+        access_token = item['access_token'] if item else None
+        asset_request = AssetReportCreateRequest(
+            access_tokens=[access_token],
+            days_requested=60,
+            options=AssetReportCreateRequestOptions(
+                webhook='https://www.example.com',
+                client_report_id='123',
+                user=AssetReportUser(
+                    client_user_id='789',
+                    first_name='Jane',
+                    middle_name='Leah',
+                    last_name='Doe',
+                    ssn='123-45-6789',
+                    phone_number='(555) 123-4567',
+                    email='jane.doe@example.com',
+                )
+            )
+        )
+
+        response = client.asset_report_create(asset_request)
+        log_response(response.to_dict())
+
+        # The report is fetched by a report job once Plaid has generated it
+        return start_report_job('asset_report', item['item_id'] if item else None, {
+            'asset_report_token': response['asset_report_token'],
+        })
+    except plaid.ApiException as e:
+        error_response = format_error(e)
+        return jsonify(error_response)
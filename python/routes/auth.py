@@ -0,0 +1,34 @@
+"""Auth: account and routing numbers"""
+
+from flask import Blueprint, jsonify
+import plaid
+from plaid.model.auth_get_request import AuthGetRequest
+from server_common import (
+    client, get_access_token_from_db, cached_plaid_response,
+    format_error,
+)
+from structured_log import log_response
+
+bp = Blueprint('auth', __name__)
+
+
+# Retrieve ACH or ETF account numbers for an Item
+# https://plaid.com/docs/#auth
+
+
+@bp.route('/api/auth', methods=['GET'])
+def get_auth():
+    def fetch():
+        access_token = get_access_token_from_db()
+        auth_request = AuthGetRequest(
+            access_token=access_token
+        )
+        response = client.auth_get(auth_request)
+        log_response(response.to_dict())
+        return response.to_dict()
+
+    try:
+        return cached_plaid_response('auth', fetch)
+    except plaid.ApiException as e:
+        error_response = format_error(e)
+        return jsonify(error_response)
@@ -0,0 +1,32 @@
+"""Plaid Check (CRA): base report, income insights and partner insights"""
+
+from flask import Blueprint
+from server_common import demo_state, get_item_id_from_db, start_report_job
+
+bp = Blueprint('cra', __name__)
+
+
+# Plaid Check reports are generated after Link; each endpoint starts a report
+# job that fetches the report once it is ready and returns its id to poll at
+# /api/report_jobs/<job_id>
+
+
+# Retrieve CRA Base Report and PDF
+# Base report: https://plaid.com/docs/check/api/#cracheck_reportbase_reportget
+# PDF: https://plaid.com/docs/check/api/#cracheck_reportpdfget
+@bp.route('/api/cra/get_base_report', methods=['GET'])
+def cra_check_report():
+    return start_report_job('cra_base_report', get_item_id_from_db(), {'user_token': demo_state['user_token']})
+
+# Retrieve CRA Income Insights and PDF with Insights
+# Income insights: https://plaid.com/docs/check/api/#cracheck_reportincome_insightsget
+# PDF w/ income insights: https://plaid.com/docs/check/api/#cracheck_reportpdfget
+@bp.route('/api/cra/get_income_insights', methods=['GET'])
+def cra_income_insights():
+    return start_report_job('cra_income_insights', get_item_id_from_db(), {'user_token': demo_state['user_token']})
+
+# Retrieve CRA Partner Insights
+# https://plaid.com/docs/check/api/#cracheck_reportpartner_insightsget
+@bp.route('/api/cra/get_partner_insights', methods=['GET'])
+def cra_partner_insights():
+    return start_report_job('cra_partner_insights', get_item_id_from_db(), {'user_token': demo_state['user_token']})
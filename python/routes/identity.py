@@ -0,0 +1,34 @@
+"""Identity: account holder names, addresses, emails and phone numbers"""
+
+from flask import Blueprint, jsonify
+import plaid
+from plaid.model.identity_get_request import IdentityGetRequest
+from server_common import (
+    client, get_access_token_from_db, cached_plaid_response,
+    format_error,
+)
+from structured_log import log_response
+
+bp = Blueprint('identity', __name__)
+
+
+# Retrieve Identity data for an Item
+# https://plaid.com/docs/#identity
+
+
+@bp.route('/api/identity', methods=['GET'])
+def get_identity():
+    def fetch():
+        access_token = get_access_token_from_db()
+        identity_request = IdentityGetRequest(
+            access_token=access_token
+        )
+        response = client.identity_get(identity_request)
+        log_response(response.to_dict())
+        return {'error': None, 'identity': response.to_dict()['accounts']}
+
+    try:
+        return cached_plaid_response('identity', fetch)
+    except plaid.ApiException as e:
+        error_response = format_error(e)
+        return jsonify(error_response)
@@ -0,0 +1,65 @@
+"""Investments: holdings and investment transactions"""
+
+import datetime as dt
+
+from flask import Blueprint, jsonify
+import plaid
+from plaid.model.investments_transactions_get_request_options import InvestmentsTransactionsGetRequestOptions
+from plaid.model.investments_transactions_get_request import InvestmentsTransactionsGetRequest
+from plaid.model.investments_holdings_get_request import InvestmentsHoldingsGetRequest
+from server_common import (
+    client, get_access_token_from_db, cached_plaid_response,
+    format_error,
+)
+from structured_log import log_response
+
+bp = Blueprint('investments', __name__)
+
+
+# Retrieve investment holdings data for an Item
+# https://plaid.com/docs/#investments
+
+
+@bp.route('/api/holdings', methods=['GET'])
+def get_holdings():
+    def fetch():
+        access_token = get_access_token_from_db()
+        holdings_request = InvestmentsHoldingsGetRequest(access_token=access_token)
+        response = client.investments_holdings_get(holdings_request)
+        log_response(response.to_dict())
+        return {'error': None, 'holdings': response.to_dict()}
+
+    try:
+        return cached_plaid_response('holdings', fetch)
+    except plaid.ApiException as e:
+        error_response = format_error(e)
+        return jsonify(error_response)
+
+
+# Retrieve Investment Transactions for an Item
+# https://plaid.com/docs/#investments
+
+
+@bp.route('/api/investments_transactions', methods=['GET'])
+def get_investments_transactions():
+    # Pull transactions for the last 30 days
+    access_token = get_access_token_from_db()
+    start_date = (dt.datetime.now() - dt.timedelta(days=(30)))
+    end_date = dt.datetime.now()
+    try:
+        options = InvestmentsTransactionsGetRequestOptions()
+        inv_txn_request = InvestmentsTransactionsGetRequest(
+            access_token=access_token,
+            start_date=start_date.date(),
+            end_date=end_date.date(),
+            options=options
+        )
+        response = client.investments_transactions_get(
+            inv_txn_request)
+        log_response(response.to_dict())
+        return jsonify(
+            {'error': None, 'investments_transactions': response.to_dict()})
+
+    except plaid.ApiException as e:
+        error_response = format_error(e)
+        return jsonify(error_response)
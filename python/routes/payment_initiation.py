@@ -0,0 +1,107 @@
+"""Payment Initiation (UK and Europe): create and retrieve a payment"""
+
+import json
+import time
+
+from flask import Blueprint, jsonify
+import plaid
+from plaid.model.payment_amount import PaymentAmount
+from plaid.model.payment_amount_currency import PaymentAmountCurrency
+from plaid.model.products import Products
+from plaid.model.country_code import CountryCode
+from plaid.model.recipient_bacs_nullable import RecipientBACSNullable
+from plaid.model.payment_initiation_address import PaymentInitiationAddress
+from plaid.model.payment_initiation_recipient_create_request import PaymentInitiationRecipientCreateRequest
+from plaid.model.payment_initiation_payment_create_request import PaymentInitiationPaymentCreateRequest
+from plaid.model.payment_initiation_payment_get_request import PaymentInitiationPaymentGetRequest
+from plaid.model.link_token_create_request_payment_initiation import LinkTokenCreateRequestPaymentInitiation
+from plaid.model.link_token_create_request import LinkTokenCreateRequest
+from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
+from server_common import (
+    client, demo_state, PLAID_COUNTRY_CODES, PLAID_REDIRECT_URI,
+    format_error,
+)
+from structured_log import log_response
+
+bp = Blueprint('payment_initiation', __name__)
+
+
+# Create a payment and a Link token to authorize it; the payment_initiation
+# product has to be the only product of the Link token
+
+
+@bp.route('/api/create_link_token_for_payment', methods=['POST'])
+def create_link_token_for_payment():
+    try:
+        request = PaymentInitiationRecipientCreateRequest(
+            name='John Doe',
+            bacs=RecipientBACSNullable(account='26207729', sort_code='560029'),
+            address=PaymentInitiationAddress(
+                street=['street name 999'],
+                city='city',
+                postal_code='99999',
+                country='GB'
+            )
+        )
+        response = client.payment_initiation_recipient_create(
+            request)
+        recipient_id = response['recipient_id']
+
+        request = PaymentInitiationPaymentCreateRequest(
+            recipient_id=recipient_id,
+            reference='TestPayment',
+            amount=PaymentAmount(
+                PaymentAmountCurrency('GBP'),
+                value=100.00
+            )
+        )
+        response = client.payment_initiation_payment_create(
+            request
+        )
+        log_response(response.to_dict())
+        
+        # We store the payment_id in memory for demo purposes - in production, store it in a secure
+        # persistent data store along with the Payment metadata, such as userId.
+        demo_state['payment_id'] = response['payment_id']
+        
+        linkRequest = LinkTokenCreateRequest(
+            # The 'payment_initiation' product has to be the only element in the 'products' list.
+            products=[Products('payment_initiation')],
+            client_name='Plaid Test',
+            # Institutions from all listed countries will be shown.
+            country_codes=list(map(lambda x: CountryCode(x), PLAID_COUNTRY_CODES)),
+            language='en',
+            user=LinkTokenCreateRequestUser(
+                # This should correspond to a unique id for the current user.
+                # Typically, this will be a user ID number from your application.
+                # Personally identifiable information, such as an email address or phone number, should not be used here.
+                client_user_id=str(time.time())
+            ),
+            payment_initiation=LinkTokenCreateRequestPaymentInitiation(
+                payment_id=demo_state['payment_id']
+            )
+        )
+
+        if PLAID_REDIRECT_URI!=None:
+            linkRequest['redirect_uri']=PLAID_REDIRECT_URI
+        linkResponse = client.link_token_create(linkRequest)
+        log_response(linkResponse.to_dict())
+        return jsonify(linkResponse.to_dict())
+    except plaid.ApiException as e:
+        return json.loads(e.body)
+
+
+# This functionality is only relevant for the UK Payment Initiation product.
+# Retrieve Payment for a specified Payment ID
+
+
+@bp.route('/api/payment', methods=['GET'])
+def payment():
+    try:
+        request = PaymentInitiationPaymentGetRequest(payment_id=demo_state['payment_id'])
+        response = client.payment_initiation_payment_get(request)
+        log_response(response.to_dict())
+        return jsonify({'error': None, 'payment': response.to_dict()})
+    except plaid.ApiException as e:
+        error_response = format_error(e)
+        return jsonify(error_response)
@@ -0,0 +1,63 @@
+"""Status, results and PDFs of the asset and Plaid Check report jobs"""
+
+from flask import Blueprint, jsonify, url_for
+import plaid
+import report_jobs
+from server_common import client, get_db, pdf_download, format_error
+
+bp = Blueprint('report_jobs', __name__)
+
+# Download names of report PDFs
+PDF_NAMES = {
+    'asset_report': 'Asset Report.pdf',
+    'cra_base_report': 'Plaid Check Report.pdf',
+    'cra_income_insights': 'Plaid Check Report with Insights.pdf',
+}
+
+
+def report_not_found(job_id):
+    return jsonify({'error': {'status_code': 404, 'display_message': f'No report job {job_id}',
+                              'error_code': 'NOT_FOUND', 'error_type': 'API_ERROR'}}), 404
+
+
+# Poll a report started by /api/assets or /api/cra/*: 202 while it is being
+# generated, then the report itself, in the shape those endpoints used to
+# return with a pdf_url in place of the embedded PDF, or the error that ended it
+
+
+@bp.route('/api/report_jobs/<int:job_id>', methods=['GET'])
+def get_report_job(job_id):
+    report = report_jobs.get_report(get_db(), job_id)
+    if report is None:
+        return report_not_found(job_id)
+
+    status = {'job_id': report['id'], 'report_type': report['report_type'], 'status': report['status']}
+    if report['status'] == 'pending':
+        return jsonify(dict(status, error=None, polls=report['polls'], created_at=report['created_at'])), 202
+    if report['status'] == 'failed':
+        return jsonify(dict(status, error=report['error']))
+    if report['report_type'] in report_jobs.PDF_DOWNLOADS:
+        status['pdf_url'] = url_for('report_jobs.get_report_job_pdf', job_id=job_id)
+    return jsonify(dict(report['result'], **status))
+
+
+# Stream a finished report's PDF, from the PDF cache after the first download
+
+
+@bp.route('/api/report_jobs/<int:job_id>/pdf', methods=['GET'])
+def get_report_job_pdf(job_id):
+    report = report_jobs.get_report(get_db(), job_id)
+    if report is None or report['report_type'] not in report_jobs.PDF_DOWNLOADS:
+        return report_not_found(job_id)
+    if report['status'] != 'ready':
+        return jsonify({'error': None, 'job_id': job_id, 'status': report['status']}), 202
+
+    download = report_jobs.PDF_DOWNLOADS[report['report_type']]
+    try:
+        return pdf_download(
+            f'report_job:{job_id}',
+            lambda: download(client, report['params'], _preload_content=False),
+            PDF_NAMES[report['report_type']])
+    except plaid.ApiException as e:
+        error_response = format_error(e)
+        return jsonify(error_response)
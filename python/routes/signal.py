@@ -0,0 +1,47 @@
+"""Signal: ACH return risk of a debit"""
+
+import os
+import time
+import uuid
+
+from flask import Blueprint, jsonify
+import plaid
+from plaid.model.signal_evaluate_request import SignalEvaluateRequest
+from server_common import (
+    client, demo_state, get_access_token_from_db, get_item_id_from_db, get_default_account_id,
+    format_error,
+)
+from structured_log import log_response
+
+SIGNAL_RULESET_KEY = os.getenv('SIGNAL_RULESET_KEY', '')
+
+bp = Blueprint('signal', __name__)
+
+
+@bp.route('/api/signal_evaluate', methods=['GET'])
+def signal():
+    access_token = get_access_token_from_db()
+    try:
+        # /accounts/get must finish before the main call, so the account is
+        # read from the accounts stored at link time instead
+        account_id = demo_state['account_id'] = get_default_account_id(access_token, get_item_id_from_db())
+        # Generate unique transaction ID using timestamp and random component
+        client_transaction_id = f"txn-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+
+        signal_request_params = {
+            'access_token': access_token,
+            'account_id': account_id,
+            'client_transaction_id': client_transaction_id,
+            'amount': 100.00
+        }
+
+        if SIGNAL_RULESET_KEY:
+            signal_request_params['ruleset_key'] = SIGNAL_RULESET_KEY
+
+        request = SignalEvaluateRequest(**signal_request_params)
+        response = client.signal_evaluate(request)
+        log_response(response.to_dict())
+        return jsonify(response.to_dict())
+    except plaid.ApiException as e:
+        error_response = format_error(e)
+        return jsonify(error_response)
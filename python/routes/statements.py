@@ -0,0 +1,65 @@
+"""Statements: list and download bank statements"""
+
+from flask import Blueprint, jsonify, send_file, url_for
+import plaid
+import statement_archive
+from plaid.model.statements_list_request import StatementsListRequest
+from plaid.model.statements_download_request import StatementsDownloadRequest
+from server_common import (
+    client, get_db, get_access_token_from_db, get_item_id_from_db, cached_plaid_response, pdf_download,
+    format_error,
+)
+from structured_log import log_response
+
+bp = Blueprint('statements', __name__)
+
+
+# List an Item's statements, with a pdf_url to download the first one
+
+
+@bp.route('/api/statements', methods=['GET'])
+def statements():
+    def fetch():
+        access_token = get_access_token_from_db()
+        statements_request = StatementsListRequest(access_token=access_token)
+        response = client.statements_list(statements_request)
+        log_response(response.to_dict())
+        statement_id = response['accounts'][0]['statements'][0]['statement_id']
+        return {
+            'error': None,
+            'json': response.to_dict(),
+            'pdf_url': url_for('statements.statement_pdf', statement_id=statement_id),
+        }
+
+    try:
+        return cached_plaid_response('statements', fetch)
+    except plaid.ApiException as e:
+        error_response = format_error(e)
+        return jsonify(error_response)
+
+
+# Stream a statement's PDF: from the statement archive if etl.py archive_statements
+# downloaded it, otherwise from the PDF cache after the first download
+
+
+@bp.route('/api/statements/<statement_id>/pdf', methods=['GET'])
+def statement_pdf(statement_id):
+    def download():
+        download_request = StatementsDownloadRequest(
+            access_token=get_access_token_from_db(),
+            statement_id=statement_id
+        )
+        return client.statements_download(download_request, _preload_content=False)
+
+    item_id = get_item_id_from_db()
+    archived = statement_archive.lookup(get_db(), statement_id)
+    if archived is not None and archived['item_id'] == item_id:
+        return send_file(archived['path'], mimetype='application/pdf', as_attachment=True,
+                         download_name='Statement.pdf', etag=archived['digest'], conditional=True)
+
+    try:
+        # Keyed by item too, so a cached statement is only served for the item it belongs to
+        return pdf_download(f'statement:{item_id}:{statement_id}', download, 'Statement.pdf')
+    except plaid.ApiException as e:
+        error_response = format_error(e)
+        return jsonify(error_response)
@@ -0,0 +1,149 @@
+"""Transactions sync, stored transaction history and spending summaries"""
+
+import contextlib
+import os
+import time
+from datetime import date, timedelta
+
+from flask import Blueprint, request, jsonify
+import plaid
+from plaid.model.transactions_sync_request import TransactionsSyncRequest
+import item_lock
+import transaction_queries
+import spending_aggregates
+from transaction_writer import StagedTransactionSync
+from server_common import (
+    client, get_db, get_access_token_from_db, get_item_id_from_db, get_sync_cursor,
+    format_error,
+)
+from structured_log import log_response
+
+# Seconds /api/transactions waits for another sync of the item to finish
+ITEM_SYNC_LOCK_TIMEOUT = float(os.getenv('ITEM_SYNC_LOCK_TIMEOUT', '30'))
+
+bp = Blueprint('transactions', __name__)
+
+
+# Retrieve Transactions for an Item
+# https://plaid.com/docs/#transactions
+
+
+@bp.route('/api/transactions', methods=['GET'])
+def get_transactions():
+    access_token = get_access_token_from_db()
+    item_id = get_item_id_from_db()
+
+    # Wait for a webhook or ETL sync of this item to finish rather than racing
+    # it on the cursor
+    if item_id:
+        lock = item_lock.item_sync_lock(get_db(), item_id, ITEM_SYNC_LOCK_TIMEOUT)
+    else:
+        lock = contextlib.nullcontext()
+
+    try:
+        with lock:
+            # Get stored cursor or start fresh
+            cursor = get_sync_cursor(item_id) if item_id else ''
+
+            # Pages are staged as they arrive; only the 8 most recent additions are
+            # kept in memory for the response
+            staged = StagedTransactionSync(get_db(), item_id)
+            latest_transactions = []
+            has_more = True
+            staged.reset()
+            # Iterate through each page of new transaction updates for item
+            while has_more:
+                txn_request = TransactionsSyncRequest(
+                    access_token=access_token,
+                    cursor=cursor,
+                )
+                response = client.transactions_sync(txn_request).to_dict()
+                cursor = response['next_cursor']
+                # If no transactions are available yet, wait and poll the endpoint.
+                # Normally, we would listen for a webhook, but the Quickstart doesn't
+                # support webhooks. For a webhook example, see
+                # https://github.com/plaid/tutorial-resources or
+                # https://github.com/plaid/pattern
+                if cursor == '':
+                    time.sleep(2)
+                    continue
+                # If cursor is not an empty string, we got results,
+                # so stage this page of results
+                staged.stage_page(response)
+                latest_transactions = sorted(
+                    latest_transactions + response['added'], key=lambda t: t['date'])[-8:]
+                has_more = response['has_more']
+                log_response(response)
+
+            # Apply the staged pages and save the cursor for next sync atomically
+            staged.promote(cursor)
+
+            # Return the 8 most recent transactions
+            return jsonify({
+                'latest_transactions': latest_transactions,
+                'total_added': staged.added,
+                'total_modified': staged.modified,
+                'total_removed': staged.removed,
+                'total_written': staged.written,
+                'total_skipped': staged.skipped
+            })
+
+    except item_lock.ItemLockBusy:
+        return jsonify({'error': {'status_code': 409, 'display_message':
+                                  'Transactions for this item are already being synced, please try again shortly.',
+                                  'error_code': 'SYNC_IN_PROGRESS', 'error_type': 'API_ERROR'}})
+    except plaid.ApiException as e:
+        error_response = format_error(e)
+        return jsonify(error_response)
+
+
+# Browse stored transactions without calling Plaid, newest first. Filters:
+# account_id (repeatable), start_date, end_date, category, merchant,
+# min_amount, max_amount, pending. Pass next_cursor back as cursor for the
+# next page, and include_raw=true to get raw_data
+
+
+@bp.route('/api/transactions/history', methods=['GET'])
+def get_transaction_history():
+    try:
+        filters = transaction_queries.filters_from_args(request.args)
+        # Scoped to the current item unless another one is asked for
+        item_id = filters.get('item_id') or get_item_id_from_db()
+        if item_id:
+            filters['item_id'] = item_id
+        limit = int(request.args.get('limit', transaction_queries.DEFAULT_LIMIT))
+        include_raw = request.args.get('include_raw', 'false').lower() == 'true'
+        page = transaction_queries.query_transactions(
+            get_db(), filters, request.args.get('cursor'), limit, include_raw)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
+
+# Spending totals from the incrementally maintained aggregates, grouped by
+# category or merchant per month, or by account per day
+
+
+@bp.route('/api/spending/summary', methods=['GET'])
+def get_spending_summary():
+    group_by = request.args.get('group_by', 'category')
+    if group_by not in spending_aggregates.AGGREGATES:
+        return jsonify({'error': f"group_by must be one of {', '.join(spending_aggregates.AGGREGATES)}"}), 400
+
+    try:
+        end_date = date.fromisoformat(request.args['end_date']) if 'end_date' in request.args else date.today()
+        start_date = date.fromisoformat(request.args['start_date']) if 'start_date' in request.args else end_date - timedelta(days=365)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    rows = spending_aggregates.get_summary(
+        get_db(), group_by, start_date, end_date,
+        item_id=request.args.get('item_id') or get_item_id_from_db(),
+        account_ids=request.args.getlist('account_id'))
+    return jsonify({
+        'group_by': group_by,
+        'period': spending_aggregates.AGGREGATES[group_by]['period'],
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'summary': [dict(row) for row in rows]
+    })
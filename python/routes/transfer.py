@@ -0,0 +1,74 @@
+"""Transfer: authorize and create an ACH debit"""
+
+from flask import Blueprint, jsonify
+import plaid
+from plaid.model.transfer_authorization_create_request import TransferAuthorizationCreateRequest
+from plaid.model.transfer_create_request import TransferCreateRequest
+from plaid.model.transfer_network import TransferNetwork
+from plaid.model.transfer_type import TransferType
+from plaid.model.transfer_authorization_user_in_request import TransferAuthorizationUserInRequest
+from plaid.model.ach_class import ACHClass
+from plaid.model.transfer_user_address_in_request import TransferUserAddressInRequest
+from server_common import (
+    client, demo_state, get_access_token_from_db, get_item_id_from_db, get_default_account_id,
+    format_error,
+)
+from structured_log import log_response
+
+bp = Blueprint('transfer', __name__)
+
+
+# This functionality is only relevant for the ACH Transfer product.
+# Authorize a transfer
+
+@bp.route('/api/transfer_authorize', methods=['GET'])
+def transfer_authorization():
+    access_token = get_access_token_from_db()
+    try:
+        # /accounts/get must finish before the main call, so the account is
+        # read from the accounts stored at link time instead
+        account_id = demo_state['account_id'] = get_default_account_id(access_token, get_item_id_from_db())
+        transfer_auth_request = TransferAuthorizationCreateRequest(
+            access_token=access_token,
+            account_id=account_id,
+            type=TransferType('debit'),
+            network=TransferNetwork('ach'),
+            amount='1.00',
+            ach_class=ACHClass('ppd'),
+            user=TransferAuthorizationUserInRequest(
+                legal_name='FirstName LastName',
+                email_address='foobar@email.com',
+                address=TransferUserAddressInRequest(
+                    street='123 Main St.',
+                    city='San Francisco',
+                    region='CA',
+                    postal_code='94053',
+                    country='US'
+                ),
+            ),
+        )
+        response = client.transfer_authorization_create(transfer_auth_request)
+        log_response(response.to_dict())
+        demo_state['authorization_id'] = response['authorization']['id']
+        return jsonify(response.to_dict())
+    except plaid.ApiException as e:
+        error_response = format_error(e)
+        return jsonify(error_response)
+
+# Create Transfer for a specified Transfer ID
+
+@bp.route('/api/transfer_create', methods=['GET'])
+def transfer():
+    try:
+        access_token = get_access_token_from_db()
+        transfer_create_request = TransferCreateRequest(
+            access_token=access_token,
+            account_id=demo_state['account_id'],
+            authorization_id=demo_state['authorization_id'],
+            description='Debit')
+        response = client.transfer_create(transfer_create_request)
+        log_response(response.to_dict())
+        return jsonify(response.to_dict())
+    except plaid.ApiException as e:
+        error_response = format_error(e)
+        return jsonify(error_response)
@@ -0,0 +1,17 @@
+"""
+Content hashes used to skip no-op upserts.
+
+Rows in financial_accounts and financial_transactions store a hash of the
+Plaid payload they were written from. Upserts only rewrite a row when the
+incoming hash differs, so re-syncing unchanged data costs no WAL, no TOAST
+rewrite of raw_data and no dead tuples.
+"""
+
+import hashlib
+import json
+
+
+def content_hash(data):
+    """Stable SHA-256 of a Plaid payload, independent of key order"""
+    payload = json.dumps(data, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
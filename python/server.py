@@ -1,113 +1,51 @@
 # Read env vars from .env file
-import base64
-import os
-import datetime as dt
+from datetime import date, timedelta
 import json
+import os
 import time
-from datetime import date, timedelta
 import uuid
-import psycopg2
-from psycopg2.extras import RealDictCursor
 
-from dotenv import load_dotenv
-from flask import Flask, request, jsonify, g
+from flask import Flask, request, jsonify
 import plaid
-from plaid.model.payment_amount import PaymentAmount
-from plaid.model.payment_amount_currency import PaymentAmountCurrency
 from plaid.model.products import Products
 from plaid.model.country_code import CountryCode
-from plaid.model.recipient_bacs_nullable import RecipientBACSNullable
-from plaid.model.payment_initiation_address import PaymentInitiationAddress
-from plaid.model.payment_initiation_recipient_create_request import PaymentInitiationRecipientCreateRequest
-from plaid.model.payment_initiation_payment_create_request import PaymentInitiationPaymentCreateRequest
-from plaid.model.payment_initiation_payment_get_request import PaymentInitiationPaymentGetRequest
-from plaid.model.link_token_create_request_payment_initiation import LinkTokenCreateRequestPaymentInitiation
 from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
 from plaid.model.link_token_create_request import LinkTokenCreateRequest
 from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
-from plaid.model.user_create_request import UserCreateRequest
-from plaid.model.consumer_report_user_identity import ConsumerReportUserIdentity
-from plaid.model.asset_report_create_request import AssetReportCreateRequest
-from plaid.model.asset_report_create_request_options import AssetReportCreateRequestOptions
-from plaid.model.asset_report_user import AssetReportUser
-from plaid.model.asset_report_get_request import AssetReportGetRequest
-from plaid.model.asset_report_pdf_get_request import AssetReportPDFGetRequest
-from plaid.model.auth_get_request import AuthGetRequest
-from plaid.model.transactions_sync_request import TransactionsSyncRequest
-from plaid.model.identity_get_request import IdentityGetRequest
-from plaid.model.investments_transactions_get_request_options import InvestmentsTransactionsGetRequestOptions
-from plaid.model.investments_transactions_get_request import InvestmentsTransactionsGetRequest
 from plaid.model.accounts_balance_get_request import AccountsBalanceGetRequest
 from plaid.model.accounts_get_request import AccountsGetRequest
-from plaid.model.investments_holdings_get_request import InvestmentsHoldingsGetRequest
 from plaid.model.item_get_request import ItemGetRequest
-from plaid.model.institutions_get_by_id_request import InstitutionsGetByIdRequest
-from plaid.model.transfer_authorization_create_request import TransferAuthorizationCreateRequest
-from plaid.model.transfer_create_request import TransferCreateRequest
-from plaid.model.transfer_get_request import TransferGetRequest
-from plaid.model.transfer_network import TransferNetwork
-from plaid.model.transfer_type import TransferType
-from plaid.model.transfer_authorization_user_in_request import TransferAuthorizationUserInRequest
-from plaid.model.ach_class import ACHClass
-from plaid.model.transfer_create_idempotency_key import TransferCreateIdempotencyKey
-from plaid.model.transfer_user_address_in_request import TransferUserAddressInRequest
-from plaid.model.signal_evaluate_request import SignalEvaluateRequest
-from plaid.model.statements_list_request import StatementsListRequest
-from plaid.model.link_token_create_request_statements import LinkTokenCreateRequestStatements
-from plaid.model.link_token_create_request_cra_options import LinkTokenCreateRequestCraOptions
-from plaid.model.statements_download_request import StatementsDownloadRequest
-from plaid.model.consumer_report_permissible_purpose import ConsumerReportPermissiblePurpose
-from plaid.model.cra_check_report_base_report_get_request import CraCheckReportBaseReportGetRequest
-from plaid.model.cra_check_report_pdf_get_request import CraCheckReportPDFGetRequest
-from plaid.model.cra_check_report_income_insights_get_request import CraCheckReportIncomeInsightsGetRequest
-from plaid.model.cra_check_report_partner_insights_get_request import CraCheckReportPartnerInsightsGetRequest
-from plaid.model.cra_pdf_add_ons import CraPDFAddOns
-from plaid.api import plaid_api
-
-load_dotenv()
+import db_pool
+import rate_limiter
+import balance_history
+import partitions
+import job_queue
+import report_jobs
+import pdf_cache
+import spending_aggregates
+import response_cache
+import institutions
+import fanout
+import routes
+from server_common import (
+    PLAID_PRODUCTS, PLAID_COUNTRY_CODES, PLAID_REDIRECT_URI, client, products, demo_state,
+    get_db, close_db, get_current_item, get_access_token_from_db, get_item_id_from_db,
+    save_item_full, save_account, save_account_balance_history, cached_plaid_response,
+    get_institution_pooled, format_error, format_timeout,
+)
+import structured_log
+from structured_log import log_response
+from transaction_writer import TRANSACTION_COLUMNS, SYNC_STAGING_TABLE
 
 
 app = Flask(__name__)
 
-PLAID_CLIENT_ID = os.getenv('PLAID_CLIENT_ID')
-PLAID_SECRET = os.getenv('PLAID_SECRET')
-PLAID_ENV = os.getenv('PLAID_ENV', 'sandbox')
-PLAID_PRODUCTS = os.getenv('PLAID_PRODUCTS', 'transactions').split(',')
-PLAID_COUNTRY_CODES = os.getenv('PLAID_COUNTRY_CODES', 'US').split(',')
-SIGNAL_RULESET_KEY = os.getenv('SIGNAL_RULESET_KEY', '')
-
-# PostgreSQL configuration
-POSTGRES_HOST = os.getenv('POSTGRES_HOST')
-POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
-POSTGRES_DB = os.getenv('POSTGRES_DB')
-POSTGRES_USER = os.getenv('POSTGRES_USER')
-POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
-
-def get_db():
-    if 'db' not in g:
-        g.db = psycopg2.connect(
-            host=POSTGRES_HOST,
-            port=POSTGRES_PORT,
-            database=POSTGRES_DB,
-            user=POSTGRES_USER,
-            password=POSTGRES_PASSWORD,
-            cursor_factory=RealDictCursor
-        )
-    return g.db
-
-def close_db(e=None):
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
+# Only the blueprints of PLAID_PRODUCTS are imported and registered, so the
+# plaid.model classes of unused products are never loaded
+routes.register_blueprints(app, PLAID_PRODUCTS)
 
 def init_db():
-    conn = psycopg2.connect(
-        host=POSTGRES_HOST,
-        port=POSTGRES_PORT,
-        database=POSTGRES_DB,
-        user=POSTGRES_USER,
-        password=POSTGRES_PASSWORD
-    )
+    conn = db_pool.getconn()
     cur = conn.cursor()
 
     # Institutions table - stores bank/financial institution info
@@ -168,6 +106,7 @@ def init_db():
             unofficial_currency_code VARCHAR(10),
             persistent_account_id VARCHAR(255),
             raw_data JSONB,
+            content_hash VARCHAR(64),
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
@@ -186,16 +125,18 @@ def init_db():
         )
     ''')
 
-    # Financial Transactions table
+    # Financial Transactions table, range partitioned by date (see partitions.py).
+    # Databases created before partitioning keep a plain table until
+    # `etl.py migrate_partitions` is run.
     cur.execute('''
         CREATE TABLE IF NOT EXISTS financial_transactions (
-            id SERIAL PRIMARY KEY,
-            transaction_id VARCHAR(255) UNIQUE NOT NULL,
+            id SERIAL,
+            transaction_id VARCHAR(255) NOT NULL,
             account_id VARCHAR(255) REFERENCES financial_accounts(account_id),
             amount DECIMAL(15, 2),
             iso_currency_code VARCHAR(10),
             unofficial_currency_code VARCHAR(10),
-            date DATE,
+            date DATE NOT NULL,
             datetime TIMESTAMP,
             authorized_date DATE,
             authorized_datetime TIMESTAMP,
@@ -233,24 +174,50 @@ def init_db():
             payment_meta_reason VARCHAR(255),
             counterparties JSONB,
             raw_data JSONB,
+            content_hash VARCHAR(64),
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (transaction_id, date)
+        ) PARTITION BY RANGE (date)
     ''')
 
-    # Account Balances History table (track balance changes over time)
+    # Hash of the Plaid payload each row was written from, used to skip
+    # no-op upserts. Added separately for databases created before it existed.
+    cur.execute('ALTER TABLE financial_accounts ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)')
+    cur.execute('ALTER TABLE financial_transactions ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)')
+
+    # Account Balances History table (track balance changes over time),
+    # an append-only time series range partitioned by recorded_at
     cur.execute('''
         CREATE TABLE IF NOT EXISTS account_balance_history (
-            id SERIAL PRIMARY KEY,
+            id SERIAL,
             account_id VARCHAR(255) REFERENCES financial_accounts(account_id),
             current_balance DECIMAL(15, 2),
             available_balance DECIMAL(15, 2),
             limit_amount DECIMAL(15, 2),
             iso_currency_code VARCHAR(10),
-            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
+            recorded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, recorded_at)
+        ) PARTITION BY RANGE (recorded_at)
     ''')
 
+    # Daily and weekly balance rollups, maintained by balance_history.record_balance
+    for rollup_table in balance_history.ROLLUP_TABLES.values():
+        cur.execute(f'''
+            CREATE TABLE IF NOT EXISTS {rollup_table} (
+                account_id VARCHAR(255) REFERENCES financial_accounts(account_id),
+                period_start DATE NOT NULL,
+                open_balance DECIMAL(15, 2),
+                close_balance DECIMAL(15, 2),
+                min_balance DECIMAL(15, 2),
+                max_balance DECIMAL(15, 2),
+                available_balance DECIMAL(15, 2),
+                iso_currency_code VARCHAR(10),
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (account_id, period_start)
+            )
+        ''')
+
     # Sync Cursors table (for transaction sync)
     cur.execute('''
         CREATE TABLE IF NOT EXISTS sync_cursors (
@@ -261,358 +228,114 @@ def init_db():
         )
     ''')
 
-    # Create indexes for better query performance
-    cur.execute('CREATE INDEX IF NOT EXISTS idx_transactions_account_id ON financial_transactions(account_id)')
-    cur.execute('CREATE INDEX IF NOT EXISTS idx_transactions_date ON financial_transactions(date)')
-    cur.execute('CREATE INDEX IF NOT EXISTS idx_transactions_merchant ON financial_transactions(merchant_name)')
-    cur.execute('CREATE INDEX IF NOT EXISTS idx_transactions_category ON financial_transactions(personal_finance_category_primary)')
-    cur.execute('CREATE INDEX IF NOT EXISTS idx_accounts_item_id ON financial_accounts(item_id)')
-    cur.execute('CREATE INDEX IF NOT EXISTS idx_balance_history_account ON account_balance_history(account_id)')
-    cur.execute('CREATE INDEX IF NOT EXISTS idx_balance_history_date ON account_balance_history(recorded_at)')
-
-    conn.commit()
-    cur.close()
-    conn.close()
-
-def empty_to_none(field):
-    value = os.getenv(field)
-    if value is None or len(value) == 0:
-        return None
-    return value
-
-host = plaid.Environment.Sandbox
-
-if PLAID_ENV == 'sandbox':
-    host = plaid.Environment.Sandbox
-
-if PLAID_ENV == 'production':
-    host = plaid.Environment.Production
-
-# Parameters used for the OAuth redirect Link flow.
-#
-# Set PLAID_REDIRECT_URI to 'http://localhost:3000/'
-# The OAuth redirect flow requires an endpoint on the developer's website
-# that the bank website should redirect to. You will need to configure
-# this redirect URI for your client ID through the Plaid developer dashboard
-# at https://dashboard.plaid.com/team/api.
-PLAID_REDIRECT_URI = empty_to_none('PLAID_REDIRECT_URI')
-
-configuration = plaid.Configuration(
-    host=host,
-    api_key={
-        'clientId': PLAID_CLIENT_ID,
-        'secret': PLAID_SECRET,
-        'plaidVersion': '2020-09-14'
-    }
-)
-
-api_client = plaid.ApiClient(configuration)
-client = plaid_api.PlaidApi(api_client)
-
-products = []
-for product in PLAID_PRODUCTS:
-    products.append(Products(product))
-
-
-# Initialize database and register teardown
-app.teardown_appcontext(close_db)
+    # Spending totals per category/merchant month and account day, kept
+    # current by every transaction write (see spending_aggregates.py)
+    spending_aggregates.create_tables(cur)
 
-# Initialize database tables on startup
-try:
-    init_db()
-    print("Database initialized successfully")
-except Exception as e:
-    print(f"Warning: Could not initialize database: {e}")
-
-# Helper functions to get/set tokens from database
-def get_current_item():
-    """Get the most recent item from database"""
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('SELECT * FROM plaid_items ORDER BY created_at DESC LIMIT 1')
-    item = cur.fetchone()
-    cur.close()
-    return item
-
-def save_item(item_id, access_token, user_token=None, payment_id=None, transfer_id=None):
-    """Save or update an item in the database"""
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('''
-        INSERT INTO plaid_items (item_id, access_token, user_token, payment_id, transfer_id)
-        VALUES (%s, %s, %s, %s, %s)
-        ON CONFLICT (item_id) DO UPDATE SET
-            access_token = EXCLUDED.access_token,
-            user_token = COALESCE(EXCLUDED.user_token, plaid_items.user_token),
-            payment_id = COALESCE(EXCLUDED.payment_id, plaid_items.payment_id),
-            transfer_id = COALESCE(EXCLUDED.transfer_id, plaid_items.transfer_id),
-            updated_at = CURRENT_TIMESTAMP
-    ''', (item_id, access_token, user_token, payment_id, transfer_id))
-    db.commit()
-    cur.close()
+    # Shared backend of the Plaid response cache (see response_cache.py)
+    response_cache.create_tables(cur)
 
-def get_access_token_from_db():
-    """Get access token from the most recent item"""
-    item = get_current_item()
-    return item['access_token'] if item else None
+    # Durable queue for webhook-triggered syncs (see job_queue.py)
+    job_queue.create_tables(cur)
 
-def get_item_id_from_db():
-    """Get item_id from the most recent item"""
-    item = get_current_item()
-    return item['item_id'] if item else None
+    # Asset and Plaid Check reports polled in the background (see report_jobs.py)
+    report_jobs.create_tables(cur)
 
-# ============================================
-# Database helper functions for Plaid data
-# ============================================
+    # Source of every cached statement and report PDF (see pdf_cache.py)
+    pdf_cache.create_tables(cur)
 
-def save_institution(institution_data):
-    """Save institution data to database"""
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('''
-        INSERT INTO institutions (
-            institution_id, name, url, logo, primary_color,
-            country_codes, products, routing_numbers, raw_data
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (institution_id) DO UPDATE SET
-            name = EXCLUDED.name,
-            url = EXCLUDED.url,
-            logo = EXCLUDED.logo,
-            primary_color = EXCLUDED.primary_color,
-            country_codes = EXCLUDED.country_codes,
-            products = EXCLUDED.products,
-            routing_numbers = EXCLUDED.routing_numbers,
-            raw_data = EXCLUDED.raw_data,
-            updated_at = CURRENT_TIMESTAMP
-    ''', (
-        institution_data.get('institution_id'),
-        institution_data.get('name'),
-        institution_data.get('url'),
-        institution_data.get('logo'),
-        institution_data.get('primary_color'),
-        institution_data.get('country_codes'),
-        institution_data.get('products'),
-        institution_data.get('routing_numbers'),
-        json.dumps(institution_data, default=str)
-    ))
-    db.commit()
-    cur.close()
+    # Statements downloaded by etl.py archive_statements (see statement_archive.py);
+    # imported here, as only the ETL and the statements blueprint use it
+    import statement_archive
+    statement_archive.create_tables(cur)
 
-def save_item_full(item_data, access_token, institution_id=None):
-    """Save full item data to database"""
-    db = get_db()
-    cur = db.cursor()
+    # Historical fetch progress per item and date window (etl.py fetch_historical --resume)
     cur.execute('''
-        INSERT INTO plaid_items (
-            item_id, access_token, institution_id, consent_expiration_time,
-            update_type, webhook, error, available_products, billed_products, raw_data
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (item_id) DO UPDATE SET
-            access_token = EXCLUDED.access_token,
-            institution_id = COALESCE(EXCLUDED.institution_id, plaid_items.institution_id),
-            consent_expiration_time = EXCLUDED.consent_expiration_time,
-            update_type = EXCLUDED.update_type,
-            webhook = EXCLUDED.webhook,
-            error = EXCLUDED.error,
-            available_products = EXCLUDED.available_products,
-            billed_products = EXCLUDED.billed_products,
-            raw_data = EXCLUDED.raw_data,
-            updated_at = CURRENT_TIMESTAMP
-    ''', (
-        item_data.get('item_id'),
-        access_token,
-        institution_id or item_data.get('institution_id'),
-        item_data.get('consent_expiration_time'),
-        item_data.get('update_type'),
-        item_data.get('webhook'),
-        json.dumps(item_data.get('error'), default=str) if item_data.get('error') else None,
-        item_data.get('available_products'),
-        item_data.get('billed_products'),
-        json.dumps(item_data, default=str)
-    ))
-    db.commit()
-    cur.close()
-
-def save_account(account_data, item_id):
-    """Save account data to database"""
-    db = get_db()
-    cur = db.cursor()
+        CREATE TABLE IF NOT EXISTS historical_fetch_checkpoints (
+            id SERIAL PRIMARY KEY,
+            item_id VARCHAR(255) REFERENCES plaid_items(item_id),
+            window_start DATE NOT NULL,
+            window_end DATE NOT NULL,
+            next_offset INTEGER NOT NULL DEFAULT 0,
+            total_transactions INTEGER,
+            completed BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (item_id, window_start, window_end)
+        )
+    ''')
 
-    balances = account_data.get('balances', {})
+    # Staging area for in-progress transaction syncs. Pages are copied here as
+    # they arrive and promoted together with the new cursor once pagination
+    # finishes. Unlogged: after a crash the cursor was never advanced, so the
+    # sync simply restarts.
+    cur.execute(f'''
+        CREATE UNLOGGED TABLE IF NOT EXISTS {SYNC_STAGING_TABLE} AS
+        SELECT {', '.join(TRANSACTION_COLUMNS)} FROM financial_transactions
+        WITH NO DATA
+    ''')
+    cur.execute(f'''
+        ALTER TABLE {SYNC_STAGING_TABLE}
+            ADD COLUMN IF NOT EXISTS staging_id BIGSERIAL,
+            ADD COLUMN IF NOT EXISTS item_id VARCHAR(255),
+            ADD COLUMN IF NOT EXISTS removed BOOLEAN NOT NULL DEFAULT FALSE,
+            ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)
+    ''')
 
-    cur.execute('''
-        INSERT INTO financial_accounts (
-            account_id, item_id, name, official_name, type, subtype, mask,
-            current_balance, available_balance, limit_amount,
-            iso_currency_code, unofficial_currency_code, persistent_account_id, raw_data
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (account_id) DO UPDATE SET
-            name = EXCLUDED.name,
-            official_name = EXCLUDED.official_name,
-            type = EXCLUDED.type,
-            subtype = EXCLUDED.subtype,
-            mask = EXCLUDED.mask,
-            current_balance = EXCLUDED.current_balance,
-            available_balance = EXCLUDED.available_balance,
-            limit_amount = EXCLUDED.limit_amount,
-            iso_currency_code = EXCLUDED.iso_currency_code,
-            unofficial_currency_code = EXCLUDED.unofficial_currency_code,
-            persistent_account_id = EXCLUDED.persistent_account_id,
-            raw_data = EXCLUDED.raw_data,
-            updated_at = CURRENT_TIMESTAMP
-    ''', (
-        account_data.get('account_id'),
-        item_id,
-        account_data.get('name'),
-        account_data.get('official_name'),
-        account_data.get('type'),
-        account_data.get('subtype'),
-        account_data.get('mask'),
-        balances.get('current'),
-        balances.get('available'),
-        balances.get('limit'),
-        balances.get('iso_currency_code'),
-        balances.get('unofficial_currency_code'),
-        account_data.get('persistent_account_id'),
-        json.dumps(account_data, default=str)
-    ))
-    db.commit()
-    cur.close()
+    # Create indexes for better query performance
+    # Transactions: composite indexes in (date, transaction_id) keyset order
+    # after each filter column, superseding the single-column ones
+    for index in ('idx_transactions_account_id', 'idx_transactions_date',
+                  'idx_transactions_merchant', 'idx_transactions_category'):
+        cur.execute(f'DROP INDEX IF EXISTS {index}')
+    for index, definition in partitions.TABLES[partitions.TRANSACTIONS]['indexes'].items():
+        cur.execute(f'CREATE INDEX IF NOT EXISTS {index} ON financial_transactions {definition}')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_accounts_item_id ON financial_accounts(item_id)')
+    # Balance history: (account_id, recorded_at DESC) serves per-account and
+    # latest-balance lookups, and a BRIN index covers time ranges at a tiny
+    # fraction of a B-tree's size since rows arrive in recorded_at order
+    cur.execute('DROP INDEX IF EXISTS idx_balance_history_account')
+    cur.execute('DROP INDEX IF EXISTS idx_balance_history_date')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_balance_history_account_latest ON account_balance_history(account_id, recorded_at DESC)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_balance_history_recorded_brin ON account_balance_history USING BRIN (recorded_at)')
+    cur.execute(f'CREATE INDEX IF NOT EXISTS idx_sync_staging_item ON {SYNC_STAGING_TABLE}(item_id)')
+
+    # Default and upcoming partitions
+    partitions.init_partitions(cur, partitions.TRANSACTIONS)
+    partitions.init_partitions(cur, partitions.BALANCE_HISTORY)
 
-def save_account_balance_history(account_id, balances):
-    """Save balance snapshot to history table"""
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('''
-        INSERT INTO account_balance_history (
-            account_id, current_balance, available_balance, limit_amount, iso_currency_code
-        ) VALUES (%s, %s, %s, %s, %s)
-    ''', (
-        account_id,
-        balances.get('current'),
-        balances.get('available'),
-        balances.get('limit'),
-        balances.get('iso_currency_code')
-    ))
-    db.commit()
+    conn.commit()
     cur.close()
+    db_pool.putconn(conn)
 
-def save_transaction(txn_data):
-    """Save transaction data to database"""
-    db = get_db()
-    cur = db.cursor()
 
-    location = txn_data.get('location', {}) or {}
-    payment_meta = txn_data.get('payment_meta', {}) or {}
-    personal_finance_category = txn_data.get('personal_finance_category', {}) or {}
+# Register teardown
+app.teardown_appcontext(close_db)
 
-    cur.execute('''
-        INSERT INTO financial_transactions (
-            transaction_id, account_id, amount, iso_currency_code, unofficial_currency_code,
-            date, datetime, authorized_date, authorized_datetime,
-            name, merchant_name, merchant_entity_id, logo_url, website,
-            payment_channel, pending, pending_transaction_id, account_owner,
-            transaction_code, transaction_type, category_id,
-            personal_finance_category_primary, personal_finance_category_detailed,
-            personal_finance_category_confidence, personal_finance_category_icon_url,
-            location_address, location_city, location_region, location_postal_code,
-            location_country, location_lat, location_lon, location_store_number,
-            payment_meta_reference_number, payment_meta_ppd_id, payment_meta_payee,
-            payment_meta_by_order_of, payment_meta_payer, payment_meta_payment_method,
-            payment_meta_payment_processor, payment_meta_reason,
-            counterparties, raw_data
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-            %s, %s, %s, %s, %s, %s, %s
-        )
-        ON CONFLICT (transaction_id) DO UPDATE SET
-            amount = EXCLUDED.amount,
-            name = EXCLUDED.name,
-            merchant_name = EXCLUDED.merchant_name,
-            pending = EXCLUDED.pending,
-            personal_finance_category_primary = EXCLUDED.personal_finance_category_primary,
-            personal_finance_category_detailed = EXCLUDED.personal_finance_category_detailed,
-            raw_data = EXCLUDED.raw_data,
-            updated_at = CURRENT_TIMESTAMP
-    ''', (
-        txn_data.get('transaction_id'),
-        txn_data.get('account_id'),
-        txn_data.get('amount'),
-        txn_data.get('iso_currency_code'),
-        txn_data.get('unofficial_currency_code'),
-        txn_data.get('date'),
-        txn_data.get('datetime'),
-        txn_data.get('authorized_date'),
-        txn_data.get('authorized_datetime'),
-        txn_data.get('name'),
-        txn_data.get('merchant_name'),
-        txn_data.get('merchant_entity_id'),
-        txn_data.get('logo_url'),
-        txn_data.get('website'),
-        txn_data.get('payment_channel'),
-        txn_data.get('pending'),
-        txn_data.get('pending_transaction_id'),
-        txn_data.get('account_owner'),
-        txn_data.get('transaction_code'),
-        txn_data.get('transaction_type'),
-        txn_data.get('category_id'),
-        personal_finance_category.get('primary'),
-        personal_finance_category.get('detailed'),
-        personal_finance_category.get('confidence_level'),
-        personal_finance_category.get('icon_url'),
-        location.get('address'),
-        location.get('city'),
-        location.get('region'),
-        location.get('postal_code'),
-        location.get('country'),
-        location.get('lat'),
-        location.get('lon'),
-        location.get('store_number'),
-        payment_meta.get('reference_number'),
-        payment_meta.get('ppd_id'),
-        payment_meta.get('payee'),
-        payment_meta.get('by_order_of'),
-        payment_meta.get('payer'),
-        payment_meta.get('payment_method'),
-        payment_meta.get('payment_processor'),
-        payment_meta.get('reason'),
-        json.dumps(txn_data.get('counterparties'), default=str) if txn_data.get('counterparties') else None,
-        json.dumps(txn_data, default=str)
-    ))
-    db.commit()
-    cur.close()
 
-def delete_transaction(transaction_id):
-    """Delete a transaction from the database"""
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('DELETE FROM financial_transactions WHERE transaction_id = %s', (transaction_id,))
-    db.commit()
-    cur.close()
+# Schema setup runs once per start: in the gunicorn master (see
+# gunicorn.conf.py), before app.run(), or with `flask --app server init-db`,
+# not on import, so forked workers don't each repeat it
+def setup_database():
+    """Create and migrate the database schema"""
+    try:
+        init_db()
+        print("Database initialized successfully")
+    except Exception as e:
+        print(f"Warning: Could not initialize database: {e}")
+    try:
+        # The only walk of the PDF cache directory; eviction and stats use pdf_artifacts
+        with db_pool.connection() as conn:
+            removed, deleted = pdf_cache.reconcile(conn)
+        if removed or deleted:
+            print(f"PDF cache reconciled: removed {removed} untracked files, forgot {deleted} missing ones")
+    except Exception as e:
+        print(f"Warning: Could not reconcile the PDF cache: {e}")
 
-def save_sync_cursor(item_id, cursor):
-    """Save or update sync cursor for an item"""
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('''
-        INSERT INTO sync_cursors (item_id, cursor, last_synced_at)
-        VALUES (%s, %s, CURRENT_TIMESTAMP)
-        ON CONFLICT (item_id) DO UPDATE SET
-            cursor = EXCLUDED.cursor,
-            last_synced_at = CURRENT_TIMESTAMP
-    ''', (item_id, cursor))
-    db.commit()
-    cur.close()
 
-def get_sync_cursor(item_id):
-    """Get sync cursor for an item"""
-    db = get_db()
-    cur = db.cursor()
-    cur.execute('SELECT cursor FROM sync_cursors WHERE item_id = %s', (item_id,))
-    result = cur.fetchone()
-    cur.close()
-    return result['cursor'] if result else ''
+@app.cli.command('init-db')
+def init_db_command():
+    setup_database()
 
 
 @app.route('/api/info', methods=['POST'])
@@ -625,71 +348,8 @@ def info():
     })
 
 
-@app.route('/api/create_link_token_for_payment', methods=['POST'])
-def create_link_token_for_payment():
-    global payment_id
-    try:
-        request = PaymentInitiationRecipientCreateRequest(
-            name='John Doe',
-            bacs=RecipientBACSNullable(account='26207729', sort_code='560029'),
-            address=PaymentInitiationAddress(
-                street=['street name 999'],
-                city='city',
-                postal_code='99999',
-                country='GB'
-            )
-        )
-        response = client.payment_initiation_recipient_create(
-            request)
-        recipient_id = response['recipient_id']
-
-        request = PaymentInitiationPaymentCreateRequest(
-            recipient_id=recipient_id,
-            reference='TestPayment',
-            amount=PaymentAmount(
-                PaymentAmountCurrency('GBP'),
-                value=100.00
-            )
-        )
-        response = client.payment_initiation_payment_create(
-            request
-        )
-        pretty_print_response(response.to_dict())
-        
-        # We store the payment_id in memory for demo purposes - in production, store it in a secure
-        # persistent data store along with the Payment metadata, such as userId.
-        payment_id = response['payment_id']
-        
-        linkRequest = LinkTokenCreateRequest(
-            # The 'payment_initiation' product has to be the only element in the 'products' list.
-            products=[Products('payment_initiation')],
-            client_name='Plaid Test',
-            # Institutions from all listed countries will be shown.
-            country_codes=list(map(lambda x: CountryCode(x), PLAID_COUNTRY_CODES)),
-            language='en',
-            user=LinkTokenCreateRequestUser(
-                # This should correspond to a unique id for the current user.
-                # Typically, this will be a user ID number from your application.
-                # Personally identifiable information, such as an email address or phone number, should not be used here.
-                client_user_id=str(time.time())
-            ),
-            payment_initiation=LinkTokenCreateRequestPaymentInitiation(
-                payment_id=payment_id
-            )
-        )
-
-        if PLAID_REDIRECT_URI!=None:
-            linkRequest['redirect_uri']=PLAID_REDIRECT_URI
-        linkResponse = client.link_token_create(linkRequest)
-        pretty_print_response(linkResponse.to_dict())
-        return jsonify(linkResponse.to_dict())
-    except plaid.ApiException as e:
-        return json.loads(e.body)
-
-
 @app.route('/api/create_link_token', methods=['POST'])
 def create_link_token():
-    global user_token
     try:
         request = LinkTokenCreateRequest(
             products=products,
@@ -703,6 +363,7 @@ def create_link_token():
         if PLAID_REDIRECT_URI!=None:
             request['redirect_uri']=PLAID_REDIRECT_URI
         if Products('statements') in products:
+            from plaid.model.link_token_create_request_statements import LinkTokenCreateRequestStatements
             statements=LinkTokenCreateRequestStatements(
                 end_date=date.today(),
                 start_date=date.today()-timedelta(days=30)
@@ -711,7 +372,9 @@ def create_link_token():
 
         cra_products = ["cra_base_report", "cra_income_insights", "cra_partner_insights"]
         if any(product in cra_products for product in PLAID_PRODUCTS):
-            request['user_token'] = user_token
+            from plaid.model.consumer_report_permissible_purpose import ConsumerReportPermissiblePurpose
+            from plaid.model.link_token_create_request_cra_options import LinkTokenCreateRequestCraOptions
+            request['user_token'] = demo_state['user_token']
             request['consumer_report_permissible_purpose'] = ConsumerReportPermissiblePurpose('ACCOUNT_REVIEW_CREDIT')
             request['cra_options'] = LinkTokenCreateRequestCraOptions(
                 days_requested=60
@@ -727,7 +390,10 @@ def create_link_token():
 # https://plaid.com/docs/api/users/#usercreate
 @app.route('/api/create_user_token', methods=['POST'])
 def create_user_token():
-    global user_token
+    # Only used by the Plaid Check (CRA) and Income flows, so its models are
+    # imported on first use
+    from plaid.model.user_create_request import UserCreateRequest
+    from plaid.model.consumer_report_user_identity import ConsumerReportUserIdentity
     try:
         consumer_report_user_identity = None
         user_create_request = UserCreateRequest(
@@ -754,7 +420,7 @@ def create_user_token():
             user_create_request["consumer_report_user_identity"] = consumer_report_user_identity
 
         user_response = client.user_create(user_create_request)
-        user_token = user_response['user_token']
+        demo_state['user_token'] = user_response['user_token']
         return jsonify(user_response.to_dict())
     except plaid.ApiException as e:
         print(e)
@@ -776,141 +442,40 @@ def set_access_token():
         access_token = exchange_response['access_token']
         item_id = exchange_response['item_id']
 
-        # Get item details and save to database
-        item_request = ItemGetRequest(access_token=access_token)
-        item_response = client.item_get(item_request)
-        item_data = item_response.to_dict()['item']
-
-        # Get and save institution data
-        try:
-            inst_request = InstitutionsGetByIdRequest(
-                institution_id=item_data['institution_id'],
-                country_codes=list(map(lambda x: CountryCode(x), PLAID_COUNTRY_CODES))
-            )
-            inst_response = client.institutions_get_by_id(inst_request)
-            save_institution(inst_response.to_dict()['institution'])
-        except Exception as e:
-            print(f"Warning: Could not fetch institution: {e}")
+        timeout = fanout.default_timeout()
 
-        # Save item to database
-        save_item_full(item_data, access_token)
+        def fetch_item():
+            item_request = ItemGetRequest(access_token=access_token)
+            item_data = client.item_get(item_request, _request_timeout=timeout).to_dict()['item']
+            # Make sure the institution is stored; only calls Plaid when it is
+            # missing or stale
+            try:
+                get_institution_pooled(item_data['institution_id'])
+            except Exception as e:
+                print(f"Warning: Could not fetch institution: {e}")
+            return item_data
 
-        # Fetch and save accounts
+        # Item details (then its institution) and accounts only need the
+        # access token, so they are fetched concurrently
         accounts_request = AccountsGetRequest(access_token=access_token)
-        accounts_response = client.accounts_get(accounts_request)
-        for account in accounts_response.to_dict()['accounts']:
+        results = fanout.run({
+            'item': fetch_item,
+            'accounts': lambda: client.accounts_get(accounts_request, _request_timeout=timeout),
+        }, timeout)
+
+        # Save item to database; a relinked item starts with a fresh cache
+        save_item_full(results['item'], access_token)
+        response_cache.invalidate(item_id)
+
+        # Save accounts
+        for account in results['accounts'].to_dict()['accounts']:
             save_account(account, item_id)
 
         return jsonify(exchange_response.to_dict())
     except plaid.ApiException as e:
         return json.loads(e.body)
-
-
-# Retrieve ACH or ETF account numbers for an Item
-# https://plaid.com/docs/#auth
-
-
-@app.route('/api/auth', methods=['GET'])
-def get_auth():
-    try:
-       access_token = get_access_token_from_db()
-       auth_request = AuthGetRequest(
-            access_token=access_token
-        )
-       response = client.auth_get(auth_request)
-       pretty_print_response(response.to_dict())
-       return jsonify(response.to_dict())
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
-
-
-# Retrieve Transactions for an Item
-# https://plaid.com/docs/#transactions
-
-
-@app.route('/api/transactions', methods=['GET'])
-def get_transactions():
-    access_token = get_access_token_from_db()
-    item_id = get_item_id_from_db()
-
-    # Get stored cursor or start fresh
-    cursor = get_sync_cursor(item_id) if item_id else ''
-
-    # New transaction updates since "cursor"
-    added = []
-    modified = []
-    removed = [] # Removed transaction ids
-    has_more = True
-    try:
-        # Iterate through each page of new transaction updates for item
-        while has_more:
-            txn_request = TransactionsSyncRequest(
-                access_token=access_token,
-                cursor=cursor,
-            )
-            response = client.transactions_sync(txn_request).to_dict()
-            cursor = response['next_cursor']
-            # If no transactions are available yet, wait and poll the endpoint.
-            # Normally, we would listen for a webhook, but the Quickstart doesn't
-            # support webhooks. For a webhook example, see
-            # https://github.com/plaid/tutorial-resources or
-            # https://github.com/plaid/pattern
-            if cursor == '':
-                time.sleep(2)
-                continue
-            # If cursor is not an empty string, we got results,
-            # so add this page of results
-            added.extend(response['added'])
-            modified.extend(response['modified'])
-            removed.extend(response['removed'])
-            has_more = response['has_more']
-            pretty_print_response(response)
-
-        # Save transactions to database
-        for txn in added:
-            save_transaction(txn)
-        for txn in modified:
-            save_transaction(txn)
-        for txn in removed:
-            delete_transaction(txn['transaction_id'])
-
-        # Save the cursor for next sync
-        if item_id and cursor:
-            save_sync_cursor(item_id, cursor)
-
-        # Return the 8 most recent transactions
-        latest_transactions = sorted(added, key=lambda t: t['date'])[-8:]
-        return jsonify({
-            'latest_transactions': latest_transactions,
-            'total_added': len(added),
-            'total_modified': len(modified),
-            'total_removed': len(removed)
-        })
-
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
-
-
-# Retrieve Identity data for an Item
-# https://plaid.com/docs/#identity
-
-
-@app.route('/api/identity', methods=['GET'])
-def get_identity():
-    try:
-        access_token = get_access_token_from_db()
-        identity_request = IdentityGetRequest(
-            access_token=access_token
-        )
-        response = client.identity_get(identity_request)
-        pretty_print_response(response.to_dict())
-        return jsonify(
-            {'error': None, 'identity': response.to_dict()['accounts']})
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
+    except fanout.FanoutTimeout as e:
+        return jsonify(format_timeout(e))
 
 
 # Retrieve real-time balance data for each of an Item's accounts
@@ -931,260 +496,73 @@ def get_balance():
             save_account(account, item_id)
             save_account_balance_history(account['account_id'], account.get('balances', {}))
 
-        pretty_print_response(response_data)
+        log_response(response_data)
         return jsonify(response_data)
     except plaid.ApiException as e:
         error_response = format_error(e)
         return jsonify(error_response)
 
 
-# Retrieve an Item's accounts
-# https://plaid.com/docs/#accounts
-
-
-@app.route('/api/accounts', methods=['GET'])
-def get_accounts():
-    try:
-        access_token = get_access_token_from_db()
-        accounts_request = AccountsGetRequest(
-            access_token=access_token
-        )
-        response = client.accounts_get(accounts_request)
-        pretty_print_response(response.to_dict())
-        return jsonify(response.to_dict())
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
-
-
-# Create and then retrieve an Asset Report for one or more Items. Note that an
-# Asset Report can contain up to 100 items, but for simplicity we're only
-# including one Item here.
-# https://plaid.com/docs/#assets
-
-
-@app.route('/api/assets', methods=['GET'])
-def get_assets():
-    try:
-        access_token = get_access_token_from_db()
-        asset_request = AssetReportCreateRequest(
-            access_tokens=[access_token],
-            days_requested=60,
-            options=AssetReportCreateRequestOptions(
-                webhook='https://www.example.com',
-                client_report_id='123',
-                user=AssetReportUser(
-                    client_user_id='789',
-                    first_name='Jane',
-                    middle_name='Leah',
-                    last_name='Doe',
-                    ssn='123-45-6789',
-                    phone_number='(555) 123-4567',
-                    email='jane.doe@example.com',
-                )
-            )
-        )
-
-        response = client.asset_report_create(asset_request)
-        pretty_print_response(response.to_dict())
-        asset_report_token = response['asset_report_token']
-
-        # Poll for the completion of the Asset Report.
-        request = AssetReportGetRequest(
-            asset_report_token=asset_report_token,
-        )
-        response = poll_with_retries(lambda: client.asset_report_get(request))
-        asset_report_json = response['report']
+# Retrieve an account's balance history from the daily or weekly rollups,
+# or the raw change snapshots with granularity=raw
 
-        request = AssetReportPDFGetRequest(
-            asset_report_token=asset_report_token,
-        )
-        pdf = client.asset_report_pdf_get(request)
-        return jsonify({
-            'error': None,
-            'json': asset_report_json.to_dict(),
-            'pdf': base64.b64encode(pdf.read()).decode('utf-8'),
-        })
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
 
+@app.route('/api/balance/history', methods=['GET'])
+def get_balance_history():
+    account_id = request.args.get('account_id')
+    granularity = request.args.get('granularity', 'day')
+    granularities = ['raw'] + list(balance_history.ROLLUP_TABLES)
+    if not account_id:
+        return jsonify({'error': 'account_id is required'}), 400
+    if granularity not in granularities:
+        return jsonify({'error': f"granularity must be one of {', '.join(granularities)}"}), 400
 
-# Retrieve investment holdings data for an Item
-# https://plaid.com/docs/#investments
-
-
-@app.route('/api/holdings', methods=['GET'])
-def get_holdings():
     try:
-        access_token = get_access_token_from_db()
-        holdings_request = InvestmentsHoldingsGetRequest(access_token=access_token)
-        response = client.investments_holdings_get(holdings_request)
-        pretty_print_response(response.to_dict())
-        return jsonify({'error': None, 'holdings': response.to_dict()})
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
-
-
-# Retrieve Investment Transactions for an Item
-# https://plaid.com/docs/#investments
+        end_date = date.fromisoformat(request.args['end_date']) if 'end_date' in request.args else date.today()
+        start_date = date.fromisoformat(request.args['start_date']) if 'start_date' in request.args else end_date - timedelta(days=90)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if granularity == 'raw':
+        rows = balance_history.get_snapshots(get_db(), account_id, start_date, end_date)
+    else:
+        rows = balance_history.get_rollups(get_db(), account_id, granularity, start_date, end_date)
+    return jsonify({
+        'account_id': account_id,
+        'granularity': granularity,
+        'history': [dict(row) for row in rows]
+    })
 
 
-@app.route('/api/investments_transactions', methods=['GET'])
-def get_investments_transactions():
-    # Pull transactions for the last 30 days
-    access_token = get_access_token_from_db()
-    start_date = (dt.datetime.now() - dt.timedelta(days=(30)))
-    end_date = dt.datetime.now()
-    try:
-        options = InvestmentsTransactionsGetRequestOptions()
-        inv_txn_request = InvestmentsTransactionsGetRequest(
-            access_token=access_token,
-            start_date=start_date.date(),
-            end_date=end_date.date(),
-            options=options
-        )
-        response = client.investments_transactions_get(
-            inv_txn_request)
-        pretty_print_response(response.to_dict())
-        return jsonify(
-            {'error': None, 'investments_transactions': response.to_dict()})
+@app.route('/api/balance/latest', methods=['GET'])
+def get_latest_balances():
+    """Latest recorded balance of every account of the current item"""
+    rows = balance_history.get_latest_balances(get_db(), get_item_id_from_db())
+    return jsonify({'balances': [dict(row) for row in rows]})
 
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
 
-# This functionality is only relevant for the ACH Transfer product.
-# Authorize a transfer
-
-@app.route('/api/transfer_authorize', methods=['GET'])
-def transfer_authorization():
-    global authorization_id
-    global account_id
-    access_token = get_access_token_from_db()
-    acct_request = AccountsGetRequest(access_token=access_token)
-    response = client.accounts_get(acct_request)
-    account_id = response['accounts'][0]['account_id']
-    try:
-        transfer_auth_request = TransferAuthorizationCreateRequest(
-            access_token=access_token,
-            account_id=account_id,
-            type=TransferType('debit'),
-            network=TransferNetwork('ach'),
-            amount='1.00',
-            ach_class=ACHClass('ppd'),
-            user=TransferAuthorizationUserInRequest(
-                legal_name='FirstName LastName',
-                email_address='foobar@email.com',
-                address=TransferUserAddressInRequest(
-                    street='123 Main St.',
-                    city='San Francisco',
-                    region='CA',
-                    postal_code='94053',
-                    country='US'
-                ),
-            ),
-        )
-        response = client.transfer_authorization_create(transfer_auth_request)
-        pretty_print_response(response.to_dict())
-        authorization_id = response['authorization']['id']
-        return jsonify(response.to_dict())
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
+# Retrieve an Item's accounts
+# https://plaid.com/docs/#accounts
 
-# Create Transfer for a specified Transfer ID
 
-@app.route('/api/transfer_create', methods=['GET'])
-def transfer():
-    try:
-        access_token = get_access_token_from_db()
-        transfer_create_request = TransferCreateRequest(
-            access_token=access_token,
-            account_id=account_id,
-            authorization_id=authorization_id,
-            description='Debit')
-        response = client.transfer_create(transfer_create_request)
-        pretty_print_response(response.to_dict())
-        return jsonify(response.to_dict())
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
-
-@app.route('/api/statements', methods=['GET'])
-def statements():
-    try:
+@app.route('/api/accounts', methods=['GET'])
+def get_accounts():
+    def fetch():
         access_token = get_access_token_from_db()
-        statements_request = StatementsListRequest(access_token=access_token)
-        response = client.statements_list(statements_request)
-        pretty_print_response(response.to_dict())
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
-    try:
-        request = StatementsDownloadRequest(
-            access_token=access_token,
-            statement_id=response['accounts'][0]['statements'][0]['statement_id']
+        accounts_request = AccountsGetRequest(
+            access_token=access_token
         )
-        pdf = client.statements_download(request)
-        return jsonify({
-            'error': None,
-            'json': response.to_dict(),
-            'pdf': base64.b64encode(pdf.read()).decode('utf-8'),
-        })
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
-
-
-
+        response = client.accounts_get(accounts_request)
+        log_response(response.to_dict())
+        return response.to_dict()
 
-@app.route('/api/signal_evaluate', methods=['GET'])
-def signal():
-    global account_id
-    access_token = get_access_token_from_db()
-    acct_request = AccountsGetRequest(access_token=access_token)
-    response = client.accounts_get(acct_request)
-    account_id = response['accounts'][0]['account_id']
     try:
-        # Generate unique transaction ID using timestamp and random component
-        client_transaction_id = f"txn-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
-
-        signal_request_params = {
-            'access_token': access_token,
-            'account_id': account_id,
-            'client_transaction_id': client_transaction_id,
-            'amount': 100.00
-        }
-
-        if SIGNAL_RULESET_KEY:
-            signal_request_params['ruleset_key'] = SIGNAL_RULESET_KEY
-
-        request = SignalEvaluateRequest(**signal_request_params)
-        response = client.signal_evaluate(request)
-        pretty_print_response(response.to_dict())
-        return jsonify(response.to_dict())
+        return cached_plaid_response('accounts', fetch)
     except plaid.ApiException as e:
         error_response = format_error(e)
         return jsonify(error_response)
 
 
-# This functionality is only relevant for the UK Payment Initiation product.
-# Retrieve Payment for a specified Payment ID
-
-
-@app.route('/api/payment', methods=['GET'])
-def payment():
-    global payment_id
-    try:
-        request = PaymentInitiationPaymentGetRequest(payment_id=payment_id)
-        response = client.payment_initiation_payment_get(request)
-        pretty_print_response(response.to_dict())
-        return jsonify({'error': None, 'payment': response.to_dict()})
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
 
 
 # Retrieve high-level information about an Item
@@ -1193,101 +571,42 @@ def payment():
 
 @app.route('/api/item', methods=['GET'])
 def item():
-    try:
-        access_token = get_access_token_from_db()
+    def fetch():
+        stored = get_current_item()
+        access_token = stored['access_token'] if stored else None
+        stored_institution_id = stored['institution_id'] if stored else None
+        timeout = fanout.default_timeout()
+
+        # The institution is looked up by the id stored with the item, in
+        # parallel with /item/get, rather than after it
         item_request = ItemGetRequest(access_token=access_token)
-        response = client.item_get(item_request)
-        inst_request = InstitutionsGetByIdRequest(
-            institution_id=response['item']['institution_id'],
-            country_codes=list(map(lambda x: CountryCode(x), PLAID_COUNTRY_CODES))
-        )
-        institution_response = client.institutions_get_by_id(inst_request)
-        pretty_print_response(response.to_dict())
-        pretty_print_response(institution_response.to_dict())
-        return jsonify({'error': None, 'item': response.to_dict()[
-            'item'], 'institution': institution_response.to_dict()['institution']})
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
+        calls = {'item': lambda: client.item_get(item_request, _request_timeout=timeout)}
+        if stored_institution_id:
+            calls['institution'] = lambda: get_institution_pooled(stored_institution_id)
+        results = fanout.run(calls, timeout)
+
+        response = results['item']
+        # Items created without an institution have none to look up
+        institution_id = response.to_dict()['item'].get('institution_id')
+        if institution_id is None:
+            institution = None
+        elif stored_institution_id and institution_id == stored_institution_id:
+            institution = results['institution']
+        else:
+            institution = institutions.get_institution(get_db(), client, institution_id, PLAID_COUNTRY_CODES)
+        log_response(response.to_dict())
+        if institution is not None:
+            log_response(institution)
+        return {'error': None, 'item': response.to_dict()[
+            'item'], 'institution': institution}
 
-# Retrieve CRA Base Report and PDF
-# Base report: https://plaid.com/docs/check/api/#cracheck_reportbase_reportget
-# PDF: https://plaid.com/docs/check/api/#cracheck_reportpdfget
-@app.route('/api/cra/get_base_report', methods=['GET'])
-def cra_check_report():
     try:
-        get_response = poll_with_retries(lambda: client.cra_check_report_base_report_get(
-            CraCheckReportBaseReportGetRequest(user_token=user_token, item_ids=[])
-        ))
-        pretty_print_response(get_response.to_dict())
-
-        pdf_response = client.cra_check_report_pdf_get(
-            CraCheckReportPDFGetRequest(user_token=user_token)
-        )
-        return jsonify({
-            'report': get_response.to_dict()['report'],
-            'pdf': base64.b64encode(pdf_response.read()).decode('utf-8')
-        })
+        return cached_plaid_response('item', fetch)
     except plaid.ApiException as e:
         error_response = format_error(e)
         return jsonify(error_response)
-
-# Retrieve CRA Income Insights and PDF with Insights
-# Income insights: https://plaid.com/docs/check/api/#cracheck_reportincome_insightsget
-# PDF w/ income insights: https://plaid.com/docs/check/api/#cracheck_reportpdfget
-@app.route('/api/cra/get_income_insights', methods=['GET'])
-def cra_income_insights():
-    try:
-        get_response = poll_with_retries(lambda: client.cra_check_report_income_insights_get(
-            CraCheckReportIncomeInsightsGetRequest(user_token=user_token))
-        )
-        pretty_print_response(get_response.to_dict())
-
-        pdf_response = client.cra_check_report_pdf_get(
-            CraCheckReportPDFGetRequest(user_token=user_token, add_ons=[CraPDFAddOns('cra_income_insights')]),
-        )
-
-        return jsonify({
-            'report': get_response.to_dict()['report'],
-            'pdf': base64.b64encode(pdf_response.read()).decode('utf-8')
-        })
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
-
-# Retrieve CRA Partner Insights
-# https://plaid.com/docs/check/api/#cracheck_reportpartner_insightsget
-@app.route('/api/cra/get_partner_insights', methods=['GET'])
-def cra_partner_insights():
-    try:
-        response = poll_with_retries(lambda: client.cra_check_report_partner_insights_get(
-            CraCheckReportPartnerInsightsGetRequest(user_token=user_token)
-        ))
-        pretty_print_response(response.to_dict())
-
-        return jsonify(response.to_dict())
-    except plaid.ApiException as e:
-        error_response = format_error(e)
-        return jsonify(error_response)
-
-# Since this quickstart does not support webhooks, this function can be used to poll
-# an API that would otherwise be triggered by a webhook.
-# For a webhook example, see
-# https://github.com/plaid/tutorial-resources or
-# https://github.com/plaid/pattern
-def poll_with_retries(request_callback, ms=1000, retries_left=20):
-    while retries_left > 0:
-        try:
-            return request_callback()
-        except plaid.ApiException as e:
-            response = json.loads(e.body)
-            if response['error_code'] != 'PRODUCT_NOT_READY':
-                raise e
-            elif retries_left == 0:
-                raise Exception('Ran out of retries while polling') from e
-            else:
-                retries_left -= 1
-                time.sleep(ms / 1000)
+    except fanout.FanoutTimeout as e:
+        return jsonify(format_timeout(e))
 
 
 # ============================================
@@ -1338,60 +657,28 @@ def webhook_handler():
 
     print(f"[WEBHOOK] Received: {webhook_type} - {webhook_code} for item: {item_id}")
 
+    # Drop cached Plaid responses this webhook makes stale
+    try:
+        invalidated = response_cache.invalidate_for_webhook(item_id, webhook_type)
+        if invalidated:
+            print(f"[WEBHOOK] Invalidated {invalidated} cached responses for item: {item_id}")
+    except Exception as e:
+        print(f"[WEBHOOK] Error invalidating response cache: {e}")
+
     # Transaction webhooks
     if webhook_type == 'TRANSACTIONS':
         if webhook_code in ['SYNC_UPDATES_AVAILABLE', 'DEFAULT_UPDATE', 'HISTORICAL_UPDATE']:
-            # Trigger transaction sync for this item
+            # Queue a transaction sync for this item; the ETL queue workers run
+            # it, so the webhook is acknowledged without waiting on Plaid.
+            # A burst of webhooks for the item collapses into one queued job
             print(f"[WEBHOOK] Transaction updates available for item: {item_id}")
             try:
-                # Get the access token for this item
-                db = get_db()
-                cur = db.cursor()
-                cur.execute('SELECT access_token FROM plaid_items WHERE item_id = %s', (item_id,))
-                result = cur.fetchone()
-                cur.close()
-
-                if result:
-                    access_token = result['access_token']
-                    cursor = get_sync_cursor(item_id)
-
-                    # Sync transactions
-                    added = []
-                    modified = []
-                    removed = []
-                    has_more = True
-
-                    while has_more:
-                        txn_request = TransactionsSyncRequest(
-                            access_token=access_token,
-                            cursor=cursor,
-                        )
-                        response = client.transactions_sync(txn_request).to_dict()
-                        cursor = response['next_cursor']
-
-                        if cursor == '':
-                            break
-
-                        added.extend(response['added'])
-                        modified.extend(response['modified'])
-                        removed.extend(response['removed'])
-                        has_more = response['has_more']
-
-                    # Save to database
-                    for txn in added:
-                        save_transaction(txn)
-                    for txn in modified:
-                        save_transaction(txn)
-                    for txn in removed:
-                        delete_transaction(txn['transaction_id'])
-
-                    if cursor:
-                        save_sync_cursor(item_id, cursor)
-
-                    print(f"[WEBHOOK] Synced: +{len(added)} added, ~{len(modified)} modified, -{len(removed)} removed")
-
+                job_id = job_queue.enqueue(get_db(), 'sync_transactions', item_id, {
+                    'webhook_code': webhook_code
+                })
+                print(f"[WEBHOOK] Queued sync job {job_id} for item: {item_id}")
             except Exception as e:
-                print(f"[WEBHOOK] Error syncing transactions: {e}")
+                print(f"[WEBHOOK] Error queueing transaction sync: {e}")
 
     # Item error webhooks
     elif webhook_type == 'ITEM':
@@ -1443,13 +730,44 @@ def get_items_status():
     })
 
 
-def pretty_print_response(response):
-  print(json.dumps(response, indent=2, sort_keys=True, default=str))
+@app.route('/api/db/pool_stats', methods=['GET'])
+def get_pool_stats():
+    """Connection pool usage, for sizing DB_POOL_MAX_SIZE under load"""
+    return jsonify(db_pool.pool_stats())
+
+
+@app.route('/api/jobs/stats', methods=['GET'])
+def get_job_queue_stats():
+    """Sync job queue depth, running and dead-lettered jobs"""
+    return jsonify(job_queue.queue_stats(get_db()))
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_response_cache_stats():
+    """Plaid response and PDF cache hit rates, sizes, evictions and invalidations"""
+    return jsonify(dict(response_cache.cache_stats(), pdf=pdf_cache.cache_stats()))
+
+
+@app.route('/api/plaid/fanout', methods=['GET'])
+def get_fanout_stats():
+    """Concurrent Plaid calls made by endpoints, timeouts and time saved"""
+    return jsonify(fanout.fanout_stats())
+
+
+@app.route('/api/plaid/rate_limits', methods=['GET'])
+def get_rate_limit_stats():
+    """Time spent throttled and rate-limit errors per Plaid endpoint"""
+    return jsonify(rate_limiter.limiter_stats())
+
+
+@app.route('/api/logging/stats', methods=['GET'])
+def get_logging_stats():
+    """Plaid responses logged, sampled out and dropped by the structured log"""
+    return jsonify(structured_log.log_stats())
+
 
-def format_error(e):
-    response = json.loads(e.body)
-    return {'error': {'status_code': e.status, 'display_message':
-                      response['error_message'], 'error_code': response['error_code'], 'error_type': response['error_type']}}
 
+# Development server only; production runs `gunicorn -c gunicorn.conf.py server:app`
 if __name__ == '__main__':
+    setup_database()
     app.run(port=int(os.getenv('PORT', 8000)))
@@ -0,0 +1,310 @@
+"""
+Configuration, the Plaid client and helpers shared by server.py and the
+per-product blueprints in routes/.
+
+Only the plaid.model classes every deployment needs are imported here; each
+product's request models are imported by its blueprint, which server.py only
+loads when the product is in PLAID_PRODUCTS.
+"""
+
+import json
+import os
+
+from dotenv import load_dotenv
+from flask import current_app, g, jsonify, send_file
+import plaid
+from plaid.model.products import Products
+from plaid.api import plaid_api
+import db_pool
+import rate_limiter
+from row_hash import content_hash
+import balance_history
+import institutions
+import pdf_cache
+import report_jobs
+import response_cache
+
+load_dotenv()
+
+PLAID_CLIENT_ID = os.getenv('PLAID_CLIENT_ID')
+PLAID_SECRET = os.getenv('PLAID_SECRET')
+PLAID_ENV = os.getenv('PLAID_ENV', 'sandbox')
+PLAID_PRODUCTS = os.getenv('PLAID_PRODUCTS', 'transactions').split(',')
+PLAID_COUNTRY_CODES = os.getenv('PLAID_COUNTRY_CODES', 'US').split(',')
+
+# PostgreSQL connections come from the shared pool in db_pool.py, configured
+# with the POSTGRES_* and DB_POOL_* environment variables
+
+def get_db():
+    if 'db' not in g:
+        g.db = db_pool.getconn()
+    return g.db
+
+def close_db(e=None):
+    db = g.pop('db', None)
+    if db is not None:
+        db_pool.putconn(db)
+
+
+def empty_to_none(field):
+    value = os.getenv(field)
+    if value is None or len(value) == 0:
+        return None
+    return value
+
+host = plaid.Environment.Sandbox
+
+if PLAID_ENV == 'sandbox':
+    host = plaid.Environment.Sandbox
+
+if PLAID_ENV == 'production':
+    host = plaid.Environment.Production
+
+# Parameters used for the OAuth redirect Link flow.
+#
+# Set PLAID_REDIRECT_URI to 'http://localhost:3000/'
+# The OAuth redirect flow requires an endpoint on the developer's website
+# that the bank website should redirect to. You will need to configure
+# this redirect URI for your client ID through the Plaid developer dashboard
+# at https://dashboard.plaid.com/team/api.
+PLAID_REDIRECT_URI = empty_to_none('PLAID_REDIRECT_URI')
+
+configuration = plaid.Configuration(
+    host=host,
+    api_key={
+        'clientId': PLAID_CLIENT_ID,
+        'secret': PLAID_SECRET,
+        'plaidVersion': '2020-09-14'
+    }
+)
+
+api_client = plaid.ApiClient(configuration)
+# Every Plaid call goes through the shared adaptive rate limiter
+client = rate_limiter.RateLimitedPlaidApi(plaid_api.PlaidApi(api_client))
+
+products = []
+for product in PLAID_PRODUCTS:
+    products.append(Products(product))
+
+# Ids created by the payment initiation, transfer and CRA demo flows. Like the
+# quickstart they are kept in process memory rather than the database, see
+# gunicorn.conf.py for running them with one worker
+demo_state = {
+    'payment_id': None,
+    'user_token': None,
+    'authorization_id': None,
+    'account_id': None,
+}
+
+
+# Helper functions to get/set tokens from database
+def get_current_item():
+    """Get the most recent item from database"""
+    db = get_db()
+    cur = db.cursor()
+    cur.execute('SELECT * FROM plaid_items ORDER BY created_at DESC LIMIT 1')
+    item = cur.fetchone()
+    cur.close()
+    return item
+
+def save_item(item_id, access_token, user_token=None, payment_id=None, transfer_id=None):
+    """Save or update an item in the database"""
+    db = get_db()
+    cur = db.cursor()
+    cur.execute('''
+        INSERT INTO plaid_items (item_id, access_token, user_token, payment_id, transfer_id)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (item_id) DO UPDATE SET
+            access_token = EXCLUDED.access_token,
+            user_token = COALESCE(EXCLUDED.user_token, plaid_items.user_token),
+            payment_id = COALESCE(EXCLUDED.payment_id, plaid_items.payment_id),
+            transfer_id = COALESCE(EXCLUDED.transfer_id, plaid_items.transfer_id),
+            updated_at = CURRENT_TIMESTAMP
+    ''', (item_id, access_token, user_token, payment_id, transfer_id))
+    db.commit()
+    cur.close()
+
+def get_access_token_from_db():
+    """Get access token from the most recent item"""
+    item = get_current_item()
+    return item['access_token'] if item else None
+
+def get_item_id_from_db():
+    """Get item_id from the most recent item"""
+    item = get_current_item()
+    return item['item_id'] if item else None
+
+# ============================================
+# Database helper functions for Plaid data
+# ============================================
+
+def save_item_full(item_data, access_token, institution_id=None):
+    """Save full item data to database"""
+    db = get_db()
+    cur = db.cursor()
+    cur.execute('''
+        INSERT INTO plaid_items (
+            item_id, access_token, institution_id, consent_expiration_time,
+            update_type, webhook, error, available_products, billed_products, raw_data
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (item_id) DO UPDATE SET
+            access_token = EXCLUDED.access_token,
+            institution_id = COALESCE(EXCLUDED.institution_id, plaid_items.institution_id),
+            consent_expiration_time = EXCLUDED.consent_expiration_time,
+            update_type = EXCLUDED.update_type,
+            webhook = EXCLUDED.webhook,
+            error = EXCLUDED.error,
+            available_products = EXCLUDED.available_products,
+            billed_products = EXCLUDED.billed_products,
+            raw_data = EXCLUDED.raw_data,
+            updated_at = CURRENT_TIMESTAMP
+    ''', (
+        item_data.get('item_id'),
+        access_token,
+        institution_id or item_data.get('institution_id'),
+        item_data.get('consent_expiration_time'),
+        item_data.get('update_type'),
+        item_data.get('webhook'),
+        json.dumps(item_data.get('error'), default=str) if item_data.get('error') else None,
+        item_data.get('available_products'),
+        item_data.get('billed_products'),
+        json.dumps(item_data, default=str)
+    ))
+    db.commit()
+    cur.close()
+
+def save_account(account_data, item_id):
+    """Save account data to database, returning False if it was unchanged"""
+    db = get_db()
+    cur = db.cursor()
+
+    balances = account_data.get('balances', {})
+
+    cur.execute('''
+        INSERT INTO financial_accounts (
+            account_id, item_id, name, official_name, type, subtype, mask,
+            current_balance, available_balance, limit_amount,
+            iso_currency_code, unofficial_currency_code, persistent_account_id, raw_data,
+            content_hash
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (account_id) DO UPDATE SET
+            name = EXCLUDED.name,
+            official_name = EXCLUDED.official_name,
+            type = EXCLUDED.type,
+            subtype = EXCLUDED.subtype,
+            mask = EXCLUDED.mask,
+            current_balance = EXCLUDED.current_balance,
+            available_balance = EXCLUDED.available_balance,
+            limit_amount = EXCLUDED.limit_amount,
+            iso_currency_code = EXCLUDED.iso_currency_code,
+            unofficial_currency_code = EXCLUDED.unofficial_currency_code,
+            persistent_account_id = EXCLUDED.persistent_account_id,
+            raw_data = EXCLUDED.raw_data,
+            content_hash = EXCLUDED.content_hash,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE financial_accounts.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+    ''', (
+        account_data.get('account_id'),
+        item_id,
+        account_data.get('name'),
+        account_data.get('official_name'),
+        account_data.get('type'),
+        account_data.get('subtype'),
+        account_data.get('mask'),
+        balances.get('current'),
+        balances.get('available'),
+        balances.get('limit'),
+        balances.get('iso_currency_code'),
+        balances.get('unofficial_currency_code'),
+        account_data.get('persistent_account_id'),
+        json.dumps(account_data, default=str),
+        content_hash(account_data)
+    ))
+    written = cur.rowcount == 1
+    db.commit()
+    cur.close()
+    return written
+
+def save_account_balance_history(account_id, balances):
+    """Record a balance snapshot if the balance changed, and update the rollups"""
+    db = get_db()
+    cur = db.cursor()
+    recorded = balance_history.record_balance(cur, account_id, balances)
+    db.commit()
+    cur.close()
+    return recorded
+
+def get_default_account_id(access_token, item_id):
+    """The item's first account, read from financial_accounts (stored at link
+    time), so demo flows needing an account id skip /accounts/get"""
+    db = get_db()
+    cur = db.cursor()
+    cur.execute('SELECT account_id FROM financial_accounts WHERE item_id = %s ORDER BY id LIMIT 1', (item_id,))
+    result = cur.fetchone()
+    cur.close()
+    if result:
+        return result['account_id']
+    from plaid.model.accounts_get_request import AccountsGetRequest
+    response = client.accounts_get(AccountsGetRequest(access_token=access_token))
+    return response['accounts'][0]['account_id']
+
+def get_institution_pooled(institution_id):
+    """institutions.get_institution on a pooled connection, for calls made off the request thread"""
+    with db_pool.connection() as conn:
+        return institutions.get_institution(conn, client, institution_id, PLAID_COUNTRY_CODES)
+
+def get_sync_cursor(item_id):
+    """Get sync cursor for an item"""
+    db = get_db()
+    cur = db.cursor()
+    cur.execute('SELECT cursor FROM sync_cursors WHERE item_id = %s', (item_id,))
+    result = cur.fetchone()
+    cur.close()
+    return result['cursor'] if result else ''
+
+def cached_plaid_response(endpoint, fetch):
+    """Serve the current item's cached response for `endpoint`, or call fetch() and cache it.
+
+    The serialized body is cached, so a hit returns exactly what a miss did.
+    Plaid errors raised by fetch() are not cached.
+    """
+    item_id = get_item_id_from_db()
+    body = response_cache.get(item_id, endpoint)
+    if body is None:
+        body = current_app.json.dumps(fetch())
+        response_cache.put(item_id, endpoint, body)
+    return current_app.response_class(body, mimetype='application/json')
+
+
+def pdf_download(source_key, download, filename):
+    """Send a PDF from the PDF cache, or stream it from Plaid into the cache on a miss.
+
+    download() makes the Plaid call with _preload_content=False; a Plaid error
+    it raises propagates before any byte is sent.
+    """
+    cached = pdf_cache.lookup(get_db(), source_key)
+    if cached is not None:
+        # Cached files are named by their digest, which makes a strong ETag
+        return send_file(cached['path'], mimetype='application/pdf', as_attachment=True,
+                         download_name=filename, etag=cached['digest'], conditional=True)
+
+    body = pdf_cache.stream_into_cache(source_key, download())
+    response = current_app.response_class(body, mimetype='application/pdf')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def start_report_job(report_type, item_id, params):
+    """Start a report job and answer 202 with its id, to poll at /api/report_jobs/<job_id>"""
+    job_id = report_jobs.start(get_db(), report_type, item_id, params)
+    report_jobs.ensure_poller(client)
+    return jsonify({'error': None, 'job_id': job_id, 'report_type': report_type, 'status': 'pending'}), 202
+
+
+def format_error(e):
+    response = json.loads(e.body)
+    return {'error': {'status_code': e.status, 'display_message':
+                      response['error_message'], 'error_code': response['error_code'], 'error_type': response['error_type']}}
+
+def format_timeout(e):
+    return {'error': {'status_code': 504, 'display_message': str(e),
+                      'error_code': 'UPSTREAM_TIMEOUT', 'error_type': 'API_ERROR'}}
@@ -0,0 +1,218 @@
+"""
+Incrementally maintained spending aggregates.
+
+Totals and counts of financial_transactions are kept per account and
+category per month, per account and merchant per month, and per account per
+day, so spending summaries read O(buckets) rows instead of scanning every
+transaction. Amounts follow Plaid's sign convention: positive is money out.
+
+The aggregates are never rebuilt on sync. transaction_writer captures the
+old version of every row it changes or deletes (counted with sign -1) and the
+new version of every row it writes (sign +1) into a temp delta table, and
+apply_deltas() folds those into the aggregate tables in the same transaction
+as the write. Unchanged rows skipped by the content_hash check produce no
+delta at all. rebuild() recomputes everything from scratch; init_db runs it
+once when the aggregate tables are first created over existing data, and
+`etl.py rebuild_spending_aggregates` runs it on demand.
+
+Usage:
+    spending_aggregates.start_deltas(cur)
+    spending_aggregates.capture(cur, -1, 'DELETE ... RETURNING ...', params)
+    spending_aggregates.apply_deltas(cur)
+
+    spending_aggregates.get_summary(conn, 'category', start_date, end_date, item_id=item_id)
+"""
+
+DELTA_TABLE = 'spending_deltas'
+
+# Transaction columns the aggregates depend on, in delta table order
+TRACKED_COLUMNS = ('account_id', 'date', 'personal_finance_category_primary', 'merchant_name', 'amount')
+
+# Summary dimension -> table, dimension column and the expression filling it,
+# and the period column and the expression bucketing `date` into it. NULL
+# categories and merchants are stored as '' since they are part of the key.
+AGGREGATES = {
+    'category': {
+        'table': 'spending_by_category_month',
+        'column': 'category',
+        'expression': "COALESCE(personal_finance_category_primary, '')",
+        'period': 'month',
+        'period_expression': "date_trunc('month', date)::date",
+    },
+    'merchant': {
+        'table': 'spending_by_merchant_month',
+        'column': 'merchant_name',
+        'expression': "COALESCE(merchant_name, '')",
+        'period': 'month',
+        'period_expression': "date_trunc('month', date)::date",
+    },
+    'account': {
+        'table': 'spending_by_account_day',
+        'column': None,
+        'expression': None,
+        'period': 'day',
+        'period_expression': 'date',
+    },
+}
+
+
+def _keys(spec):
+    """Key columns of an aggregate table"""
+    if spec['column']:
+        return ('account_id', spec['column'], spec['period'])
+    return ('account_id', spec['period'])
+
+
+def _key_expressions(spec):
+    if spec['column']:
+        return ('account_id', spec['expression'], spec['period_expression'])
+    return ('account_id', spec['period_expression'])
+
+
+def create_tables(cur):
+    """Create the aggregate tables; called from init_db after financial_transactions"""
+    created = False
+    for spec in AGGREGATES.values():
+        cur.execute('SELECT to_regclass(%s) IS NULL AS missing', (spec['table'],))
+        created = cur.fetchone()['missing'] or created
+
+        dimension = f"{spec['column']} VARCHAR(255) NOT NULL," if spec['column'] else ''
+        cur.execute(f'''
+            CREATE TABLE IF NOT EXISTS {spec['table']} (
+                account_id VARCHAR(255) NOT NULL REFERENCES financial_accounts(account_id),
+                {dimension}
+                {spec['period']} DATE NOT NULL,
+                total_amount DECIMAL(18, 2) NOT NULL DEFAULT 0,
+                transaction_count INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY ({', '.join(_keys(spec))})
+            )
+        ''')
+        # Summaries filter by period across accounts
+        cur.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{spec['table']}_{spec['period']}
+            ON {spec['table']} ({spec['period']})
+        ''')
+
+    if created:
+        rebuild_tables(cur)
+
+
+def start_deltas(cur):
+    """Create (or empty) this session's delta table"""
+    columns = ', '.join(TRACKED_COLUMNS)
+    cur.execute(f'''
+        CREATE TEMP TABLE IF NOT EXISTS {DELTA_TABLE}
+        ON COMMIT DELETE ROWS
+        AS SELECT 0 AS sign, {columns} FROM financial_transactions
+        WITH NO DATA
+    ''')
+    cur.execute(f'TRUNCATE {DELTA_TABLE}')
+
+
+def capture(cur, sign, rows_sql, params=None):
+    """Record the rows returned by `rows_sql` as deltas with `sign`; returns the row count.
+
+    `rows_sql` is a SELECT, or an INSERT/UPDATE/DELETE with a RETURNING clause,
+    producing TRACKED_COLUMNS.
+    """
+    columns = ', '.join(TRACKED_COLUMNS)
+    cur.execute(f'''
+        WITH changed AS ({rows_sql})
+        INSERT INTO {DELTA_TABLE} (sign, {columns})
+        SELECT {int(sign)}, {columns} FROM changed
+    ''', params)
+    return cur.rowcount
+
+
+def apply_deltas(cur):
+    """Fold the captured deltas into every aggregate and clear them; the caller commits"""
+    for spec in AGGREGATES.values():
+        keys = ', '.join(_keys(spec))
+        expressions = ', '.join(_key_expressions(spec))
+        # Buckets are touched in key order so concurrent syncs lock them in the same order
+        cur.execute(f'''
+            INSERT INTO {spec['table']} AS agg ({keys}, total_amount, transaction_count)
+            SELECT {expressions}, SUM(sign * COALESCE(amount, 0)), SUM(sign)
+            FROM {DELTA_TABLE}
+            WHERE account_id IS NOT NULL
+            GROUP BY {expressions}
+            HAVING SUM(sign) <> 0 OR SUM(sign * COALESCE(amount, 0)) <> 0
+            ORDER BY {expressions}
+            ON CONFLICT ({keys}) DO UPDATE SET
+                total_amount = agg.total_amount + EXCLUDED.total_amount,
+                transaction_count = agg.transaction_count + EXCLUDED.transaction_count,
+                updated_at = CURRENT_TIMESTAMP
+        ''')
+        cur.execute(f'''
+            DELETE FROM {spec['table']}
+            WHERE transaction_count = 0
+              AND ({keys}) IN (SELECT {expressions} FROM {DELTA_TABLE})
+        ''')
+    cur.execute(f'TRUNCATE {DELTA_TABLE}')
+
+
+def rebuild_tables(cur):
+    """Recompute every aggregate from financial_transactions; the caller commits"""
+    for spec in AGGREGATES.values():
+        keys = ', '.join(_keys(spec))
+        expressions = ', '.join(_key_expressions(spec))
+        cur.execute(f"TRUNCATE {spec['table']}")
+        cur.execute(f'''
+            INSERT INTO {spec['table']} ({keys}, total_amount, transaction_count)
+            SELECT {expressions}, SUM(COALESCE(amount, 0)), COUNT(*)
+            FROM financial_transactions
+            WHERE account_id IS NOT NULL
+            GROUP BY {expressions}
+        ''')
+
+
+def rebuild(conn):
+    """Recompute every aggregate and commit; returns the number of buckets"""
+    cur = conn.cursor()
+    # Keep syncs from applying deltas to a half-built table
+    for spec in AGGREGATES.values():
+        cur.execute(f"LOCK TABLE {spec['table']} IN EXCLUSIVE MODE")
+    rebuild_tables(cur)
+    buckets = 0
+    for spec in AGGREGATES.values():
+        cur.execute(f"SELECT COUNT(*) AS buckets FROM {spec['table']}")
+        buckets += cur.fetchone()['buckets']
+    conn.commit()
+    cur.close()
+    return buckets
+
+
+def get_summary(conn, group_by, start_date, end_date, item_id=None, account_ids=None):
+    """Totals per dimension value and period between two dates, summed over accounts.
+
+    group_by is 'category', 'merchant' or 'account'. Monthly aggregates
+    include every month overlapping the range.
+    """
+    spec = AGGREGATES[group_by]
+    period = spec['period']
+    dimension = spec['column'] or 'account_id'
+    value = f"NULLIF({dimension}, '')" if spec['column'] else dimension
+
+    cur = conn.cursor()
+    cur.execute(f'''
+        SELECT {value} AS {group_by}, {period} AS period,
+               SUM(total_amount) AS total_amount,
+               SUM(transaction_count) AS transaction_count
+        FROM {spec['table']}
+        WHERE {period} BETWEEN date_trunc(%(period)s, %(start_date)s::date)::date AND %(end_date)s
+          AND (%(item_id)s::VARCHAR IS NULL OR account_id IN (
+              SELECT account_id FROM financial_accounts WHERE item_id = %(item_id)s))
+          AND (%(account_ids)s::VARCHAR[] IS NULL OR account_id = ANY(%(account_ids)s))
+        GROUP BY {dimension}, {period}
+        ORDER BY {period}, total_amount DESC
+    ''', {
+        'period': period,
+        'start_date': start_date,
+        'end_date': end_date,
+        'item_id': item_id,
+        'account_ids': list(account_ids) if account_ids else None,
+    })
+    rows = cur.fetchall()
+    cur.close()
+    return rows
@@ -0,0 +1,190 @@
+"""
+Local archive of every statement of every linked item.
+
+archive_item() lists an item's statements, compares them against the
+statement_ids already in statement_archive and downloads only the new ones,
+up to STATEMENT_ARCHIVE_CONCURRENCY at a time. Each PDF is streamed from
+Plaid straight to disk, so none is held in memory whole, and is only recorded
+once it was written completely; a failed download is simply tried again on
+the next run. Unlike the PDF cache the archive is never evicted. Files are
+laid out as <item_id>/<account_id>/<year>-<month>_<statement_id>.pdf.
+Configuration is read from the environment:
+
+    STATEMENT_ARCHIVE_DIR          Archive directory (default statement_archive next to this file)
+    STATEMENT_ARCHIVE_CONCURRENCY  Downloads in flight per item (default 4)
+
+Usage:
+    archived, failed = statement_archive.archive_item(conn, client, item)
+
+    statement_archive.lookup(conn, statement_id)
+"""
+
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import db_pool
+
+DEFAULT_CONCURRENCY = 4
+CHUNK_SIZE = 64 * 1024
+
+
+def archive_dir():
+    return os.getenv('STATEMENT_ARCHIVE_DIR',
+                     os.path.join(os.path.dirname(os.path.abspath(__file__)), 'statement_archive'))
+
+
+def download_concurrency():
+    return max(1, int(os.getenv('STATEMENT_ARCHIVE_CONCURRENCY', DEFAULT_CONCURRENCY)))
+
+
+def create_tables(cur):
+    """Create the statement_archive table; called from init_db"""
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS statement_archive (
+            statement_id VARCHAR(255) PRIMARY KEY,
+            item_id VARCHAR(255) REFERENCES plaid_items(item_id),
+            account_id VARCHAR(255) NOT NULL,
+            year INTEGER,
+            month INTEGER,
+            date_posted DATE,
+            path TEXT NOT NULL,
+            digest CHAR(64) NOT NULL,
+            size BIGINT NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_statement_archive_item
+        ON statement_archive (item_id, account_id)
+    ''')
+
+
+def archived_ids(conn, item_id):
+    """statement_ids of an item that are already archived"""
+    cur = conn.cursor()
+    cur.execute('SELECT statement_id FROM statement_archive WHERE item_id = %s', (item_id,))
+    ids = {row['statement_id'] for row in cur.fetchall()}
+    cur.close()
+    conn.commit()
+    return ids
+
+
+def lookup(conn, statement_id):
+    """The archive row of a statement whose file is still on disk, or None"""
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT statement_id, item_id, account_id, path, digest, size
+        FROM statement_archive
+        WHERE statement_id = %s
+    ''', (statement_id,))
+    row = cur.fetchone()
+    cur.close()
+    conn.commit()
+    if row is None or not os.path.exists(row['path']):
+        return None
+    return row
+
+
+def list_statements(client, access_token):
+    """(account_id, statement) for every statement Plaid lists for an item"""
+    # Model imports are deferred so deployments without statements never load them
+    from plaid.model.statements_list_request import StatementsListRequest
+
+    response = client.statements_list(StatementsListRequest(access_token=access_token))
+    return [
+        (account['account_id'], statement.to_dict())
+        for account in response['accounts']
+        for statement in account['statements']
+    ]
+
+
+def _path(item_id, account_id, statement):
+    name = f"{statement['statement_id']}.pdf"
+    if statement.get('year') and statement.get('month'):
+        name = f"{statement['year']}-{statement['month']:02d}_{name}"
+    return os.path.join(archive_dir(), item_id, account_id, name)
+
+
+def download_statement(client, item, account_id, statement):
+    """Stream one statement to the archive and record it; returns its size in bytes"""
+    from plaid.model.statements_download_request import StatementsDownloadRequest
+
+    path = _path(item['item_id'], account_id, statement)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    upstream = client.statements_download(
+        StatementsDownloadRequest(access_token=item['access_token'], statement_id=statement['statement_id']),
+        _preload_content=False
+    )
+    digest = hashlib.sha256()
+    size = 0
+    part = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.part', delete=False)
+    try:
+        for chunk in upstream.stream(CHUNK_SIZE):
+            part.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+        part.close()
+        upstream.release_conn()
+        os.replace(part.name, path)
+    except BaseException:
+        part.close()
+        os.unlink(part.name)
+        upstream.close()
+        raise
+
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            INSERT INTO statement_archive (
+                statement_id, item_id, account_id, year, month, date_posted, path, digest, size
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (statement_id) DO UPDATE SET
+                path = EXCLUDED.path,
+                digest = EXCLUDED.digest,
+                size = EXCLUDED.size,
+                archived_at = CURRENT_TIMESTAMP
+        ''', (
+            statement['statement_id'],
+            item['item_id'],
+            account_id,
+            statement.get('year'),
+            statement.get('month'),
+            statement.get('date_posted'),
+            path,
+            digest.hexdigest(),
+            size
+        ))
+        conn.commit()
+        cur.close()
+    return size
+
+
+def archive_item(conn, client, item, concurrency=None, log=print):
+    """Download the statements of an item that aren't archived yet; returns (archived, failed).
+
+    A statement whose download fails is logged and left for the next run.
+    """
+    statements = list_statements(client, item['access_token'])
+    known = archived_ids(conn, item['item_id'])
+    new = [(account_id, statement) for account_id, statement in statements
+           if statement['statement_id'] not in known]
+    if not new:
+        return 0, 0
+
+    def download(entry):
+        account_id, statement = entry
+        try:
+            download_statement(client, item, account_id, statement)
+            return True
+        except Exception as e:
+            log(f"Could not archive statement {statement['statement_id']} of item {item['item_id']}: {e}")
+            return False
+
+    workers = min(concurrency or download_concurrency(), len(new))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='statement-archive') as executor:
+        results = list(executor.map(download, new))
+    archived = sum(results)
+    return archived, len(results) - archived
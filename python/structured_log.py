@@ -0,0 +1,256 @@
+"""
+Structured, sampled logging of Plaid responses off the request thread.
+
+log_response() replaces printing every Plaid response as indented JSON from
+the request thread. It checks the level and the endpoint's sample rate
+first, so a response that isn't logged costs nothing, and otherwise only
+puts the record on a bounded in-memory queue. A listener thread does the
+expensive part: it redacts account numbers, tokens and identity fields,
+cuts long lists and the serialized payload short, formats the record and writes it to
+stdout. When the queue is full records are dropped and counted rather than
+making the request wait. Configuration is read from the environment:
+
+    LOG_LEVEL                      Minimum level written (default INFO; WARNING silences responses)
+    LOG_FORMAT                     text, or json for one JSON object per line (default text)
+    RESPONSE_LOG_SAMPLE            Fraction of responses logged (default 1)
+    RESPONSE_LOG_SAMPLE_<VIEW>     Per-endpoint override by view name, e.g. RESPONSE_LOG_SAMPLE_GET_TRANSACTIONS
+    RESPONSE_LOG_MAX_ITEMS         List elements kept per list (default 5)
+    RESPONSE_LOG_MAX_CHARS         Characters a serialized response is cut to (default 4000)
+    RESPONSE_LOG_REDACT_KEYS       Comma separated keys redacted on top of REDACT_KEYS
+    LOG_QUEUE_SIZE                 Records waiting to be written before new ones are dropped (default 10000)
+
+Responses are serialized later on the listener thread, so a caller must not
+mutate a response after logging it (pass response.to_dict(), not a dict it
+keeps building).
+
+Usage:
+    structured_log.log_response(response.to_dict())
+    structured_log.get_logger().warning('Sync lock busy', extra={'item_id': item_id})
+
+    structured_log.log_stats()
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+
+DEFAULT_MAX_ITEMS = 5
+DEFAULT_MAX_CHARS = 4000
+DEFAULT_QUEUE_SIZE = 10000
+
+# Keys whose values are never written: account and routing numbers, tokens,
+# and the personal data of identity responses
+REDACT_KEYS = {
+    'access_token', 'public_token', 'processor_token', 'user_token', 'payment_token',
+    'account', 'routing', 'wire_routing', 'iban', 'bacs', 'eft', 'international',
+    'names', 'emails', 'phone_numbers', 'addresses', 'date_of_birth', 'ssn', 'secret',
+}
+
+LOGGER_NAME = 'plaid_quickstart'
+
+_stats = {'logged': 0, 'sampled_out': 0, 'dropped': 0, 'written': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def _redact_keys():
+    extra = os.getenv('RESPONSE_LOG_REDACT_KEYS', '')
+    return REDACT_KEYS | {key.strip() for key in extra.split(',') if key.strip()}
+
+
+def _sample_rates():
+    prefix = 'RESPONSE_LOG_SAMPLE_'
+    return {
+        key[len(prefix):].lower(): float(value)
+        for key, value in os.environ.items()
+        if key.startswith(prefix)
+    }
+
+
+def scrub(value, redact_keys, max_items):
+    """A copy of a response with redacted keys masked and lists cut to max_items"""
+    if isinstance(value, dict):
+        return {
+            key: '[REDACTED]' if key in redact_keys and item is not None else scrub(item, redact_keys, max_items)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        kept = [scrub(item, redact_keys, max_items) for item in value[:max_items]]
+        if len(value) > max_items:
+            kept.append(f'... {len(value) - max_items} more')
+        return kept
+    return value
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats records, and the response payload they carry, as text or a JSON line"""
+
+    def __init__(self, fmt='text'):
+        super().__init__()
+        self.json = fmt == 'json'
+        self.redact_keys = _redact_keys()
+        self.max_items = int(os.getenv('RESPONSE_LOG_MAX_ITEMS', DEFAULT_MAX_ITEMS))
+        self.max_chars = int(os.getenv('RESPONSE_LOG_MAX_CHARS', DEFAULT_MAX_CHARS))
+
+    def _payload(self, record):
+        payload = getattr(record, 'payload', None)
+        if payload is None:
+            return None
+        text = json.dumps(scrub(payload, self.redact_keys, self.max_items), sort_keys=True, default=str)
+        if len(text) > self.max_chars:
+            text = f'{text[:self.max_chars]}... ({len(text) - self.max_chars} more chars)'
+        return text
+
+    def format(self, record):
+        timestamp = datetime.fromtimestamp(record.created, timezone.utc).isoformat()
+        message = record.getMessage()
+        payload = self._payload(record)
+        endpoint = getattr(record, 'endpoint', None)
+        if self.json:
+            entry = {'ts': timestamp, 'level': record.levelname, 'logger': record.name, 'msg': message}
+            if endpoint:
+                entry['endpoint'] = endpoint
+            if payload is not None:
+                # Already cut to max_chars, so it is embedded as a string
+                entry['payload'] = payload
+            if record.exc_text:
+                entry['exc'] = record.exc_text
+            return json.dumps(entry, default=str)
+
+        line = f"[{timestamp}] [{record.levelname}] [{endpoint or record.name}] {message}"
+        if payload is not None:
+            line = f'{line} {payload}'
+        if record.exc_text:
+            line = f'{line}\n{record.exc_text}'
+        return line
+
+
+class _CountingHandler(logging.StreamHandler):
+    def emit(self, record):
+        super().emit(record)
+        _count('written')
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener and drops records when the queue is full"""
+
+    def prepare(self, record):
+        # The stock prepare() formats the record here, on the request thread;
+        # the listener's formatter does it instead. Only a traceback is
+        # rendered now, rather than keeping its frames alive in the queue
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        _ensure_listener(self)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _count('dropped')
+
+
+_logger = None
+_queue = None
+_sample_rates_by_view = {}
+_listener = None
+_listener_pid = None
+_setup_lock = threading.Lock()
+
+
+def _new_queue():
+    return queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)))
+
+
+def _ensure_listener(queue_handler):
+    """Start this process's listener thread.
+
+    Threads don't survive fork(), so each gunicorn worker starts its own, on
+    a fresh queue: the inherited one may have been locked by the master's
+    listener at the time of the fork.
+    """
+    global _queue, _listener, _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _setup_lock:
+        if _listener_pid == os.getpid():
+            return
+        if _listener_pid is not None:
+            _queue = queue_handler.queue = _new_queue()
+        handler = _CountingHandler(sys.stdout)
+        handler.setFormatter(StructuredFormatter(os.getenv('LOG_FORMAT', 'text').lower()))
+        _listener = logging.handlers.QueueListener(_queue, handler)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+
+def _stop_listener():
+    """Write out what is still queued when the process exits"""
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+
+
+def get_logger():
+    """The app's logger, writing through the queue; configured on first use"""
+    global _logger, _queue, _sample_rates_by_view
+    with _setup_lock:
+        if _logger is None:
+            _queue = _new_queue()
+            _sample_rates_by_view = _sample_rates()
+            logger = logging.getLogger(LOGGER_NAME)
+            logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+            logger.addHandler(NonBlockingQueueHandler(_queue))
+            logger.propagate = False
+            atexit.register(_stop_listener)
+            _logger = logger
+        return _logger
+
+
+def _endpoint():
+    try:
+        from flask import has_request_context, request
+    except ImportError:
+        return None
+    if has_request_context() and request.endpoint:
+        return request.endpoint
+    return None
+
+
+def log_response(response, endpoint=None, level=logging.INFO):
+    """Log a Plaid response, subject to the level and the endpoint's sample rate.
+
+    `endpoint` defaults to the Flask endpoint of the current request; its
+    view name selects the RESPONSE_LOG_SAMPLE_<VIEW> override.
+    """
+    logger = get_logger()
+    if not logger.isEnabledFor(level):
+        return
+    endpoint = endpoint or _endpoint()
+    view = endpoint.rsplit('.', 1)[-1] if endpoint else None
+    rate = _sample_rates_by_view.get(view, float(os.getenv('RESPONSE_LOG_SAMPLE', '1')))
+    if rate < 1 and random.random() >= rate:
+        _count('sampled_out')
+        return
+    _count('logged')
+    logger.log(level, 'Plaid response', extra={'payload': response, 'endpoint': endpoint})
+
+
+def log_stats():
+    """Responses logged, sampled out and dropped, and records written and still queued"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['queued'] = _queue.qsize() if _queue is not None else 0
+    stats['level'] = logging.getLevelName(get_logger().level)
+    return stats
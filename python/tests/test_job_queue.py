@@ -0,0 +1,80 @@
+"""complete/fail/defer/requeue_stale against a scripted cursor; no database is needed"""
+
+import pytest
+
+import job_queue
+
+
+class FakeCursor:
+    """Reports `rowcount` rows changed by every statement"""
+
+    def __init__(self, rowcount):
+        self.rowcount = rowcount
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.commits = 0
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+JOB = {'id': 7, 'attempts': 1, 'max_attempts': 5}
+
+
+def test_complete_records_outcome_of_held_job():
+    cur = FakeCursor(rowcount=1)
+    job_queue.complete(FakeConnection(cur), 7, 'host:1:worker-0')
+    sql, params = cur.executed[0]
+    assert 'locked_by = %s' in sql
+    assert params == (7, 'host:1:worker-0')
+
+
+def test_complete_raises_job_lost_when_lock_moved():
+    with pytest.raises(job_queue.JobLost) as lost:
+        job_queue.complete(FakeConnection(FakeCursor(rowcount=0)), 7, 'host:1:worker-0')
+    assert lost.value.job_id == 7
+    assert lost.value.worker_id == 'host:1:worker-0'
+
+
+def test_fail_raises_job_lost_when_lock_moved():
+    with pytest.raises(job_queue.JobLost):
+        job_queue.fail(FakeConnection(FakeCursor(rowcount=0)), JOB, 'boom', 'host:1:worker-0')
+
+
+def test_defer_raises_job_lost_when_lock_moved():
+    with pytest.raises(job_queue.JobLost):
+        job_queue.defer(FakeConnection(FakeCursor(rowcount=0)), JOB, 30, 'busy', 'host:1:worker-0')
+
+
+def test_fail_dead_letters_last_attempt():
+    cur = FakeCursor(rowcount=1)
+    job = dict(JOB, attempts=5)
+    assert job_queue.fail(FakeConnection(cur), job, 'boom', 'host:1:worker-0')
+    sql, params = cur.executed[0]
+    assert "SET status = 'dead'" in sql
+    assert params['worker_id'] == 'host:1:worker-0'
+
+
+def test_requeue_stale_finishes_dead_jobs():
+    cur = FakeCursor(rowcount=2)
+    assert job_queue.requeue_stale(FakeConnection(cur), visibility_timeout=60) == 2
+    sql, params = cur.executed[0]
+    assert 'finished_at = CASE' in sql
+    assert '{superseded}' not in sql
+    assert params == {'timeout': 60}
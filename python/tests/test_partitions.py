@@ -0,0 +1,80 @@
+"""migrate_table against a scripted cursor; no database is needed"""
+
+from datetime import date, datetime
+
+import partitions
+
+
+class FakeCursor:
+    """Answers the queries migrate_table makes for a plain, non-empty table"""
+
+    def __init__(self, columns, first, last):
+        self.columns = columns
+        self.bounds = {'first': first, 'last': last}
+        self.executed = []
+        self.rowcount = 0
+        self._row = None
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        self.rowcount = 1
+        if 'relkind' in sql:
+            self._row = None
+        elif 'COUNT(*) AS missing' in sql:
+            self._row = {'missing': 0}
+        elif 'MIN(' in sql:
+            self._row = self.bounds
+        elif 'to_regclass(%s) IS NOT NULL' in sql:
+            self._row = {'present': False}
+        elif 'pg_get_serial_sequence' in sql:
+            self._row = {'sequence': None}
+        else:
+            self._row = None
+
+    def fetchone(self):
+        return self._row
+
+    def fetchall(self):
+        return [{'column_name': name} for name in self.columns]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        pass
+
+
+def copied_ranges(cur):
+    return [params for sql, params in cur.executed if 'FOR SHARE' in sql]
+
+
+def test_periods_accepts_timestamps():
+    periods = list(partitions._periods(datetime(2024, 1, 31, 23, 59), datetime(2024, 3, 1, 8, 0), 'month'))
+    assert periods == [
+        (date(2024, 1, 1), date(2024, 2, 1)),
+        (date(2024, 2, 1), date(2024, 3, 1)),
+        (date(2024, 3, 1), date(2024, 4, 1)),
+    ]
+
+
+def test_migrate_non_empty_balance_history(monkeypatch):
+    monkeypatch.setenv('BALANCE_HISTORY_PARTITION_INTERVAL', 'month')
+    # recorded_at is a TIMESTAMP, so its bounds come back as datetimes
+    cur = FakeCursor(['id', 'account_id', 'recorded_at'], datetime(2024, 1, 15, 9, 30), datetime(2024, 3, 2, 18, 0))
+
+    assert partitions.migrate_table(FakeConnection(cur), partitions.BALANCE_HISTORY, log=lambda message: None)
+    assert copied_ranges(cur) == [
+        (date(2024, 1, 1), date(2024, 2, 1)),
+        (date(2024, 2, 1), date(2024, 3, 1)),
+        (date(2024, 3, 1), date(2024, 4, 1)),
+    ]
+    attached = [params[0] for sql, params in cur.executed if 'ATTACH PARTITION' in sql]
+    assert attached[0] == date(2024, 1, 1)
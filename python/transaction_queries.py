@@ -0,0 +1,145 @@
+"""
+Paginated reads of stored transactions.
+
+Transactions are returned newest first, ordered by (date, transaction_id),
+and paged with a keyset cursor: each page ends with an opaque cursor holding
+the last row's (date, transaction_id), and the next page seeks past it with a
+row comparison. Unlike OFFSET, a deep page costs the same as the first one
+and rows inserted by a concurrent sync never shift a page.
+
+Each filter is served by a composite index ending in
+(date DESC, transaction_id DESC) (see partitions.TABLES), so a page is an
+index range scan that stops after `limit` rows. raw_data is only read when
+asked for.
+
+Usage:
+    filters = transaction_queries.filters_from_args(request.args)
+    page = transaction_queries.query_transactions(conn, filters, cursor, limit=100)
+    page['transactions'], page['next_cursor']
+"""
+
+import base64
+import json
+from datetime import date
+from decimal import Decimal
+
+from transaction_writer import TRANSACTION_COLUMNS
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# Columns returned by default; raw_data is large and only sent on request
+COLUMNS = tuple(column for column in TRANSACTION_COLUMNS if column not in ('raw_data', 'content_hash'))
+
+
+def encode_cursor(row):
+    payload = json.dumps([row['date'].isoformat(), row['transaction_id']])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """(date, transaction_id) of a cursor; raises ValueError if it is malformed"""
+    try:
+        last_date, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return date.fromisoformat(last_date), str(last_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f'Invalid cursor: {cursor!r}') from e
+
+
+def _parse_bool(value):
+    if value.lower() in ('true', '1', 'yes'):
+        return True
+    if value.lower() in ('false', '0', 'no'):
+        return False
+    raise ValueError(f'Expected true or false, got {value!r}')
+
+
+def filters_from_args(args):
+    """Build query filters from request arguments; raises ValueError on bad input"""
+    filters = {}
+    account_ids = args.getlist('account_id')
+    if account_ids:
+        filters['account_ids'] = account_ids
+    if args.get('item_id'):
+        filters['item_id'] = args['item_id']
+    if args.get('start_date'):
+        filters['start_date'] = date.fromisoformat(args['start_date'])
+    if args.get('end_date'):
+        filters['end_date'] = date.fromisoformat(args['end_date'])
+    if args.get('category'):
+        filters['category'] = args['category']
+    if args.get('merchant'):
+        filters['merchant'] = args['merchant']
+    try:
+        if args.get('min_amount'):
+            filters['min_amount'] = Decimal(args['min_amount'])
+        if args.get('max_amount'):
+            filters['max_amount'] = Decimal(args['max_amount'])
+    except ArithmeticError as e:
+        raise ValueError('min_amount and max_amount must be numbers') from e
+    if args.get('pending'):
+        filters['pending'] = _parse_bool(args['pending'])
+    return filters
+
+
+def query_transactions(conn, filters, cursor=None, limit=DEFAULT_LIMIT, include_raw=False):
+    """One page of transactions matching `filters`, newest first.
+
+    Returns {'transactions': [...], 'next_cursor': str or None}.
+    """
+    limit = max(1, min(int(limit), MAX_LIMIT))
+
+    conditions = []
+    params = {'limit': limit + 1}
+
+    if 'account_ids' in filters:
+        conditions.append('account_id = ANY(%(account_ids)s)')
+        params['account_ids'] = list(filters['account_ids'])
+    if 'item_id' in filters:
+        conditions.append('account_id IN (SELECT account_id FROM financial_accounts WHERE item_id = %(item_id)s)')
+        params['item_id'] = filters['item_id']
+    if 'start_date' in filters:
+        conditions.append('date >= %(start_date)s')
+        params['start_date'] = filters['start_date']
+    if 'end_date' in filters:
+        conditions.append('date <= %(end_date)s')
+        params['end_date'] = filters['end_date']
+    if 'category' in filters:
+        conditions.append('personal_finance_category_primary = %(category)s')
+        params['category'] = filters['category']
+    if 'merchant' in filters:
+        conditions.append('merchant_name = %(merchant)s')
+        params['merchant'] = filters['merchant']
+    if 'min_amount' in filters:
+        conditions.append('amount >= %(min_amount)s')
+        params['min_amount'] = filters['min_amount']
+    if 'max_amount' in filters:
+        conditions.append('amount <= %(max_amount)s')
+        params['max_amount'] = filters['max_amount']
+    if 'pending' in filters:
+        conditions.append('pending = %(pending)s')
+        params['pending'] = filters['pending']
+    if cursor:
+        params['last_date'], params['last_id'] = decode_cursor(cursor)
+        conditions.append('(date, transaction_id) < (%(last_date)s, %(last_id)s)')
+
+    columns = COLUMNS + ('raw_data',) if include_raw else COLUMNS
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    cur = conn.cursor()
+    cur.execute(f'''
+        SELECT {', '.join(columns)}
+        FROM financial_transactions
+        {where}
+        ORDER BY date DESC, transaction_id DESC
+        LIMIT %(limit)s
+    ''', params)
+    rows = cur.fetchall()
+    cur.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'transactions': [dict(row) for row in rows],
+        'next_cursor': encode_cursor(rows[-1]) if has_more else None,
+    }
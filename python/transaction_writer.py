@@ -0,0 +1,377 @@
+"""
+Batched transaction writer for the financial_transactions table.
+
+Instead of one INSERT ... ON CONFLICT and one commit per transaction, rows are
+streamed into a temporary staging table with COPY and merged into
+financial_transactions with a single set-based upsert per batch. Removed
+transactions are deleted with a single set-based DELETE. Rows whose
+content_hash is unchanged are left alone, and the writers count how many rows
+were actually written versus skipped. Every write also folds its changes into
+the spending aggregates (see spending_aggregates.py) in the same transaction.
+
+Usage:
+    writer = TransactionBatchWriter(conn)
+    writer.upsert_many(response['added'])
+    writer.upsert_many(response['modified'])
+    writer.remove_many(response['removed'])
+    writer.flush()
+
+For /transactions/sync pagination, StagedTransactionSync writes every page to
+a per-item staging area as it arrives and promotes the staged pages together
+with the new cursor in one transaction once has_more is false:
+
+    staged = StagedTransactionSync(conn, item_id)
+    staged.reset()
+    while has_more:
+        ...
+        staged.stage_page(response)
+    staged.promote(cursor)
+"""
+
+import io
+import json
+import os
+from datetime import date, datetime
+
+import partitions
+import spending_aggregates
+from row_hash import content_hash
+
+TRANSACTION_COLUMNS = (
+    'transaction_id', 'account_id', 'amount', 'iso_currency_code', 'unofficial_currency_code',
+    'date', 'datetime', 'authorized_date', 'authorized_datetime',
+    'name', 'merchant_name', 'merchant_entity_id', 'logo_url', 'website',
+    'payment_channel', 'pending', 'pending_transaction_id', 'account_owner',
+    'transaction_code', 'transaction_type', 'category_id',
+    'personal_finance_category_primary', 'personal_finance_category_detailed',
+    'personal_finance_category_confidence', 'personal_finance_category_icon_url',
+    'location_address', 'location_city', 'location_region', 'location_postal_code',
+    'location_country', 'location_lat', 'location_lon', 'location_store_number',
+    'payment_meta_reference_number', 'payment_meta_ppd_id', 'payment_meta_payee',
+    'payment_meta_by_order_of', 'payment_meta_payer', 'payment_meta_payment_method',
+    'payment_meta_payment_processor', 'payment_meta_reason',
+    'counterparties', 'raw_data', 'content_hash',
+)
+
+# Columns refreshed when an existing transaction is upserted again
+UPDATE_COLUMNS = (
+    'amount', 'name', 'merchant_name', 'pending',
+    'personal_finance_category_primary', 'personal_finance_category_detailed',
+    'raw_data', 'content_hash',
+)
+
+STAGING_TABLE = 'transaction_batch_staging'
+
+# Persistent (unlogged) table holding pages of in-progress syncs, see init_db
+SYNC_STAGING_TABLE = 'transaction_sync_staging'
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def transaction_row(txn_data):
+    """Map a Plaid transaction dict to a tuple ordered like TRANSACTION_COLUMNS"""
+    location = txn_data.get('location', {}) or {}
+    payment_meta = txn_data.get('payment_meta', {}) or {}
+    personal_finance_category = txn_data.get('personal_finance_category', {}) or {}
+
+    return (
+        txn_data.get('transaction_id'),
+        txn_data.get('account_id'),
+        txn_data.get('amount'),
+        txn_data.get('iso_currency_code'),
+        txn_data.get('unofficial_currency_code'),
+        txn_data.get('date'),
+        txn_data.get('datetime'),
+        txn_data.get('authorized_date'),
+        txn_data.get('authorized_datetime'),
+        txn_data.get('name'),
+        txn_data.get('merchant_name'),
+        txn_data.get('merchant_entity_id'),
+        txn_data.get('logo_url'),
+        txn_data.get('website'),
+        txn_data.get('payment_channel'),
+        txn_data.get('pending'),
+        txn_data.get('pending_transaction_id'),
+        txn_data.get('account_owner'),
+        txn_data.get('transaction_code'),
+        txn_data.get('transaction_type'),
+        txn_data.get('category_id'),
+        personal_finance_category.get('primary'),
+        personal_finance_category.get('detailed'),
+        personal_finance_category.get('confidence_level'),
+        personal_finance_category.get('icon_url'),
+        location.get('address'),
+        location.get('city'),
+        location.get('region'),
+        location.get('postal_code'),
+        location.get('country'),
+        location.get('lat'),
+        location.get('lon'),
+        location.get('store_number'),
+        payment_meta.get('reference_number'),
+        payment_meta.get('ppd_id'),
+        payment_meta.get('payee'),
+        payment_meta.get('by_order_of'),
+        payment_meta.get('payer'),
+        payment_meta.get('payment_method'),
+        payment_meta.get('payment_processor'),
+        payment_meta.get('reason'),
+        json.dumps(txn_data.get('counterparties'), default=str) if txn_data.get('counterparties') else None,
+        json.dumps(txn_data, default=str),
+        content_hash(txn_data)
+    )
+
+
+def _copy_value(value):
+    """Encode a single value for COPY ... FROM STDIN in text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def copy_rows(cur, table, columns, rows):
+    """Stream rows into a table with COPY"""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(_copy_value(value) for value in row))
+        buf.write('\n')
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+def _create_staging_table(cur):
+    cur.execute(f'''
+        CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE}
+        ON COMMIT DELETE ROWS
+        AS SELECT {', '.join(TRANSACTION_COLUMNS)} FROM financial_transactions
+        WITH NO DATA
+    ''')
+    cur.execute(f'TRUNCATE {STAGING_TABLE}')
+
+
+def merge_staged_transactions(cur, source, params=None):
+    """Upsert every row of `source` (aliased `staged`) into financial_transactions.
+
+    Existing rows with the same content_hash are not touched; returns the
+    number of rows inserted or updated.
+    """
+    columns = ', '.join(TRANSACTION_COLUMNS)
+    updates = ',\n            '.join(f'{column} = EXCLUDED.{column}' for column in UPDATE_COLUMNS)
+    tracked = ', '.join(spending_aggregates.TRACKED_COLUMNS)
+    existing_tracked = ', '.join(f'existing.{column}' for column in spending_aggregates.TRACKED_COLUMNS)
+
+    # The table is keyed (and partitioned) by (transaction_id, date), so make
+    # sure the partitions exist and drop the old row of any transaction whose
+    # date moved, e.g. when a pending transaction posts on a later day
+    partitions.ensure_partitions_for(cur, partitions.TRANSACTIONS, source, params)
+
+    # Take the old versions of rows about to change out of the aggregates
+    spending_aggregates.start_deltas(cur)
+    spending_aggregates.capture(cur, -1, f'''
+        SELECT {existing_tracked}
+        FROM financial_transactions existing
+        JOIN {source} ON existing.transaction_id = staged.transaction_id
+        WHERE existing.content_hash IS DISTINCT FROM staged.content_hash
+           OR existing.date IS DISTINCT FROM staged.date
+    ''', params)
+
+    cur.execute(f'''
+        DELETE FROM financial_transactions existing
+        USING {source}
+        WHERE existing.transaction_id = staged.transaction_id
+          AND existing.date IS DISTINCT FROM staged.date
+    ''', params)
+
+    # ...and add the versions actually written
+    written = spending_aggregates.capture(cur, 1, f'''
+        INSERT INTO financial_transactions ({columns})
+        SELECT {columns} FROM {source}
+        ON CONFLICT (transaction_id, date) DO UPDATE SET
+            {updates},
+            updated_at = CURRENT_TIMESTAMP
+        WHERE financial_transactions.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+        RETURNING {tracked}
+    ''', params)
+    spending_aggregates.apply_deltas(cur)
+    return written
+
+
+def delete_transactions(cur, transaction_ids):
+    """Delete a set of transactions in one statement"""
+    spending_aggregates.start_deltas(cur)
+    deleted = spending_aggregates.capture(cur, -1, f'''
+        DELETE FROM financial_transactions WHERE transaction_id = ANY(%s)
+        RETURNING {', '.join(spending_aggregates.TRACKED_COLUMNS)}
+    ''', (list(transaction_ids),))
+    spending_aggregates.apply_deltas(cur)
+    return deleted
+
+
+class TransactionBatchWriter:
+    """Buffers transaction upserts and removals and writes them in batches"""
+
+    def __init__(self, conn, batch_size=None):
+        self.conn = conn
+        self.batch_size = batch_size or int(os.getenv('TRANSACTION_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+        self._upserts = {}
+        self._removed = set()
+        self.upserted = 0
+        self.written = 0
+        self.skipped = 0
+        self.removed = 0
+
+    def upsert(self, txn_data):
+        # Later versions of the same transaction replace earlier ones, since
+        # a single INSERT ... ON CONFLICT cannot touch the same row twice
+        self._upserts[txn_data['transaction_id']] = transaction_row(txn_data)
+        if len(self._upserts) >= self.batch_size:
+            self.flush()
+
+    def upsert_many(self, transactions):
+        for txn in transactions:
+            self.upsert(txn)
+
+    def remove(self, transaction_id):
+        self._removed.add(transaction_id)
+        if len(self._removed) >= self.batch_size:
+            self.flush()
+
+    def remove_many(self, removed):
+        """Queue removals from a Plaid `removed` list"""
+        for txn in removed:
+            self.remove(txn['transaction_id'])
+
+    def flush(self, commit=True):
+        """Write all buffered changes; commits once unless commit=False"""
+        if not self._upserts and not self._removed:
+            return
+
+        cur = self.conn.cursor()
+        if self._upserts:
+            _create_staging_table(cur)
+            copy_rows(cur, STAGING_TABLE, TRANSACTION_COLUMNS, self._upserts.values())
+            written = merge_staged_transactions(cur, f'{STAGING_TABLE} AS staged')
+            self.upserted += len(self._upserts)
+            self.written += written
+            self.skipped += len(self._upserts) - written
+        if self._removed:
+            delete_transactions(cur, self._removed)
+            self.removed += len(self._removed)
+        cur.close()
+
+        if commit:
+            self.conn.commit()
+        self._upserts = {}
+        self._removed = set()
+
+
+class StagedTransactionSync:
+    """Stages /transactions/sync pages for one item and promotes them atomically.
+
+    Each page is copied into transaction_sync_staging and committed as soon as
+    it arrives, so memory stays flat however large the item is. Nothing in
+    financial_transactions or sync_cursors changes until promote(), which
+    merges the staged pages and saves the new cursor in a single transaction.
+    If the process dies mid-pagination the stored cursor is untouched and the
+    next run discards the leftover pages with reset().
+    """
+
+    def __init__(self, conn, item_id):
+        self.conn = conn
+        self.item_id = item_id
+        self.added = 0
+        self.modified = 0
+        self.removed = 0
+        self.written = 0
+        self.skipped = 0
+
+    def reset(self):
+        """Discard pages left behind by an interrupted sync of this item"""
+        cur = self.conn.cursor()
+        cur.execute(f'DELETE FROM {SYNC_STAGING_TABLE} WHERE item_id = %s', (self.item_id,))
+        self.conn.commit()
+        cur.close()
+        self.added = 0
+        self.modified = 0
+        self.removed = 0
+        self.written = 0
+        self.skipped = 0
+
+    def stage_page(self, response):
+        """Copy one /transactions/sync response page into the staging area"""
+        padding = (None,) * (len(TRANSACTION_COLUMNS) - 1)
+        rows = [
+            (self.item_id, False) + transaction_row(txn)
+            for txn in response['added'] + response['modified']
+        ]
+        rows.extend(
+            (self.item_id, True, txn['transaction_id']) + padding
+            for txn in response['removed']
+        )
+
+        if rows:
+            cur = self.conn.cursor()
+            copy_rows(cur, SYNC_STAGING_TABLE, ('item_id', 'removed') + TRANSACTION_COLUMNS, rows)
+            self.conn.commit()
+            cur.close()
+
+        self.added += len(response['added'])
+        self.modified += len(response['modified'])
+        self.removed += len(response['removed'])
+
+    def promote(self, cursor):
+        """Apply the staged pages and save the new cursor in one transaction"""
+        columns = ', '.join(TRANSACTION_COLUMNS)
+        cur = self.conn.cursor()
+
+        # A transaction can be staged on several pages, e.g. removed on one and
+        # added again on a later one; its latest staged row decides whether it
+        # is upserted or deleted
+        latest = f'''
+            SELECT DISTINCT ON (transaction_id) removed, {columns}
+            FROM {SYNC_STAGING_TABLE}
+            WHERE item_id = %s
+            ORDER BY transaction_id, staging_id DESC
+        '''
+
+        cur.execute(f'SELECT COUNT(*) AS staged FROM ({latest}) AS latest WHERE NOT removed', (self.item_id,))
+        staged = cur.fetchone()['staged']
+
+        self.written = merge_staged_transactions(cur, f'''(
+            SELECT {columns} FROM ({latest}) AS latest
+            WHERE NOT removed
+        ) AS staged''', (self.item_id,))
+        self.skipped = staged - self.written
+        spending_aggregates.start_deltas(cur)
+        spending_aggregates.capture(cur, -1, f'''
+            DELETE FROM financial_transactions
+            WHERE transaction_id IN (
+                SELECT transaction_id FROM ({latest}) AS latest
+                WHERE removed
+            )
+            RETURNING {', '.join(spending_aggregates.TRACKED_COLUMNS)}
+        ''', (self.item_id,))
+        spending_aggregates.apply_deltas(cur)
+
+        if cursor:
+            cur.execute('''
+                INSERT INTO sync_cursors (item_id, cursor, last_synced_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (item_id) DO UPDATE SET
+                    cursor = EXCLUDED.cursor,
+                    last_synced_at = CURRENT_TIMESTAMP
+            ''', (self.item_id, cursor))
+
+        cur.execute(f'DELETE FROM {SYNC_STAGING_TABLE} WHERE item_id = %s', (self.item_id,))
+        self.conn.commit()
+        cur.close()